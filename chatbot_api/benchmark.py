@@ -0,0 +1,95 @@
+"""Benchmark API startup: import time and time to the first served request.
+
+Every run starts a fresh Python process that imports chatbot_api.main, runs the
+lifespan hook (including the warm-up) and serves one request through the ASGI
+app in process. Without --question the request is GET /stats; with a question it
+is POST /chat-with-history, which needs the provider API keys:
+
+    python -m chatbot_api.benchmark --runs 5
+    python -m chatbot_api.benchmark --runs 5 --no-warm-up --question "Hola"
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def measure_startup(question: Optional[str]) -> Dict[str, Any]:
+    """Import the app, start it and serve one request, timing each step."""
+    started_at = time.perf_counter()
+    import chatbot_api.main as main
+
+    imported_at = time.perf_counter()
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        ready_at = time.perf_counter()
+        if question:
+            response = client.post(
+                "/chat-with-history",
+                json={"question": question, "session_id": "startup-benchmark"},
+            )
+        else:
+            response = client.get("/stats")
+        served_at = time.perf_counter()
+    return {
+        "import_seconds": imported_at - started_at,
+        "lifespan_seconds": ready_at - imported_at,
+        "first_request_seconds": served_at - ready_at,
+        "time_to_first_request_seconds": served_at - started_at,
+        "status_code": response.status_code,
+        "startup": main.get_startup_stats(),
+    }
+
+
+def run_child(question: Optional[str], warm_up: bool) -> Dict[str, Any]:
+    """Measure startup in a fresh process, so no module is imported yet."""
+    command = [sys.executable, "-m", "chatbot_api.benchmark", "--child"]
+    if question:
+        command += ["--question", question]
+    env = {**os.environ, "STARTUP_WARM_UP": "true" if warm_up else "false"}
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--question", default=None)
+    parser.add_argument("--no-warm-up", dest="warm_up", action="store_false")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_startup(args.question)))
+        return
+
+    results: List[Dict[str, Any]] = []
+    for run in range(args.runs):
+        result = run_child(args.question, args.warm_up)
+        results.append(result)
+        logger.info(f"Run {run + 1}: {json.dumps(result)}")
+    for key in (
+        "import_seconds",
+        "lifespan_seconds",
+        "first_request_seconds",
+        "time_to_first_request_seconds",
+    ):
+        values = [result[key] for result in results]
+        logger.info(
+            f"{key}: median {statistics.median(values):.3f}s, "
+            f"min {min(values):.3f}s, max {max(values):.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,11 @@
 from .chain import * # noqa
+from .budget import PromptBudget, count_tokens
+from .complexity import ComplexityRouter, classify_question
+from .cache import LRUMemo, MemoizedRunnable, SemanticCache
+from .embeddings import CachedQueryEmbeddings, get_cached_query_embeddings
+from .hedging import HedgedFallbacks, ProviderHealth
 from .memory import ChatMemory
+from .selection import DiverseRetriever
+from .speculative import SpeculativeRetrieval
 from .session import SessionManager
+from .structured import StockQuery, StructuredStockRetriever, parse_stock_query
@@ -0,0 +1,93 @@
+"""Benchmark the per-request cost of preparing the chat history for the chain.
+
+Compares the dict round trip (ChatMemory.get_history(), ChatRequest validation and
+serialize_history building new message objects) with the cached path
+(ChatMemory.get_messages(), passed through by serialize_history). No model is
+called, so only the history handling is measured.
+
+By default the memory is filled up to the cap SessionManager gives every session
+(10 messages), which is what requests actually see:
+
+    python -m chatbot_api.chains.benchmark
+
+Larger --max-messages values use memories uncapped beyond what the API keeps, to
+show how both paths scale with longer histories:
+
+    python -m chatbot_api.chains.benchmark --max-messages 10 100 1000
+"""
+
+import argparse
+import logging
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from chatbot_api.chains.chain import ChatRequest, serialize_history
+from chatbot_api.chains.memory import ChatMemory
+from chatbot_api.chains.session import SessionManager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def time_calls(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Call func repeatedly and return latency percentiles in microseconds."""
+    latencies = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started_at) * 1e6)
+    latencies.sort()
+    return {
+        "p50_us": statistics.median(latencies),
+        "p95_us": latencies[int(0.95 * (len(latencies) - 1))],
+        "mean_us": statistics.fmean(latencies),
+    }
+
+
+def build_memory(max_messages: int) -> ChatMemory:
+    """Return a memory filled with question and answer turns up to max_messages."""
+    memory = ChatMemory(max_messages=max_messages)
+    for turn in range((max_messages + 1) // 2):
+        memory.add_turn(
+            f"Question {turn}: ¿tienen autos con CarPlay por menos de 15 millones?",
+            f"Answer {turn}: sí, tenemos varios modelos disponibles en stock.",
+        )
+    return memory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--max-messages", type=int, nargs="+", default=[SessionManager().max_messages]
+    )
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for max_messages in args.max_messages:
+        memory = build_memory(max_messages)
+
+        def dict_round_trip() -> List:
+            request = ChatRequest(question="hola", chat_history=memory.get_history())
+            return serialize_history({"chat_history": request.chat_history})
+
+        def cached_messages() -> List:
+            return serialize_history({"chat_history": memory.get_messages()})
+
+        results = {
+            "dict_round_trip": time_calls(dict_round_trip, args.repeat),
+            "cached_messages": time_calls(cached_messages, args.repeat),
+        }
+        speedup = results["dict_round_trip"]["p50_us"] / results["cached_messages"]["p50_us"]
+        for name, stats in results.items():
+            logger.info(
+                f"{max_messages} messages, {name}: p50 {stats['p50_us']:.1f}us, "
+                f"p95 {stats['p95_us']:.1f}us, mean {stats['mean_us']:.1f}us"
+            )
+        logger.info(
+            f"{max_messages} messages: cached messages are {speedup:.1f}x faster at p50"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Token budget for the response prompt.
+
+The response prompt holds the system prompt, the chat history, the question and
+the retrieved documents, and nothing else bounds its size: a long conversation or
+a few 4000 character CSV chunks make every request slower and more expensive.
+PromptBudget counts tokens locally with tiktoken and fits the prompt into
+PROMPT_MAX_TOKENS before the response is generated:
+
+- The system prompt and the question are always kept.
+- The history gets at most PROMPT_HISTORY_MAX_TOKENS; the oldest messages are
+  dropped first.
+- The documents get whatever is left, in retrieval order. Once a document no
+  longer fits it is truncated, and the lower ranked documents after it are dropped.
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat format around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Tokens added around every document by format_docs' <doc> tags
+DOC_OVERHEAD_TOKENS = 8
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(os.environ.get("PROMPT_TOKEN_ENCODING", "cl100k_base"))
+        except Exception as e:
+            # tiktoken downloads the encoding on first use; estimate if it can't
+            _encoding_failed = True
+            logger.warning(f"Token encoding unavailable, estimating 4 characters per token: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens, estimated from the length if tiktoken is unavailable.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most max_tokens tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[: max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+class PromptBudget:
+    """Fits chat history and retrieved documents into a prompt token budget."""
+
+    def __init__(
+        self,
+        system_prompt: str,
+        max_tokens: int = 6000,
+        max_history_tokens: int = 1500,
+        min_doc_tokens: int = 50,
+    ):
+        """Initialize the budget.
+
+        Args:
+            system_prompt (str): The system prompt template; its {context}
+                placeholder is filled with the documents.
+            max_tokens (int): Maximum tokens of the whole prompt.
+            max_history_tokens (int): Maximum tokens of the chat history.
+            min_doc_tokens (int): A document is dropped rather than truncated to
+                fewer tokens than this.
+        """
+        self.max_tokens = max_tokens
+        self.max_history_tokens = max_history_tokens
+        self.min_doc_tokens = min_doc_tokens
+        self.system_prompt = system_prompt
+        # Counted on first use, loading the token encoding may download it
+        self._system_tokens: Optional[int] = None
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.dropped_messages = 0
+        self.truncated_docs = 0
+        self.dropped_docs = 0
+        self.prompt_tokens = 0
+        self.saved_tokens = 0
+
+    @property
+    def system_tokens(self) -> int:
+        """Tokens of the system prompt without the documents."""
+        if self._system_tokens is None:
+            self._system_tokens = (
+                count_tokens(self.system_prompt.replace("{context}", "")) + MESSAGE_OVERHEAD_TOKENS
+            )
+        return self._system_tokens
+
+    @classmethod
+    def from_env(cls, system_prompt: str) -> "PromptBudget":
+        """Create a budget configured by PROMPT_* environment variables."""
+        return cls(
+            system_prompt,
+            max_tokens=int(os.environ.get("PROMPT_MAX_TOKENS", "6000")),
+            max_history_tokens=int(os.environ.get("PROMPT_HISTORY_MAX_TOKENS", "1500")),
+            min_doc_tokens=int(os.environ.get("PROMPT_MIN_DOC_TOKENS", "50")),
+        )
+
+    def fit_history(
+        self, messages: Sequence[BaseMessage], budget: int
+    ) -> Tuple[List[BaseMessage], int, int]:
+        """Keep the newest messages that fit in the budget.
+
+        Returns:
+            Tuple[List[BaseMessage], int, int]: The kept messages, their tokens and
+                the tokens of all messages.
+        """
+        kept: List[BaseMessage] = []
+        used = total = 0
+        full = False
+        for message in reversed(messages):
+            tokens = count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+            total += tokens
+            if not full and used + tokens <= budget:
+                kept.append(message)
+                used += tokens
+            else:
+                # Keep the history contiguous: nothing older than a dropped message
+                full = True
+        kept.reverse()
+        return kept, used, total
+
+    def fit_docs(self, docs: Sequence[Document], budget: int) -> Tuple[List[Document], int, int, int]:
+        """Keep documents in rank order, truncating the first one that overflows.
+
+        Returns:
+            Tuple[List[Document], int, int, int]: The kept documents, their tokens,
+                the tokens of all documents and the number of truncated documents.
+        """
+        kept: List[Document] = []
+        used = total = truncated = 0
+        for doc in docs:
+            tokens = count_tokens(doc.page_content) + DOC_OVERHEAD_TOKENS
+            total += tokens
+            remaining = budget - used
+            if tokens <= remaining:
+                kept.append(doc)
+                used += tokens
+            elif remaining - DOC_OVERHEAD_TOKENS >= self.min_doc_tokens:
+                content = truncate_tokens(doc.page_content, remaining - DOC_OVERHEAD_TOKENS)
+                # Retrieved documents may be shared with caches, so copy instead of editing
+                kept.append(Document(page_content=content, metadata=doc.metadata))
+                used += count_tokens(content) + DOC_OVERHEAD_TOKENS
+                truncated += 1
+        return kept, used, total, truncated
+
+    def apply(self, input: Dict[str, Any]) -> Dict[str, Any]:
+        """Trim the chat history and documents of a chain input to the budget.
+
+        Args:
+            input (Dict[str, Any]): Chain input with "question", "chat_history"
+                (message objects) and "docs".
+
+        Returns:
+            Dict[str, Any]: The input with the trimmed "chat_history" and "docs".
+        """
+        question_tokens = count_tokens(input["question"]) + MESSAGE_OVERHEAD_TOKENS
+        available = max(0, self.max_tokens - self.system_tokens - question_tokens)
+        messages = input.get("chat_history") or []
+        history, history_tokens, all_history_tokens = self.fit_history(
+            messages, min(self.max_history_tokens, available)
+        )
+        docs = input.get("docs") or []
+        kept_docs, context_tokens, all_context_tokens, truncated = self.fit_docs(
+            docs, available - history_tokens
+        )
+        prompt_tokens = self.system_tokens + question_tokens + history_tokens + context_tokens
+        saved = all_history_tokens - history_tokens + all_context_tokens - context_tokens
+        dropped_messages = len(messages) - len(history)
+        dropped_docs = len(docs) - len(kept_docs)
+
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.saved_tokens += saved
+        self.dropped_messages += dropped_messages
+        self.truncated_docs += truncated
+        self.dropped_docs += dropped_docs
+        if saved:
+            self.trimmed_requests += 1
+        logger.info(
+            f"Prompt budget {prompt_tokens}/{self.max_tokens} tokens: "
+            f"system {self.system_tokens}, question {question_tokens}, "
+            f"history {history_tokens}/{all_history_tokens} ({dropped_messages} messages dropped), "
+            f"context {context_tokens}/{all_context_tokens} "
+            f"({truncated} docs truncated, {dropped_docs} dropped)"
+        )
+        return {**input, "chat_history": history, "docs": kept_docs}
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the budget and how often prompts had to be trimmed."""
+        return {
+            "max_tokens": self.max_tokens,
+            "max_history_tokens": self.max_history_tokens,
+            "system_tokens": self.system_tokens,
+            "requests": self.requests,
+            "trimmed_requests": self.trimmed_requests,
+            "dropped_messages": self.dropped_messages,
+            "truncated_docs": self.truncated_docs,
+            "dropped_docs": self.dropped_docs,
+            "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0.0,
+            "saved_tokens": self.saved_tokens,
+        }
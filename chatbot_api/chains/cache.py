@@ -0,0 +1,484 @@
+"""Caches used by the answer chain.
+
+The semantic answer cache stores answers under the embedding of the standalone
+question. A new question whose embedding is close enough (cosine similarity above
+a threshold) to a stored one reuses the stored answer, skipping retrieval and
+generation entirely. Answers are only reused for requests that selected the same
+model.
+
+The LRU memo caches exact results of deterministic steps, such as rephrasing a
+follow up question, keyed on a stable digest of their input.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.utils import ConfigurableFieldSpec, get_unique_config_specs
+
+from chatbot_api.ingests.version import get_index_version
+
+
+class LRUMemo:
+    """Bounded, TTL-evicting mapping used to memoize exact results."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        """Initialize the memo.
+
+        Args:
+            max_size (int): Maximum number of remembered results.
+            ttl (float): Seconds a result stays valid after it was stored.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the remembered result for a key, or None.
+
+        Args:
+            key (Hashable): The memo key.
+
+        Returns:
+            Optional[Any]: The result, or None if missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Remember a result for a key.
+
+        Args:
+            key (Hashable): The memo key.
+            value (Any): The result to remember.
+        """
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget every result."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit and size counters for the memo."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def history_digest(input: Dict[str, Any], config: Optional[RunnableConfig] = None) -> str:
+    """Return a stable digest of the chat history, question and configurable fields.
+
+    Args:
+        input (Dict[str, Any]): Chain input with ``question`` and ``chat_history``,
+            the history holding either message objects or role dicts.
+        config (Optional[RunnableConfig]): The run config; its configurable fields,
+            such as the selected model, are part of the digest.
+
+    Returns:
+        str: The hex digest.
+    """
+    history = [
+        [message.type, message.content] if hasattr(message, "content") else message
+        for message in input.get("chat_history") or []
+    ]
+    payload = json.dumps(
+        {
+            "history": history,
+            "question": input.get("question"),
+            "configurable": (config or {}).get("configurable", {}),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoizedRunnable(Runnable[Any, Any]):
+    """Wraps a runnable and remembers its output for repeated inputs."""
+
+    def __init__(
+        self,
+        runnable: Runnable,
+        memo: LRUMemo,
+        key_func: Callable[[Any, Optional[RunnableConfig]], Hashable] = history_digest,
+    ):
+        self.runnable = runnable
+        self.memo = memo
+        self.key_func = key_func
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return self.runnable.config_specs
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    def _invoke(
+        self,
+        input: Any,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Any:
+        key = self.key_func(input, config)
+        output = self.memo.get(key)
+        if output is None:
+            output = self.runnable.invoke(input, config, **kwargs)
+            self.memo.set(key, output)
+        return output
+
+    async def _ainvoke(
+        self,
+        input: Any,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Any:
+        key = self.key_func(input, config)
+        output = self.memo.get(key)
+        if output is None:
+            output = await self.runnable.ainvoke(input, config, **kwargs)
+            self.memo.set(key, output)
+        return output
+
+
+class _CacheEntry:
+    """A cached answer and the data needed to evict it; the vector is a matrix row."""
+    __slots__ = ("answer", "latency", "size")
+
+    def __init__(self, answer: str, latency: float, size: int):
+        self.answer = answer
+        self.latency = latency
+        self.size = size
+
+
+def model_namespace(config: Optional[RunnableConfig] = None) -> str:
+    """Return the cache namespace of the model selected in a run config.
+
+    Answers generated by one model are only served to requests that selected the
+    same one through the ``llm`` configurable field.
+    """
+    return str(((config or {}).get("configurable") or {}).get("llm", "default"))
+
+
+class SemanticCache:
+    """LRU, TTL-evicting cache of answers keyed on question embeddings.
+
+    The normalized question vectors are rows of one matrix that grows by doubling
+    up to max_entries rows. Rows are written when an answer is stored and freed
+    when it is evicted, so a lookup is a single matrix-vector product without
+    copying the vectors.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        version_check_interval: float = 5.0,
+    ):
+        """Initialize the cache.
+
+        Args:
+            threshold (float): Minimum cosine similarity for a cache hit.
+            max_entries (int): Maximum number of cached answers.
+            max_bytes (int): Approximate memory budget for vectors and answers.
+            ttl (float): Seconds an answer stays valid after it was stored.
+            version_check_interval (float): Seconds between checks of the index
+                version stamp written by ingestion.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        # Row -> entry, least recently used first
+        self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        # Namespace id of each row, -1 for free rows
+        self._row_namespaces = np.empty(0, dtype=np.int32)
+        self._expires_at = np.empty(0, dtype=np.float64)
+        self._namespaces: Dict[str, int] = {}
+        self._free_rows: List[int] = []
+        self._used_rows = 0
+        self._bytes = 0
+        self._index_version = get_index_version()
+        self._version_checked_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.latency_saved = 0.0
+
+    @classmethod
+    def from_env(cls) -> "SemanticCache":
+        """Create a cache configured from ANSWER_CACHE_* environment variables."""
+        return cls(
+            threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95")),
+            max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.environ.get("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl=float(os.environ.get("ANSWER_CACHE_TTL", "3600")),
+        )
+
+    def lookup(self, vector: List[float], namespace: str = "default") -> Optional[str]:
+        """Return the cached answer for the closest stored question, if close enough.
+
+        Args:
+            vector (List[float]): The embedding of the standalone question.
+            namespace (str): Only answers stored in this namespace are considered,
+                see model_namespace.
+
+        Returns:
+            Optional[str]: The cached answer, or None on a miss.
+        """
+        self._check_index_version()
+        self._expire()
+        namespace_id = self._namespaces.get(namespace)
+        if not self._entries or namespace_id is None or len(vector) != self._matrix.shape[1]:
+            self.misses += 1
+            return None
+        query = self._normalize(vector)
+        used = self._used_rows
+        scores = self._matrix[:used] @ query
+        scores[self._row_namespaces[:used] != namespace_id] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        entry = self._entries[best]
+        self._entries.move_to_end(best)
+        self.hits += 1
+        self.latency_saved += entry.latency
+        return entry.answer
+
+    def store(
+        self, vector: List[float], answer: str, latency: float, namespace: str = "default"
+    ) -> None:
+        """Store an answer under a question embedding.
+
+        Args:
+            vector (List[float]): The embedding of the standalone question.
+            answer (str): The generated answer.
+            latency (float): Seconds it took to generate the answer.
+            namespace (str): The namespace the answer is served in.
+        """
+        normalized = self._normalize(vector)
+        size = normalized.nbytes + len(answer.encode("utf-8"))
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        if self._matrix is not None and self._matrix.shape[1] != len(normalized):
+            # A different embedding model, the stored vectors are not comparable
+            self.clear()
+            self._matrix = None
+        while self._entries and (
+            len(self._entries) >= self.max_entries or self._bytes + size > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+        row = self._allocate_row(len(normalized))
+        self._matrix[row] = normalized
+        self._row_namespaces[row] = self._namespaces.setdefault(namespace, len(self._namespaces))
+        self._expires_at[row] = time.monotonic() + self.ttl
+        self._entries[row] = _CacheEntry(answer, latency, size)
+        self._bytes += size
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        self._entries.clear()
+        self._row_namespaces[:] = -1
+        self._expires_at[:] = np.inf
+        self._free_rows = []
+        self._used_rows = 0
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, size and latency counters for the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "matrix_rows": len(self._matrix) if self._matrix is not None else 0,
+            "namespaces": len(self._namespaces),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "latency_saved_seconds": self.latency_saved,
+        }
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _allocate_row(self, dim: int) -> int:
+        """Return a free matrix row, growing the matrix when every row is used."""
+        if self._free_rows:
+            return self._free_rows.pop()
+        capacity = len(self._matrix) if self._matrix is not None else 0
+        if self._used_rows == capacity:
+            new_capacity = min(self.max_entries, max(16, capacity * 2))
+            matrix = np.zeros((new_capacity, dim), dtype=np.float32)
+            namespaces = np.full(new_capacity, -1, dtype=np.int32)
+            expires_at = np.full(new_capacity, np.inf)
+            if self._matrix is not None:
+                matrix[:capacity] = self._matrix
+                namespaces[:capacity] = self._row_namespaces
+                expires_at[:capacity] = self._expires_at
+            self._matrix, self._row_namespaces, self._expires_at = matrix, namespaces, expires_at
+        self._used_rows += 1
+        return self._used_rows - 1
+
+    def _remove(self, row: int) -> None:
+        """Evict the entry in a row and free the row."""
+        self._bytes -= self._entries.pop(row).size
+        self._row_namespaces[row] = -1
+        self._expires_at[row] = np.inf
+        self._free_rows.append(row)
+
+    def _expire(self) -> None:
+        """Drop entries whose TTL has passed."""
+        if not self._entries:
+            return
+        for row in np.flatnonzero(self._expires_at[: self._used_rows] <= time.monotonic()):
+            self._remove(int(row))
+
+    def _check_index_version(self) -> None:
+        """Clear the cache when ingestion has written a new index version."""
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        version = get_index_version()
+        if version != self._index_version:
+            self._index_version = version
+            self.invalidations += 1
+            self.clear()
+
+
+class SemanticCacheRunnable(Runnable[Dict[str, Any], str]):
+    """Runs a question chain, then answers from the cache or the answer chain.
+
+    The question chain must return the input dict with a ``standalone_question``
+    key added; that dict is passed on to the answer chain on a cache miss.
+    """
+
+    def __init__(
+        self,
+        question_chain: Runnable,
+        answer_chain: Runnable,
+        embeddings: Embeddings,
+        cache: SemanticCache,
+    ):
+        self.question_chain = question_chain
+        self.answer_chain = answer_chain
+        self.embeddings = embeddings
+        self.cache = cache
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return get_unique_config_specs(
+            self.question_chain.config_specs + self.answer_chain.config_specs
+        )
+
+    def invoke(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> str:
+        return "".join(self.stream(input, config, **kwargs))
+
+    async def ainvoke(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> str:
+        return "".join([chunk async for chunk in self.astream(input, config, **kwargs)])
+
+    def stream(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[str]:
+        yield from self._transform_stream_with_config(iter([input]), self._stream, config)
+
+    async def astream(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        async def inputs() -> AsyncIterator[Dict[str, Any]]:
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(inputs(), self._astream, config):
+            yield chunk
+
+    def _stream(
+        self,
+        inputs: Iterator[Dict[str, Any]],
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+    ) -> Iterator[str]:
+        input = next(inputs)
+        prepared = self.question_chain.invoke(input, config)
+        vector = self.embeddings.embed_query(prepared["standalone_question"])
+        namespace = model_namespace(config)
+        cached = self.cache.lookup(vector, namespace)
+        if cached is not None:
+            yield cached
+            return
+        started_at = time.perf_counter()
+        chunks = []
+        for chunk in self.answer_chain.stream(prepared, config):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.store(
+            vector, "".join(chunks), time.perf_counter() - started_at, namespace
+        )
+
+    async def _astream(
+        self,
+        inputs: AsyncIterator[Dict[str, Any]],
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+    ) -> AsyncIterator[str]:
+        input = await inputs.__anext__()
+        prepared = await self.question_chain.ainvoke(input, config)
+        vector = await self.embeddings.aembed_query(prepared["standalone_question"])
+        namespace = model_namespace(config)
+        cached = self.cache.lookup(vector, namespace)
+        if cached is not None:
+            yield cached
+            return
+        started_at = time.perf_counter()
+        chunks = []
+        async for chunk in self.answer_chain.astream(prepared, config):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.store(
+            vector, "".join(chunks), time.perf_counter() - started_at, namespace
+        )
@@ -1,23 +1,22 @@
-"""This module contains the main application logic for the chatbot API.
+"""This module contains the answer chain of the chatbot API.
 
-It sets up the FastAPI application, configures middleware, and defines the API routes.
-It also contains the logic for creating and configuring the language model and retriever.
+It contains the logic for creating and configuring the language model and retriever.
+Providers and the retriever are built lazily on first use, or ahead of the first
+request by warm_up(), so importing this module makes no network connections.
 """
 
+import logging
 import os
-import weaviate
 
 from operator import itemgetter
-from typing import Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 from chatbot_api.constants import WEAVIATE_DOCS_INDEX_NAME
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from chatbot_api.ingests import get_embeddings_model
-from langchain_anthropic import ChatAnthropic
+from chatbot_api.ingests import StockTable, get_embeddings_model
 from langchain_community.vectorstores import Weaviate
 from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import LanguageModelLike
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import (
     ChatPromptTemplate,
@@ -35,11 +34,28 @@ from langchain_core.runnables import (
     RunnableSequence,
     chain,
 )
-from langchain_fireworks import ChatFireworks
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
-from langsmith import Client
 from chatbot_api.prompts import SALES_AGENT_RESPONSE_TEMPLATE
+from chatbot_api.vectorstores import LocalVectorStore, get_vector_store_connection
+from chatbot_api.chains.budget import PromptBudget
+from chatbot_api.chains.cache import (
+    LRUMemo,
+    MemoizedRunnable,
+    SemanticCache,
+    SemanticCacheRunnable,
+)
+from chatbot_api.chains.embeddings import get_cached_query_embeddings
+from chatbot_api.chains.complexity import ComplexityRouter, RoutedResponseSynthesizer
+from chatbot_api.chains.hedging import HedgedFallbacks, get_provider_health
+from chatbot_api.chains.lazy import LazyRunnable
+from chatbot_api.chains.speculative import (
+    SpeculativeRetrieval,
+    SpeculativeRetrievalRunnable,
+)
+from chatbot_api.chains.selection import DiverseRetriever, get_weaviate_candidate_search
+from chatbot_api.chains.structured import StructuredStockRetriever
+
+logger = logging.getLogger(__name__)
 
 RESPONSE_TEMPLATE = SALES_AGENT_RESPONSE_TEMPLATE
 
@@ -55,18 +71,6 @@ Follow Up Input: {question}
 Standalone Question:"""
 
 
-client = Client()
-
-app = FastAPI()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-)
-
 
 class ChatRequest(BaseModel):
     """Model for the chat request.
@@ -81,39 +85,62 @@ class ChatRequest(BaseModel):
         arbitrary_types_allowed = True
 
 
-def get_retriever() -> BaseRetriever:
+def get_retriever(embeddings: Optional[Embeddings] = None) -> BaseRetriever:
     """Create and return a retriever.
 
     This function creates a Weaviate retriever with the appropriate configuration and returns it.
+    When VECTOR_STORE is "local", the in-process LocalVectorStore written by ingestion is used instead.
+    Weaviate is reached through the shared, pooled connection configured by WEAVIATE_* variables.
+    Unless CONTEXT_SELECTION is disabled, the top k search is replaced by a DiverseRetriever
+    that deduplicates over-fetched candidates and picks a diverse subset.
+
+    Args:
+        embeddings (Optional[Embeddings]): The model used to embed queries.
+            Defaults to get_embeddings_model().
 
     Returns:
         BaseRetriever: The created retriever.
     """
-    weaviate_client = weaviate.Client(url="http://weaviate:8080")
-    weaviate_client = Weaviate(
-        client=weaviate_client,
+    embeddings = embeddings or get_embeddings_model()
+    selection = os.environ.get("CONTEXT_SELECTION", "true").lower() == "true"
+    if os.environ.get("VECTOR_STORE", "weaviate").lower() == "local":
+        vectorstore = LocalVectorStore.from_env(embeddings, WEAVIATE_DOCS_INDEX_NAME)
+        if selection:
+            return DiverseRetriever.from_env(
+                embeddings, vectorstore.similarity_search_with_vectors
+            )
+        return vectorstore.as_retriever(search_kwargs=dict(k=6))
+    connection = get_vector_store_connection()
+    text_key = "text"
+    attributes = ["source", "title"]
+    if selection:
+        search, asearch = get_weaviate_candidate_search(
+            connection, WEAVIATE_DOCS_INDEX_NAME, text_key, attributes
+        )
+        return DiverseRetriever.from_env(embeddings, search, asearch)
+    vectorstore = Weaviate(
+        client=connection.client,
         index_name=WEAVIATE_DOCS_INDEX_NAME,
-        text_key="text",
-        embedding=get_embeddings_model(),
+        text_key=text_key,
+        embedding=embeddings,
         by_text=False,
-        attributes=["source", "title"],
+        attributes=attributes,
     )
-    return weaviate_client.as_retriever(search_kwargs=dict(k=6))
+    return vectorstore.as_retriever(search_kwargs=dict(k=6))
 
 
-def create_retriever_chain(
-    llm: LanguageModelLike, retriever: BaseRetriever
+def create_rephrase_chain(
+    llm: LanguageModelLike, memo: Optional[LRUMemo] = None
 ) -> Runnable:
-    """Create and return a retriever chain.
-
-    This function creates a retriever chain with the given language model and retriever, and returns it.
+    """Create and return the chain that rephrases a follow up question.
 
     Args:
-        llm (LanguageModelLike): The language model to use in the chain.
-        retriever (BaseRetriever): The retriever to use in the chain.
+        llm (LanguageModelLike): The language model used to rephrase the question.
+        memo (Optional[LRUMemo]): Memo for rephrased questions, keyed on a digest
+            of the history and question.
 
     Returns:
-        Runnable: The created retriever chain.
+        Runnable: The created chain.
     """
     CONDENSE_QUESTION_PROMPT = PromptTemplate.from_template(REPHRASE_TEMPLATE)
     condense_question_chain = (
@@ -121,23 +148,62 @@ def create_retriever_chain(
     ).with_config(
         run_name="CondenseQuestion",
     )
-    conversation_chain = condense_question_chain | retriever
+    if memo is not None:
+        condense_question_chain = MemoizedRunnable(condense_question_chain, memo)
+    return condense_question_chain
+
+
+def create_condense_question_chain(
+    llm: LanguageModelLike, memo: Optional[LRUMemo] = None
+) -> Runnable:
+    """Create and return a chain that turns the question into a standalone question.
+
+    With chat history the follow up question is rephrased by the language model,
+    otherwise the question is used as is. When a memo is given, rephrased questions
+    are remembered by a digest of the history and question, so repeated turns skip
+    the extra language model call.
+
+    Args:
+        llm (LanguageModelLike): The language model used to rephrase the question.
+        memo (Optional[LRUMemo]): Memo for rephrased questions.
+
+    Returns:
+        Runnable: The created chain.
+    """
+    condense_question_chain = create_rephrase_chain(llm, memo=memo)
     return RunnableBranch(
         (
             RunnableLambda(lambda x: bool(x.get("chat_history"))).with_config(
                 run_name="HasChatHistoryCheck"
             ),
-            conversation_chain.with_config(run_name="RetrievalChainWithHistory"),
+            condense_question_chain,
+        ),
+        RunnableLambda(itemgetter("question")).with_config(
+            run_name="Itemgetter:question"
         ),
-        (
-            RunnableLambda(itemgetter("question")).with_config(
-                run_name="Itemgetter:question"
-            )
-            | retriever
-        ).with_config(run_name="RetrievalChainWithNoHistory"),
     ).with_config(run_name="RouteDependingOnChatHistory")
 
 
+def create_retriever_chain(
+    llm: LanguageModelLike,
+    retriever: BaseRetriever,
+    condense_memo: Optional[LRUMemo] = None,
+) -> Runnable:
+    """Create and return a retriever chain.
+
+    This function creates a retriever chain with the given language model and retriever, and returns it.
+
+    Args:
+        llm (LanguageModelLike): The language model to use in the chain.
+        retriever (BaseRetriever): The retriever to use in the chain.
+        condense_memo (Optional[LRUMemo]): Memo for rephrased questions.
+
+    Returns:
+        Runnable: The created retriever chain.
+    """
+    return create_condense_question_chain(llm, memo=condense_memo) | retriever
+
+
 def format_docs(docs: Sequence[Document]) -> str:
     """Format the given documents into a string.
 
@@ -160,6 +226,8 @@ def serialize_history(request: ChatRequest):
     """Serialize the chat history in the given request.
 
     This function takes a chat request and serializes its chat history into a list of HumanMessage and AIMessage objects.
+    A history that already holds message objects, as returned by ChatMemory.get_messages(),
+    is passed through without conversion.
 
     Args:
         request (ChatRequest): The chat request containing the chat history to serialize.
@@ -168,6 +236,8 @@ def serialize_history(request: ChatRequest):
         list: The serialized chat history.
     """
     chat_history = request["chat_history"] or []
+    if chat_history and isinstance(chat_history[0], BaseMessage):
+        return chat_history
     converted_chat_history = []
     for message in chat_history:
         if message.get("human") is not None:
@@ -177,28 +247,77 @@ def serialize_history(request: ChatRequest):
     return converted_chat_history
 
 
-def create_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
+def create_chain(
+    llm: LanguageModelLike,
+    retriever: BaseRetriever,
+    answer_cache: Optional[SemanticCache] = None,
+    embeddings: Optional[Embeddings] = None,
+    condense_memo: Optional[LRUMemo] = None,
+    speculative_retrieval: Optional[SpeculativeRetrieval] = None,
+    prompt_budget: Optional[PromptBudget] = None,
+    strong_llm: Optional[LanguageModelLike] = None,
+    complexity_router: Optional[ComplexityRouter] = None,
+) -> Runnable:
     """Create and return a chain with the given language model and retriever.
 
     This function creates a chain with the given language model and retriever, and returns it.
+    When an answer cache is given, answers are looked up by the embedding of the
+    standalone question before retrieval and generation run. With speculative retrieval,
+    documents for the raw question are fetched while a follow up is being rephrased.
+    With a prompt budget, the history and documents are trimmed to fit it before the
+    response is generated. With a strong language model and a complexity router, the
+    default response synthesizer sends complex questions to the strong model and
+    everything else to llm; selecting another provider bypasses the router.
 
     Args:
         llm (LanguageModelLike): The language model to use in the chain.
         retriever (BaseRetriever): The retriever to use in the chain.
+        answer_cache (Optional[SemanticCache]): Cache of answers keyed on question embeddings.
+        embeddings (Optional[Embeddings]): The model used to embed questions for the cache.
+        condense_memo (Optional[LRUMemo]): Memo for rephrased questions.
+        speculative_retrieval (Optional[SpeculativeRetrieval]): Settings and counters
+            that enable speculative retrieval.
+        prompt_budget (Optional[PromptBudget]): Token budget for the response prompt.
+        strong_llm (Optional[LanguageModelLike]): The language model for complex questions.
+        complexity_router (Optional[ComplexityRouter]): Classifies questions and records
+            routing decisions and latency.
 
     Returns:
         Runnable: The created chain.
     """
-    retriever_chain = create_retriever_chain(
-        llm,
-        retriever,
-    ).with_config(run_name="FindDocs")
-
-    context = (
-        RunnablePassthrough.assign(docs=retriever_chain)
-        .assign(context=lambda x: format_docs(x["docs"]))
-        .with_config(run_name="RetrieveDocs")
+    fit_budget = (
+        RunnableLambda(prompt_budget.apply).with_config(run_name="PromptBudget")
+        if prompt_budget is not None
+        else RunnablePassthrough()
     )
+    prepare_history = RunnablePassthrough.assign(chat_history=serialize_history)
+    if speculative_retrieval is not None:
+        # Retrieval runs together with the rephrase, so docs are already in the input
+        question_chain = prepare_history | SpeculativeRetrievalRunnable(
+            create_rephrase_chain(llm, memo=condense_memo),
+            retriever,
+            speculative_retrieval,
+        ).with_config(run_name="FindDocs")
+        context = (
+            fit_budget
+            | RunnablePassthrough.assign(context=lambda x: format_docs(x["docs"]))
+        ).with_config(run_name="RetrieveDocs")
+    else:
+        question_chain = prepare_history | RunnablePassthrough.assign(
+            standalone_question=create_condense_question_chain(llm, memo=condense_memo)
+        )
+        retriever_chain = (
+            RunnableLambda(itemgetter("standalone_question")).with_config(
+                run_name="Itemgetter:standalone_question"
+            )
+            | retriever
+        ).with_config(run_name="FindDocs")
+
+        context = (
+            RunnablePassthrough.assign(docs=retriever_chain)
+            | fit_budget
+            | RunnablePassthrough.assign(context=lambda x: format_docs(x["docs"]))
+        ).with_config(run_name="RetrieveDocs")
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", RESPONSE_TEMPLATE),
@@ -208,6 +327,15 @@ def create_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
     )
 
     default_response_synthesizer = prompt | llm
+    routed_response_synthesizer = (
+        RoutedResponseSynthesizer(
+            router=complexity_router,
+            fast=default_response_synthesizer,
+            strong=prompt | strong_llm,
+        ).with_config(run_name="RouteByComplexity")
+        if strong_llm is not None and complexity_router is not None
+        else default_response_synthesizer
+    )
 
     cohere_prompt = ChatPromptTemplate.from_messages(
         [
@@ -222,7 +350,7 @@ def create_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
         return cohere_prompt | llm.bind(source_documents=input["docs"])
 
     response_synthesizer = (
-        default_response_synthesizer.configurable_alternatives(
+        routed_response_synthesizer.configurable_alternatives(
             ConfigurableField("llm"),
             default_key="openai_gpt_3_5_turbo",
             anthropic_claude_3_haiku=default_response_synthesizer,
@@ -233,44 +361,199 @@ def create_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
         | StrOutputParser()
     ).with_config(run_name="GenerateResponse")
 
-    return (
-        RunnablePassthrough.assign(chat_history=serialize_history)
-        | context
-        | response_synthesizer
+    if answer_cache is not None:
+        return SemanticCacheRunnable(
+            question_chain,
+            context | response_synthesizer,
+            embeddings or get_embeddings_model(),
+            answer_cache,
+        )
+    return question_chain | context | response_synthesizer
+
+
+def _build_gpt_3_5() -> Runnable:
+    return ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0, streaming=True)
+
+
+def _build_strong_llm() -> Runnable:
+    return ChatOpenAI(
+        model=os.environ.get("STRONG_LLM_MODEL", "gpt-4o"), temperature=0, streaming=True
     )
 
 
-gpt_3_5 = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0, streaming=True)
-claude_3_haiku = ChatAnthropic(
-    model="claude-3-haiku-20240307",
-    temperature=0,
-    max_tokens=4096,
-    anthropic_api_key=os.environ.get("ANTHROPIC_API_KEY", "not_provided"),
-)
-fireworks_mixtral = ChatFireworks(
-    model="accounts/fireworks/models/mixtral-8x7b-instruct",
-    temperature=0,
-    max_tokens=16384,
-    fireworks_api_key=os.environ.get("FIREWORKS_API_KEY", "not_provided"),
-)
-gemini_pro = ChatGoogleGenerativeAI(
-    model="gemini-pro",
-    temperature=0,
-    max_tokens=16384,
-    convert_system_message_to_human=True,
-    google_api_key=os.environ.get("GOOGLE_API_KEY", "not_provided"),
-)
+def _build_claude_3_haiku() -> Runnable:
+    # Provider SDKs are imported on first use, they dominate the import time
+    from langchain_anthropic import ChatAnthropic
+
+    return ChatAnthropic(
+        model="claude-3-haiku-20240307",
+        temperature=0,
+        max_tokens=4096,
+        anthropic_api_key=os.environ.get("ANTHROPIC_API_KEY", "not_provided"),
+    )
+
+
+def _build_fireworks_mixtral() -> Runnable:
+    from langchain_fireworks import ChatFireworks
+
+    return ChatFireworks(
+        model="accounts/fireworks/models/mixtral-8x7b-instruct",
+        temperature=0,
+        max_tokens=16384,
+        fireworks_api_key=os.environ.get("FIREWORKS_API_KEY", "not_provided"),
+    )
+
+
+def _build_gemini_pro() -> Runnable:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-pro",
+        temperature=0,
+        max_tokens=16384,
+        convert_system_message_to_human=True,
+        google_api_key=os.environ.get("GOOGLE_API_KEY", "not_provided"),
+    )
+
+
+def build_retriever() -> BaseRetriever:
+    """Create the retriever used to answer questions.
+
+    Attribute questions (price, km, year, make, model, features) are answered from
+    the columnar stock table instead of vector similarity over CSV rows.
+
+    Returns:
+        BaseRetriever: The created retriever.
+    """
+    retriever = get_retriever(query_embeddings)
+    if os.environ.get("STRUCTURED_STOCK_QUERIES", "true").lower() == "true":
+        stock_table = StockTable.from_env()
+        if stock_table is not None:
+            retriever = StructuredStockRetriever(table=stock_table, fallback=retriever)
+    return retriever
+
+
+gpt_3_5 = LazyRunnable.from_factory(_build_gpt_3_5, "openai_gpt_3_5_turbo")
+claude_3_haiku = LazyRunnable.from_factory(_build_claude_3_haiku, "anthropic_claude_3_haiku")
+fireworks_mixtral = LazyRunnable.from_factory(_build_fireworks_mixtral, "fireworks_mixtral")
+gemini_pro = LazyRunnable.from_factory(_build_gemini_pro, "google_gemini_pro")
+strong_llm = LazyRunnable.from_factory(_build_strong_llm, "openai_strong")
 cohere_command = None
-llm = gpt_3_5.configurable_alternatives(
+providers = [
+    ("openai_gpt_3_5_turbo", gpt_3_5),
+    ("anthropic_claude_3_haiku", claude_3_haiku),
+    ("fireworks_mixtral", fireworks_mixtral),
+    ("google_gemini_pro", gemini_pro),
+]
+# Latency and circuit breaker state of every provider, shared by the routers below
+provider_health = get_provider_health([name for name, _ in providers] + ["openai_strong"])
+
+
+def _fallbacks(ordered: List[Tuple[str, Runnable]]) -> Runnable:
+    """Return a runnable that calls the providers in order."""
+    if os.environ.get("LLM_HEDGING", "true").lower() == "true":
+        return HedgedFallbacks.from_env(ordered, provider_health)
+    return ordered[0][1].with_fallbacks([runnable for _, runnable in ordered])
+
+
+def _fallbacks_preferring(name: str) -> Runnable:
+    """Return a runnable that calls the named provider first, then the others in order."""
+    return _fallbacks(sorted(providers, key=lambda provider: provider[0] != name))
+
+
+llm = _fallbacks_preferring("openai_gpt_3_5_turbo").configurable_alternatives(
     # This gives this field an id
     # When configuring the end runnable, we can then use this id to configure this field
     ConfigurableField(id="llm"),
     default_key="openai_gpt_3_5_turbo",
-    anthropic_claude_3_haiku=claude_3_haiku,
-    fireworks_mixtral=fireworks_mixtral,
-    google_gemini_pro=gemini_pro,
+    anthropic_claude_3_haiku=_fallbacks_preferring("anthropic_claude_3_haiku"),
+    fireworks_mixtral=_fallbacks_preferring("fireworks_mixtral"),
+    google_gemini_pro=_fallbacks_preferring("google_gemini_pro"),
     # cohere_command=cohere_command,
-).with_fallbacks([gpt_3_5, claude_3_haiku, fireworks_mixtral, gemini_pro])
+)
+# Complex questions go to the strong model, falling back to the regular providers
+strong_llm_fallbacks = _fallbacks([("openai_strong", strong_llm)] + providers)
+
+# Identical standalone questions reuse their embedding instead of a new API call
+query_embeddings = get_cached_query_embeddings(get_embeddings_model())
+retriever = LazyRunnable.from_factory(build_retriever, "Retriever")
+answer_cache = (
+    SemanticCache.from_env()
+    if os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+    else None
+)
+# Shared so batch evaluation runs can build chains that reuse rephrased questions
+condense_question_memo = LRUMemo(
+    max_size=int(os.environ.get("CONDENSE_MEMO_SIZE", "1024")),
+    ttl=float(os.environ.get("CONDENSE_MEMO_TTL", "3600")),
+)
+speculative_retrieval = (
+    SpeculativeRetrieval.from_env()
+    if os.environ.get("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+    else None
+)
+prompt_budget = (
+    PromptBudget.from_env(RESPONSE_TEMPLATE)
+    if os.environ.get("PROMPT_BUDGET_ENABLED", "true").lower() == "true"
+    else None
+)
+complexity_router = (
+    ComplexityRouter.from_env()
+    if os.environ.get("MODEL_ROUTING", "false").lower() == "true"
+    else None
+)
+answer_chain = create_chain(
+    llm,
+    retriever,
+    answer_cache=answer_cache,
+    embeddings=query_embeddings,
+    condense_memo=condense_question_memo,
+    speculative_retrieval=speculative_retrieval,
+    prompt_budget=prompt_budget,
+    strong_llm=strong_llm_fallbacks,
+    complexity_router=complexity_router,
+)
+
+
+def warm_up() -> None:
+    """Build the retriever and the default language model ahead of the first request.
+
+    Failures are logged, reported in the startup stats and retried on first use,
+    so the API still starts when Weaviate or a provider is unavailable.
+    """
+    if prompt_budget is not None:
+        # Loads the token encoding
+        prompt_budget.system_tokens
+    for runnable in (retriever, gpt_3_5):
+        try:
+            runnable.lazy.get()
+        except Exception as e:
+            logger.warning(f"Error warming up {runnable.lazy.name}: {str(e)}")
+
+
+def get_startup_stats() -> Dict[str, Any]:
+    """Return which providers and retriever were built and how long each took."""
+    return {
+        runnable.lazy.name: runnable.lazy.stats()
+        for runnable in (
+            retriever, gpt_3_5, strong_llm, claude_3_haiku, fireworks_mixtral, gemini_pro
+        )
+    }
+
 
-retriever = get_retriever()
-answer_chain = create_chain(llm, retriever)
+def get_provider_stats() -> Dict[str, Any]:
+    """Return the latency, error and circuit breaker stats of every provider."""
+    return {name: health.stats() for name, health in provider_health.items()}
+
+
+def get_retriever_stats() -> Dict[str, Any]:
+    """Return the stats of the structured stock retriever and context selection, once built."""
+    served = retriever.lazy.peek()
+    structured = served if isinstance(served, StructuredStockRetriever) else None
+    selection = structured.fallback if structured is not None else served
+    return {
+        "structured_stock": structured.stats() if structured is not None else None,
+        "context_selection": (
+            selection.stats() if isinstance(selection, DiverseRetriever) else None
+        ),
+    }
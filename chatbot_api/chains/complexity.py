@@ -0,0 +1,248 @@
+"""Complexity-based routing between a fast and a strong language model.
+
+Most messages are greetings, FAQ-style questions or single facts that the fastest,
+cheapest model answers well; only questions comparing vehicles, stacking several
+constraints or asking for a recommendation need the stronger model.
+classify_question() scores a question with cheap local signals (English and
+Spanish), and RoutedResponseSynthesizer sends it to the matching tier. Decisions
+and per-tier latency are recorded so thresholds can be tuned from /stats.
+"""
+
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableSerializable
+
+logger = logging.getLogger(__name__)
+
+FAST = "fast"
+STRONG = "strong"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_NUMBER_RE = re.compile(r"\d[\d.,]*")
+_GREETING_RE = re.compile(
+    r"^\W*(?:hi|hello|hey|good (?:morning|afternoon|evening)|thanks?(?: you)?|bye|ok(?:ay)?|"
+    r"hola|buen[oa]s(?: d[ií]as| tardes| noches)?|gracias|muchas gracias|chau|chao|adi[oó]s|"
+    r"perfecto|genial|dale)\b",
+    re.IGNORECASE,
+)
+_COMPARISON_RE = re.compile(
+    r"\b(?:compare|comparison|versus|vs\.?|difference|differences|better|best|worse|"
+    r"recommend|recommendation|pros and cons|which one|"
+    r"comparar|compar[aá]|comparaci[oó]n|diferencia|diferencias|mejor|mejores|peor|"
+    r"recomend[aá]s|recomiendas|recomendaci[oó]n|recomienda|cu[aá]l conviene|conviene)\b",
+    re.IGNORECASE,
+)
+_REASONING_RE = re.compile(
+    r"\b(?:why|explain|financ\w*|installments?|trade[- ]in|"
+    r"por qu[eé]|explic\w*|cuotas?|permuta)\b",
+    re.IGNORECASE,
+)
+_CONSTRAINT_RE = re.compile(
+    r"\b(?:price|cost|km|kms|mileage|year|model|brand|make|color|fuel|automatic|manual|"
+    r"precio|cuesta|kil[oó]metros|a[nñ]o|modelo|marca|nafta|diesel|autom[aá]tico|"
+    r"carplay|bluetooth|under|over|between|menos|m[aá]s|entre|hasta|desde)\b",
+    re.IGNORECASE,
+)
+_CONJUNCTION_RE = re.compile(r"\b(?:and|or|but|y|o|pero|tambi[eé]n|also)\b", re.IGNORECASE)
+
+
+# Weight of each complexity signal; comparisons and recommendations alone are enough
+SIGNAL_WEIGHTS = {
+    "comparison": 2,
+    "reasoning": 1,
+    "constraints": 1,
+    "numbers": 1,
+    "multi_part": 1,
+    "long": 1,
+}
+
+
+def classify_question(
+    question: str, max_fast_words: int = 25, threshold: int = 2
+) -> Tuple[str, str]:
+    """Classify a question as fast or strong with local heuristics.
+
+    Short greetings and thanks always go to the fast tier. Otherwise the weights of
+    the signals found in the question are added up, and the strong tier is used from
+    the threshold on.
+
+    Args:
+        question (str): The (standalone) question.
+        max_fast_words (int): Longer questions count as a complexity signal.
+        threshold (int): Complexity score from which the strong tier is used.
+
+    Returns:
+        Tuple[str, str]: The tier and the reason, e.g. ("fast", "greeting") or
+            ("strong", "comparison+numbers").
+    """
+    words = _WORD_RE.findall(question)
+    if len(words) <= 6 and "?" not in question and _GREETING_RE.match(question):
+        return FAST, "greeting"
+    signals: List[str] = []
+    if _COMPARISON_RE.search(question):
+        signals.append("comparison")
+    if _REASONING_RE.search(question):
+        signals.append("reasoning")
+    if len(_CONSTRAINT_RE.findall(question)) >= 3:
+        signals.append("constraints")
+    if len(_NUMBER_RE.findall(question)) >= 2:
+        signals.append("numbers")
+    if question.count("?") >= 2 or len(_CONJUNCTION_RE.findall(question)) >= 2:
+        signals.append("multi_part")
+    if len(words) > max_fast_words:
+        signals.append("long")
+    score = sum(SIGNAL_WEIGHTS[signal] for signal in signals)
+    tier = STRONG if score >= threshold else FAST
+    return tier, "+".join(signals) or "simple"
+
+
+class ComplexityRouter:
+    """Routing settings, decisions and per-tier latency."""
+
+    def __init__(self, max_fast_words: int = 25, threshold: int = 2, window: int = 200):
+        """Initialize the router.
+
+        Args:
+            max_fast_words (int): Longer questions count as a complexity signal.
+            threshold (int): Complexity score from which the strong tier is used.
+            window (int): Number of recent latencies kept per tier.
+        """
+        self.max_fast_words = max_fast_words
+        self.threshold = threshold
+        self.decisions: Dict[str, int] = {}
+        self.tiers: Dict[str, Dict[str, Any]] = {
+            tier: {
+                "requests": 0,
+                "errors": 0,
+                "latencies": deque(maxlen=window),
+                "first_chunk_latencies": deque(maxlen=window),
+            }
+            for tier in (FAST, STRONG)
+        }
+
+    @classmethod
+    def from_env(cls) -> "ComplexityRouter":
+        """Create a router configured by MODEL_ROUTING_* environment variables."""
+        return cls(
+            max_fast_words=int(os.environ.get("MODEL_ROUTING_MAX_FAST_WORDS", "25")),
+            threshold=int(os.environ.get("MODEL_ROUTING_THRESHOLD", "2")),
+        )
+
+    def route(self, input: Dict[str, Any]) -> str:
+        """Pick the tier for a chain input and record the decision."""
+        question = input.get("standalone_question") or input["question"]
+        tier, reason = classify_question(question, self.max_fast_words, self.threshold)
+        key = f"{tier}:{reason}"
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        self.tiers[tier]["requests"] += 1
+        logger.info(f"Routing question to the {tier} model ({reason})")
+        return tier
+
+    def record(self, tier: str, seconds: float, first_chunk: Optional[float] = None) -> None:
+        """Record the latency of a response, and of its first chunk when streamed."""
+        self.tiers[tier]["latencies"].append(seconds)
+        if first_chunk is not None:
+            self.tiers[tier]["first_chunk_latencies"].append(first_chunk)
+
+    def record_error(self, tier: str) -> None:
+        """Record a failed response."""
+        self.tiers[tier]["errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return routing decisions by tier and reason, and per-tier latency."""
+        tiers = {}
+        for tier, data in self.tiers.items():
+            tiers[tier] = {"requests": data["requests"], "errors": data["errors"]}
+            for key in ("latencies", "first_chunk_latencies"):
+                if data[key]:
+                    values = np.fromiter(data[key], dtype=np.float64)
+                    name = key[: -len("latencies")]
+                    tiers[tier][f"{name}p50_seconds"] = float(np.quantile(values, 0.5))
+                    tiers[tier][f"{name}p95_seconds"] = float(np.quantile(values, 0.95))
+        return {
+            "threshold": self.threshold,
+            "decisions": dict(sorted(self.decisions.items())),
+            "tiers": tiers,
+        }
+
+
+class RoutedResponseSynthesizer(RunnableSerializable[Dict[str, Any], Any]):
+    """Sends each chain input to the fast or strong response synthesizer."""
+
+    router: ComplexityRouter
+    """Classifies inputs and records decisions and latency."""
+    fast: Runnable
+    """Response synthesizer for greetings, FAQ-style and single-fact questions."""
+    strong: Runnable
+    """Response synthesizer for complex questions."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _pick(self, input: Dict[str, Any]) -> Tuple[str, Runnable]:
+        tier = self.router.route(input)
+        return tier, self.strong if tier == STRONG else self.fast
+
+    def invoke(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        tier, runnable = self._pick(input)
+        started_at = time.perf_counter()
+        try:
+            output = runnable.invoke(input, config, **kwargs)
+        except Exception:
+            self.router.record_error(tier)
+            raise
+        self.router.record(tier, time.perf_counter() - started_at)
+        return output
+
+    async def ainvoke(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        tier, runnable = self._pick(input)
+        started_at = time.perf_counter()
+        try:
+            output = await runnable.ainvoke(input, config, **kwargs)
+        except Exception:
+            self.router.record_error(tier)
+            raise
+        self.router.record(tier, time.perf_counter() - started_at)
+        return output
+
+    def stream(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        tier, runnable = self._pick(input)
+        started_at = time.perf_counter()
+        first_chunk = None
+        try:
+            for chunk in runnable.stream(input, config, **kwargs):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started_at
+                yield chunk
+        except Exception:
+            self.router.record_error(tier)
+            raise
+        self.router.record(tier, time.perf_counter() - started_at, first_chunk)
+
+    async def astream(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        tier, runnable = self._pick(input)
+        started_at = time.perf_counter()
+        first_chunk = None
+        try:
+            async for chunk in runnable.astream(input, config, **kwargs):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started_at
+                yield chunk
+        except Exception:
+            self.router.record_error(tier)
+            raise
+        self.router.record(tier, time.perf_counter() - started_at, first_chunk)
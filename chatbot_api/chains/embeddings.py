@@ -0,0 +1,192 @@
+"""Query-embedding cache for the serving path.
+
+Every retrieval embeds the standalone question. Identical questions are common, so
+query embeddings are kept in an in-memory LRU, optionally backed by a SQLite file
+that survives restarts. Keys are namespaced by the embedding model name so that
+switching models never returns vectors from the old one.
+
+SQLite is never touched on the event loop: the async path reads it in a worker
+thread, and new vectors are written by a single background writer thread for both
+paths, so a request never waits for a commit.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that caches query embeddings."""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        max_size: int = 4096,
+        path: Optional[str] = None,
+        namespace: Optional[str] = None,
+    ):
+        """Initialize the cache.
+
+        Args:
+            underlying (Embeddings): The embeddings model to call on a miss.
+            max_size (int): Maximum number of query vectors kept in memory.
+            path (Optional[str]): SQLite file backing the cache. Memory only if None.
+            namespace (Optional[str]): Key prefix, defaults to the model name.
+        """
+        self.underlying = underlying
+        self.max_size = max_size
+        self.namespace = namespace or getattr(
+            underlying, "model", type(underlying).__name__
+        )
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Separate, so memory hits never wait for a disk read or write
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embeddings")
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._lookup_memory(key)
+        if vector is None and self._db is not None:
+            vector = self._lookup_disk(key)
+        if vector is None:
+            self.misses += 1
+            vector = self.underlying.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._lookup_memory(key)
+        if vector is None and self._db is not None:
+            vector = await asyncio.to_thread(self._lookup_disk, key)
+        if vector is None:
+            self.misses += 1
+            vector = await self.underlying.aembed_query(text)
+            self._store(key, vector)
+        return vector
+
+    def close(self) -> None:
+        """Finish the queued disk writes and close the SQLite file."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many embedding round trips were served from the cache."""
+        avoided = self.memory_hits + self.disk_hits
+        lookups = avoided + self.misses
+        return {
+            "namespace": self.namespace,
+            "entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "round_trips": self.misses,
+            "round_trips_avoided": avoided,
+            "hit_rate": avoided / lookups if lookups else 0.0,
+        }
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def _lookup_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return vector
+
+    def _lookup_disk(self, key: str) -> Optional[List[float]]:
+        """Read a vector from SQLite; blocking, so off the event loop in async code."""
+        with self._db_lock:
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute(
+                    "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading query embedding cache: {str(e)}")
+                return None
+        if row is None:
+            return None
+        vector = array("f", row[0]).tolist()
+        self._remember(key, vector)
+        self.disk_hits += 1
+        return vector
+
+    def _store(self, key: str, vector: List[float]) -> None:
+        self._remember(key, vector)
+        if self._writer is not None:
+            self._writer.submit(self._write, key, array("f", vector).tobytes())
+
+    def _write(self, key: str, blob: bytes) -> None:
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                    (key, blob),
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing query embedding cache: {str(e)}")
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+
+def get_cached_query_embeddings(underlying: Embeddings) -> CachedQueryEmbeddings:
+    """Wrap an embeddings model with a query cache configured from the environment.
+
+    Args:
+        underlying (Embeddings): The embeddings model to wrap.
+
+    Returns:
+        CachedQueryEmbeddings: The cached embeddings model.
+    """
+    return CachedQueryEmbeddings(
+        underlying,
+        max_size=int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "4096")),
+        path=os.environ.get("QUERY_EMBEDDING_CACHE_PATH") or None,
+    )
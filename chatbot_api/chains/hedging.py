@@ -0,0 +1,505 @@
+"""Latency-aware hedged fallbacks across language model providers.
+
+with_fallbacks() tries providers strictly one after another, and only after an
+exception, so a provider that hangs instead of failing stalls every request.
+HedgedFallbacks routes a call across providers in order of preference:
+
+- Every attempt has a deadline (LLM_DEADLINE); an attempt that misses it fails.
+  Streams must also deliver every following chunk within the deadline.
+- When the current attempt is slower than its provider's rolling latency
+  quantile (LLM_HEDGE_QUANTILE, p95 by default), the next provider is started
+  in parallel (a hedged request) and the first success wins; the others are
+  cancelled. Until enough latencies are known, LLM_HEDGE_DELAY is used.
+- A failure starts the next provider right away.
+- Each provider has a circuit breaker: after LLM_BREAKER_FAILURES consecutive
+  failures it is skipped for LLM_BREAKER_COOLDOWN seconds, then one trial call
+  decides whether it is healthy again.
+
+Streaming calls race for the first chunk and then stream from the winner.
+Provider latency, error and hedge counters are reported by ProviderHealth.stats().
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableSerializable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderHealth:
+    """Rolling latencies, error counters and circuit breaker of one provider."""
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 100,
+        min_samples: int = 20,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+    ):
+        """Initialize the provider's health.
+
+        Args:
+            name (str): Provider name, used in logs and stats.
+            window (int): Number of recent latencies kept per call type.
+            min_samples (int): Latencies needed before quantiles are used.
+            failure_threshold (int): Consecutive failures that open the breaker.
+            cooldown (float): Seconds the breaker stays open before a trial call.
+        """
+        self.name = name
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        # Total latency of invoke calls and time to first chunk of streams
+        self.latencies: Dict[str, deque] = {
+            "invoke": deque(maxlen=window),
+            "stream": deque(maxlen=window),
+        }
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "calls": 0,
+            "successes": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "hedges": 0,
+            "skipped": 0,
+            "breaker_opened": 0,
+        }
+
+    def acquire(self) -> bool:
+        """Return whether the provider may be called now, counting the call."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trial_in_flight):
+                self.counters["skipped"] += 1
+                return False
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = True
+            self.counters["calls"] += 1
+            return True
+
+    def record_success(self, seconds: float, kind: str) -> None:
+        with self._lock:
+            self.latencies[kind].append(seconds)
+            self.counters["successes"] += 1
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self, timeout: bool = False) -> None:
+        with self._lock:
+            self.counters["timeouts" if timeout else "errors"] += 1
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.counters["breaker_opened"] += 1
+                logger.warning(
+                    f"Circuit breaker for {self.name} opened after "
+                    f"{self.consecutive_failures} failures, skipping it for {self.cooldown}s"
+                )
+
+    def record_cancelled(self) -> None:
+        with self._lock:
+            self.counters["cancelled"] += 1
+            self._trial_in_flight = False
+
+    def record_hedge(self) -> None:
+        with self._lock:
+            self.counters["hedges"] += 1
+
+    def quantile(self, kind: str, q: float) -> Optional[float]:
+        """Return a latency quantile, or None until enough latencies are known."""
+        latencies = self.latencies[kind]
+        if len(latencies) < self.min_samples:
+            return None
+        return float(np.quantile(np.fromiter(latencies, dtype=np.float64), q))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the breaker state, counters and latency percentiles."""
+        latency = {}
+        for kind, latencies in self.latencies.items():
+            if latencies:
+                values = np.fromiter(latencies, dtype=np.float64)
+                latency[kind] = {
+                    "samples": len(values),
+                    "p50_seconds": float(np.quantile(values, 0.5)),
+                    "p95_seconds": float(np.quantile(values, 0.95)),
+                }
+        return {"state": self.state, **self.counters, "latency": latency}
+
+
+class HedgedFallbacks(RunnableSerializable[Any, Any]):
+    """Calls providers in order of preference with deadlines, hedging and breakers."""
+
+    providers: List[Tuple[str, Runnable]]
+    """Provider names and runnables, most preferred first."""
+    health: Dict[str, ProviderHealth]
+    """Health of every provider, may be shared between routers."""
+    deadline: float = 30.0
+    """Seconds an attempt may take before it fails."""
+    hedge_delay: float = 2.0
+    """Seconds before hedging while a provider's latency quantile is unknown."""
+    min_hedge_delay: float = 0.5
+    """Lower bound of the hedge delay."""
+    hedge_quantile: float = 0.95
+    """Latency quantile after which the next provider is started."""
+    max_parallel: int = 2
+    """Maximum attempts running at once."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_env(
+        cls, providers: List[Tuple[str, Runnable]], health: Dict[str, ProviderHealth]
+    ) -> "HedgedFallbacks":
+        """Create a router configured by LLM_* environment variables."""
+        return cls(
+            providers=providers,
+            health=health,
+            deadline=float(os.environ.get("LLM_DEADLINE", "30")),
+            hedge_delay=float(os.environ.get("LLM_HEDGE_DELAY", "2")),
+            min_hedge_delay=float(os.environ.get("LLM_MIN_HEDGE_DELAY", "0.5")),
+            hedge_quantile=float(os.environ.get("LLM_HEDGE_QUANTILE", "0.95")),
+            max_parallel=int(os.environ.get("LLM_MAX_PARALLEL", "2")),
+        )
+
+    def _hedge_after(self, name: str, kind: str) -> float:
+        quantile = self.health[name].quantile(kind, self.hedge_quantile)
+        return max(self.min_hedge_delay, self.hedge_delay if quantile is None else quantile)
+
+    def _candidates(self) -> Iterator[Tuple[str, Runnable]]:
+        acquired = False
+        for name, runnable in self.providers:
+            if self.health[name].acquire():
+                acquired = True
+                yield name, runnable
+        if not acquired:
+            # Every breaker is open: try the preferred provider rather than fail
+            name, runnable = self.providers[0]
+            self.health[name].counters["calls"] += 1
+            yield name, runnable
+
+    async def _arace(
+        self,
+        start: Callable[[Runnable], Awaitable[Any]],
+        kind: str,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Tuple[str, Any]:
+        """Run attempts until one succeeds, hedging slow ones.
+
+        Args:
+            start (Callable[[Runnable], Awaitable[Any]]): Starts an attempt.
+            kind (str): "invoke" or "stream", the latencies the attempt counts in.
+            discard (Optional[Callable[[Any], Awaitable[None]]]): Releases the
+                result of an attempt that succeeded but lost, e.g. closes a stream.
+
+        Returns:
+            Tuple[str, Any]: The winning provider and its result.
+        """
+        candidates = self._candidates()
+        pending: Dict[asyncio.Future, Tuple[str, float]] = {}
+        errors: List[BaseException] = []
+        exhausted = False
+
+        def launch() -> bool:
+            nonlocal exhausted
+            candidate = next(candidates, None)
+            if candidate is None:
+                exhausted = True
+                return False
+            name, runnable = candidate
+            task = asyncio.ensure_future(asyncio.wait_for(start(runnable), self.deadline))
+            pending[task] = (name, time.perf_counter())
+            return True
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if not exhausted and len(pending) < self.max_parallel:
+                    name, started_at = list(pending.values())[-1]
+                    timeout = max(
+                        0.0, self._hedge_after(name, kind) - (time.perf_counter() - started_at)
+                    )
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    self.health[name].record_hedge()
+                    logger.info(f"{name} slower than {self._hedge_after(name, kind):.2f}s, hedging")
+                    launch()
+                    continue
+                # Every finished attempt is recorded, in order of preference; the
+                # first success wins and the others are released
+                winner: Optional[Tuple[str, Any]] = None
+                for task in [task for task in pending if task in done]:
+                    name, started_at = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except asyncio.TimeoutError as e:
+                        self.health[name].record_failure(timeout=True)
+                        errors.append(e)
+                        logger.warning(f"{name} missed its {self.deadline}s deadline")
+                    except Exception as e:
+                        self.health[name].record_failure()
+                        errors.append(e)
+                        logger.warning(f"{name} failed: {str(e)}")
+                    else:
+                        self.health[name].record_success(time.perf_counter() - started_at, kind)
+                        if winner is None:
+                            winner = name, result
+                        elif discard is not None:
+                            await discard(result)
+                if winner is not None:
+                    return winner
+                if not pending:
+                    launch()
+        finally:
+            for task, (name, _) in pending.items():
+                task.cancel()
+                self.health[name].record_cancelled()
+        raise errors[-1] if errors else RuntimeError("No language model provider available")
+
+    def _race(
+        self,
+        start: Callable[[Runnable], Any],
+        kind: str,
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> Tuple[str, Any]:
+        """Thread-based variant of _arace for sync calls.
+
+        Threads can't be cancelled, so losing attempts finish in the background
+        and their results are released with discard, or dropped.
+        """
+        candidates = self._candidates()
+        pending: Dict[Future, Tuple[str, float]] = {}
+        errors: List[BaseException] = []
+        exhausted = False
+
+        def launch() -> bool:
+            nonlocal exhausted
+            candidate = next(candidates, None)
+            if candidate is None:
+                exhausted = True
+                return False
+            name, runnable = candidate
+            pending[_executor.submit(start, runnable)] = (name, time.perf_counter())
+            return True
+
+        launch()
+        try:
+            while pending:
+                now = time.perf_counter()
+                # Attempts past their deadline fail
+                for future, (name, started_at) in list(pending.items()):
+                    if now - started_at >= self.deadline:
+                        del pending[future]
+                        self.health[name].record_failure(timeout=True)
+                        errors.append(FutureTimeoutError(f"{name} missed its deadline"))
+                if not pending:
+                    if not launch():
+                        break
+                    continue
+                timeout = min(
+                    self.deadline - (now - started_at) for name, started_at in pending.values()
+                )
+                if not exhausted and len(pending) < self.max_parallel:
+                    name, started_at = list(pending.values())[-1]
+                    timeout = min(
+                        timeout, max(0.0, self._hedge_after(name, kind) - (now - started_at))
+                    )
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if not exhausted and len(pending) < self.max_parallel:
+                        name, started_at = list(pending.values())[-1]
+                        if time.perf_counter() - started_at >= self._hedge_after(name, kind):
+                            self.health[name].record_hedge()
+                            launch()
+                    continue
+                winner: Optional[Tuple[str, Any]] = None
+                for future in [future for future in pending if future in done]:
+                    name, started_at = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.health[name].record_failure()
+                        errors.append(e)
+                        logger.warning(f"{name} failed: {str(e)}")
+                    else:
+                        self.health[name].record_success(time.perf_counter() - started_at, kind)
+                        if winner is None:
+                            winner = name, result
+                        elif discard is not None:
+                            discard(result)
+                if winner is not None:
+                    return winner
+                if not pending:
+                    launch()
+        finally:
+            for future, (name, _) in pending.items():
+                if not future.cancel() and discard is not None:
+                    future.add_done_callback(partial(_discard_later, discard))
+                self.health[name].record_cancelled()
+        raise errors[-1] if errors else RuntimeError("No language model provider available")
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        _, result = self._race(lambda runnable: runnable.invoke(input, config, **kwargs), "invoke")
+        return result
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        _, result = await self._arace(
+            lambda runnable: runnable.ainvoke(input, config, **kwargs), "invoke"
+        )
+        return result
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        def start(runnable: Runnable) -> Tuple[Iterator[Any], List[Any]]:
+            iterator = iter(runnable.stream(input, config, **kwargs))
+            return iterator, [chunk for chunk in (next(iterator, None),) if chunk is not None]
+
+        def discard(result: Tuple[Iterator[Any], List[Any]]) -> None:
+            _close(result[0])
+
+        name, (iterator, first) = self._race(start, "stream", discard)
+        if not first:
+            return
+        yield from first
+        try:
+            while True:
+                # Each chunk is read in a worker thread, so a hung provider can't
+                # stall the stream past the deadline
+                chunk = _executor.submit(next, iterator, None).result(timeout=self.deadline)
+                if chunk is None:
+                    return
+                yield chunk
+        except FutureTimeoutError:
+            self.health[name].record_failure(timeout=True)
+            logger.warning(f"{name} missed its {self.deadline}s deadline mid-stream")
+            raise
+        except Exception:
+            self.health[name].record_failure()
+            raise
+        finally:
+            # A read that missed the deadline still runs and keeps the iterator open
+            _close(iterator)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        async def start(runnable: Runnable) -> Tuple[AsyncIterator[Any], List[Any]]:
+            iterator = runnable.astream(input, config, **kwargs).__aiter__()
+            try:
+                return iterator, [await iterator.__anext__()]
+            except StopAsyncIteration:
+                return iterator, []
+
+        async def discard(result: Tuple[AsyncIterator[Any], List[Any]]) -> None:
+            await _aclose(result[0])
+
+        name, (iterator, first) = await self._arace(start, "stream", discard)
+        if not first:
+            return
+        for chunk in first:
+            yield chunk
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), self.deadline)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        except asyncio.TimeoutError:
+            # Chunks were already sent, so there's no falling back mid-stream
+            self.health[name].record_failure(timeout=True)
+            logger.warning(f"{name} missed its {self.deadline}s deadline mid-stream")
+            raise
+        except Exception:
+            self.health[name].record_failure()
+            raise
+        finally:
+            await _aclose(iterator)
+
+
+def _close(iterator: Iterator[Any]) -> None:
+    """Close a losing or abandoned sync stream, if it can be closed."""
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"Error closing stream: {str(e)}")
+
+
+async def _aclose(iterator: AsyncIterator[Any]) -> None:
+    """Close a losing or abandoned async stream, if it can be closed."""
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception as e:
+            logger.debug(f"Error closing stream: {str(e)}")
+
+
+def _discard_later(discard: Callable[[Any], None], future: Future) -> None:
+    """Release the result of an attempt that finishes after losing the race."""
+    if not future.cancelled() and future.exception() is None:
+        discard(future.result())
+
+
+# Runs sync attempts, so a hung provider never blocks the next one from starting
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("LLM_SYNC_WORKERS", "16")),
+    thread_name_prefix="llm-hedge",
+)
+
+
+def get_provider_health(names: List[str]) -> Dict[str, ProviderHealth]:
+    """Create the health of each provider, configured by LLM_* environment variables."""
+    return {
+        name: ProviderHealth(
+            name,
+            window=int(os.environ.get("LLM_LATENCY_WINDOW", "100")),
+            min_samples=int(os.environ.get("LLM_LATENCY_MIN_SAMPLES", "20")),
+            failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "3")),
+            cooldown=float(os.environ.get("LLM_BREAKER_COOLDOWN", "30")),
+        )
+        for name in names
+    }
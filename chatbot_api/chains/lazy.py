@@ -0,0 +1,137 @@
+"""Lazy construction of the chain's providers and retriever.
+
+Building the language model clients and connecting to the vector store at import
+time makes every cold start pay for providers that may never be used, and makes
+the import fail outright when Weaviate is down. LazyRunnable stands in for a
+runnable in the chain and builds it on first use, once. The API builds the ones
+every request needs in its lifespan hook (warm-up), the fallbacks and
+alternatives only when a request actually reaches them.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Generic, Iterator, List, Optional, TypeVar
+
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableSerializable
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """Builds an object on first use, once, and records how long that took."""
+
+    def __init__(self, factory: Callable[[], T], name: str):
+        """Initialize the lazy object.
+
+        Args:
+            factory (Callable[[], T]): Builds the object. If it raises, the next
+                use tries again.
+            name (str): Name used in logs and stats.
+        """
+        self.factory = factory
+        self.name = name
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+        self.build_seconds: Optional[float] = None
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def built(self) -> bool:
+        return self._value is not None
+
+    def get(self) -> T:
+        """Return the object, building it if needed."""
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    started_at = time.perf_counter()
+                    try:
+                        value = self.factory()
+                    except Exception as e:
+                        self.failures += 1
+                        self.last_error = str(e)
+                        logger.error(f"Error building {self.name}: {str(e)}")
+                        raise
+                    self.build_seconds = time.perf_counter() - started_at
+                    self.last_error = None
+                    logger.info(f"Built {self.name} in {self.build_seconds:.3f}s")
+                    self._value = value
+        return self._value
+
+    async def aget(self) -> T:
+        """Return the object, building it in a worker thread if needed."""
+        if self._value is not None:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def peek(self) -> Optional[T]:
+        """Return the object if it was built, without building it."""
+        return self._value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "built": self.built,
+            "build_seconds": self.build_seconds,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class LazyRunnable(RunnableSerializable[Any, Any]):
+    """Delegates to a runnable that is built on first use.
+
+    Calls are passed straight to the built runnable with the caller's config, so
+    traces and streamed events look as if it had been in the chain all along.
+    """
+
+    lazy: Lazy
+    """Builds the wrapped runnable."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_factory(cls, factory: Callable[[], Runnable], name: str) -> "LazyRunnable":
+        """Create a lazy runnable from a function building the runnable."""
+        return cls(lazy=Lazy(factory, name), name=name)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.lazy.get().invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return await (await self.lazy.aget()).ainvoke(input, config, **kwargs)
+
+    def batch(self, inputs: List[Any], config: Any = None, **kwargs: Any) -> List[Any]:
+        return self.lazy.get().batch(inputs, config, **kwargs)
+
+    async def abatch(self, inputs: List[Any], config: Any = None, **kwargs: Any) -> List[Any]:
+        return await (await self.lazy.aget()).abatch(inputs, config, **kwargs)
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        yield from self.lazy.get().stream(input, config, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        async for chunk in (await self.lazy.aget()).astream(input, config, **kwargs):
+            yield chunk
+
+    def transform(
+        self, input: Iterator[Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        yield from self.lazy.get().transform(input, config, **kwargs)
+
+    async def atransform(
+        self, input: AsyncIterator[Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        async for chunk in (await self.lazy.aget()).atransform(input, config, **kwargs):
+            yield chunk
@@ -1,24 +1,62 @@
+import sys
 import time
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Sequence
 from collections import deque
-from dataclasses import dataclass, field
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 
-@dataclass
 class Message:
-    """Represents a single message in the chat history."""
-    role: str  # 'human' or 'ai'
-    content: str
-    timestamp: float = field(default_factory=lambda: time.time())
+    """Represents a single message in the chat history.
+
+    Uses __slots__ instead of a per-instance __dict__, since every session keeps
+    up to max_messages of these in memory.
+    """
+    __slots__ = ("role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: Optional[float] = None):
+        self.role = role  # 'human' or 'ai'
+        self.content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r}, timestamp={self.timestamp!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (self.role, self.content, self.timestamp) == (other.role, other.content, other.timestamp)
+
+    def approx_bytes(self) -> int:
+        """Return the approximate memory held by the message and its content."""
+        return sys.getsizeof(self) + sys.getsizeof(self.content) + sys.getsizeof(self.timestamp)
+
+def to_langchain_message(message: Message) -> BaseMessage:
+    """Convert a stored message to the LangChain message the chain prompts with."""
+    if message.role == 'human':
+        return HumanMessage(content=message.content)
+    return AIMessage(content=message.content)
 
 class ChatMemory:
     """Manages chat history with a fixed size circular buffer."""
-    def __init__(self, max_messages: int = 10):
+    def __init__(
+        self,
+        max_messages: int = 10,
+        on_append: Optional[Callable[[Sequence[Message]], None]] = None,
+    ):
         """Initialize chat memory.
         
         Args:
             max_messages (int): Maximum number of messages to store in history.
+            on_append (Optional[Callable]): Called with every batch of added
+                messages, e.g. to persist them in a session backend.
         """
         self.messages: deque = deque(maxlen=max_messages)
+        # LangChain messages, kept in step with self.messages so the history is
+        # converted once per message instead of once per request
+        self.lc_messages: deque = deque(maxlen=max_messages)
+        self.on_append = on_append
+        # Monotonic times of the last access and of the last load from a
+        # session backend, maintained by SessionManager
+        self.last_access = self.loaded_at = time.monotonic()
     
     def add_message(self, role: str, content: str) -> None:
         """Add a new message to the history.
@@ -29,6 +67,22 @@ class ChatMemory:
         """
         message = Message(role=role, content=content)
         self.messages.append(message)
+        self.lc_messages.append(to_langchain_message(message))
+        if self.on_append is not None:
+            self.on_append((message,))
+    
+    def add_turn(self, human: str, ai: str) -> None:
+        """Add a question and its answer to the history in one step.
+        
+        Args:
+            human (str): Content of the human message
+            ai (str): Content of the AI answer
+        """
+        messages = (Message(role='human', content=human), Message(role='ai', content=ai))
+        self.messages.extend(messages)
+        self.lc_messages.extend((HumanMessage(content=human), AIMessage(content=ai)))
+        if self.on_append is not None:
+            self.on_append(messages)
     
     def get_history(self) -> List[Dict[str, str]]:
         """Get the chat history in the format expected by ChatRequest.
@@ -41,6 +95,42 @@ class ChatMemory:
             for message in self.messages
         ]
     
+    def get_messages(self) -> List[BaseMessage]:
+        """Get the chat history as LangChain messages, ready for the chain.
+        
+        Returns:
+            List[BaseMessage]: HumanMessage and AIMessage objects, oldest first
+        """
+        return list(self.lc_messages)
+    
+    def replace(self, messages: Sequence[Message]) -> None:
+        """Replace the history with messages loaded from a session backend.
+        
+        Args:
+            messages (Sequence[Message]): The messages, oldest first.
+        """
+        self.messages.clear()
+        self.messages.extend(messages)
+        self.lc_messages.clear()
+        self.lc_messages.extend(to_langchain_message(message) for message in messages)
+    
+    def approx_bytes(self) -> int:
+        """Return the approximate memory held by the history.
+        
+        The LangChain messages share their content strings with the stored
+        messages, so only the message objects and their field dicts are added.
+        """
+        return (
+            sys.getsizeof(self.messages)
+            + sum(message.approx_bytes() for message in self.messages)
+            + sys.getsizeof(self.lc_messages)
+            + sum(
+                sys.getsizeof(message) + sys.getsizeof(message.__dict__)
+                for message in self.lc_messages
+            )
+        )
+    
     def clear(self) -> None:
         """Clear the chat history."""
-        self.messages.clear() 
\ No newline at end of file
+        self.messages.clear()
+        self.lc_messages.clear()
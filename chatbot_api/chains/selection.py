@@ -0,0 +1,311 @@
+"""Post-retrieval selection of the documents that go into the prompt.
+
+A plain top-k search over overlapping chunks and near-identical stock rows often
+fills the prompt with the same text several times. DiverseRetriever over-fetches
+candidates together with their stored vectors and then:
+
+1. keeps the candidates within a similarity cutoff of the best match, so k
+   shrinks when only a few documents are relevant;
+2. drops near-duplicates, i.e. candidates whose word shingles are mostly
+   contained in a higher ranked candidate;
+3. picks a diverse subset of the rest with maximal marginal relevance (MMR)
+   on the vectors returned by the search, so no extra embedding calls are made.
+
+The tokens saved against the plain top-k result are counted for a sample of the
+queries, one in CONTEXT_TOKEN_STATS_EVERY, since counting them means tokenizing
+the whole baseline.
+"""
+
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+
+from chatbot_api.chains.budget import count_tokens
+from chatbot_api.vectorstores import VectorStoreConnection
+
+logger = logging.getLogger(__name__)
+
+CandidateSearch = Callable[[List[float], int], Tuple[List[Document], np.ndarray]]
+AsyncCandidateSearch = Callable[[List[float], int], Awaitable[Tuple[List[Document], np.ndarray]]]
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = 3) -> Set[int]:
+    """Return the hashes of the word shingles of a text, ignoring case and punctuation."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {hash(" ".join(words))}
+    return {hash(" ".join(words[i : i + size])) for i in range(len(words) - size + 1)}
+
+
+def containment(a: Set[int], b: Set[int]) -> float:
+    """Return the share of the smaller shingle set that is also in the other."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def mmr(query: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """Select k diverse rows with maximal marginal relevance.
+
+    Args:
+        query (np.ndarray): Normalized query vector.
+        vectors (np.ndarray): Normalized candidate vectors, one per row.
+        k (int): Number of rows to select.
+        lambda_mult (float): 1 ranks by relevance only, 0 by diversity only.
+
+    Returns:
+        List[int]: The selected rows, in selection order.
+    """
+    relevance = vectors @ query
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of every candidate to any selected row
+    redundancy = vectors @ vectors[selected[0]]
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        row = int(np.argmax(scores))
+        selected.append(row)
+        redundancy = np.maximum(redundancy, vectors @ vectors[row])
+    return selected
+
+
+def _weaviate_query(
+    connection: VectorStoreConnection,
+    index_name: str,
+    attributes: List[str],
+    embedding: List[float],
+    k: int,
+) -> str:
+    return (
+        connection.client.query.get(index_name, attributes)
+        .with_additional("vector")
+        .with_near_vector({"vector": embedding})
+        .with_limit(k)
+        .build()
+    )
+
+
+def _weaviate_results(
+    index_name: str, text_key: str, result: Dict[str, Any]
+) -> Tuple[List[Document], np.ndarray]:
+    if "errors" in result:
+        raise ValueError(f"Error during query: {result['errors']}")
+    docs = []
+    vectors = []
+    for item in result["data"]["Get"][index_name]:
+        vectors.append(item.pop("_additional")["vector"])
+        text = item.pop(text_key)
+        docs.append(Document(page_content=text, metadata=item))
+    return docs, np.asarray(vectors, dtype=np.float32)
+
+
+def get_weaviate_candidate_search(
+    connection: VectorStoreConnection,
+    index_name: str,
+    text_key: str,
+    attributes: List[str],
+) -> Tuple[CandidateSearch, AsyncCandidateSearch]:
+    """Return functions searching a Weaviate index for documents and their vectors.
+
+    Args:
+        connection (VectorStoreConnection): Connection the queries are sent through.
+        index_name (str): The Weaviate class holding the documents.
+        text_key (str): Property holding the document text.
+        attributes (List[str]): Properties returned as document metadata.
+
+    Returns:
+        Tuple[CandidateSearch, AsyncCandidateSearch]: The sync and async search,
+            both taking the query embedding and the number of candidates.
+    """
+    properties = [text_key, *attributes]
+
+    def search(embedding: List[float], k: int) -> Tuple[List[Document], np.ndarray]:
+        query = _weaviate_query(connection, index_name, properties, embedding, k)
+        return _weaviate_results(index_name, text_key, connection.query(query))
+
+    async def asearch(embedding: List[float], k: int) -> Tuple[List[Document], np.ndarray]:
+        query = _weaviate_query(connection, index_name, properties, embedding, k)
+        return _weaviate_results(index_name, text_key, await connection.aquery(query))
+
+    return search, asearch
+
+
+class DiverseRetriever(BaseRetriever):
+    """Retrieves a deduplicated, diverse set of documents sized by a similarity cutoff."""
+
+    search: CandidateSearch
+    """Returns candidate documents and their vectors for a query embedding."""
+    asearch: Optional[AsyncCandidateSearch] = None
+    """Async variant of search; without it, search runs in a worker thread."""
+    embeddings: Embeddings
+    """The model used to embed queries."""
+    fetch_k: int = 20
+    """Number of candidates fetched from the vector store."""
+    k: int = 6
+    """Maximum number of documents returned, and the size of the plain top-k baseline."""
+    min_k: int = 2
+    """Minimum number of documents returned when that many candidates exist."""
+    similarity_margin: float = 0.1
+    """Candidates less similar than the best match minus this margin are cut."""
+    min_similarity: float = 0.0
+    """Candidates less similar than this are cut."""
+    duplicate_threshold: float = 0.8
+    """Shingle containment above which a candidate is a near-duplicate."""
+    lambda_mult: float = 0.7
+    """MMR trade-off between relevance (1) and diversity (0)."""
+    token_stats_every: int = 10
+    """Count the tokens saved against the plain top k for every n-th query; 0 never."""
+    counters: Dict[str, float] = {
+        "queries": 0,
+        "candidates": 0,
+        "cut": 0,
+        "duplicates": 0,
+        "returned": 0,
+        "token_sampled_queries": 0,
+        "saved_tokens": 0,
+        "select_seconds": 0.0,
+    }
+
+    @classmethod
+    def from_env(
+        cls,
+        embeddings: Embeddings,
+        search: CandidateSearch,
+        asearch: Optional[AsyncCandidateSearch] = None,
+    ) -> "DiverseRetriever":
+        """Create a retriever configured by CONTEXT_* environment variables.
+
+        Args:
+            embeddings (Embeddings): The model used to embed queries.
+            search (CandidateSearch): Returns candidates and their vectors, e.g.
+                LocalVectorStore.similarity_search_with_vectors.
+            asearch (Optional[AsyncCandidateSearch]): Async variant of search.
+
+        Returns:
+            DiverseRetriever: The retriever.
+        """
+        return cls(
+            search=search,
+            asearch=asearch,
+            embeddings=embeddings,
+            fetch_k=int(os.environ.get("CONTEXT_FETCH_K", "20")),
+            k=int(os.environ.get("CONTEXT_MAX_K", "6")),
+            min_k=int(os.environ.get("CONTEXT_MIN_K", "2")),
+            similarity_margin=float(os.environ.get("CONTEXT_SIMILARITY_MARGIN", "0.1")),
+            min_similarity=float(os.environ.get("CONTEXT_MIN_SIMILARITY", "0.0")),
+            duplicate_threshold=float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8")),
+            lambda_mult=float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7")),
+            token_stats_every=int(os.environ.get("CONTEXT_TOKEN_STATS_EVERY", "10")),
+        )
+
+    def select(
+        self, embedding: List[float], docs: List[Document], vectors: np.ndarray
+    ) -> List[Document]:
+        """Select the documents for the prompt from ranked candidates.
+
+        Args:
+            embedding (List[float]): The query embedding.
+            docs (List[Document]): Candidates, most similar first.
+            vectors (np.ndarray): The candidates' vectors.
+
+        Returns:
+            List[Document]: The selected documents, in MMR order.
+        """
+        if not docs:
+            return []
+        started_at = time.perf_counter()
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        similarities = vectors @ query
+
+        # Similarity cutoff: k follows the number of relevant candidates
+        cutoff = max(self.min_similarity, float(similarities.max()) - self.similarity_margin)
+        ranked = [int(row) for row in np.argsort(-similarities)]
+        relevant = [row for row in ranked if similarities[row] >= cutoff]
+        if len(relevant) < self.min_k:
+            relevant = ranked[: self.min_k]
+
+        # Near-duplicates: drop candidates mostly contained in a better ranked one
+        kept: List[int] = []
+        kept_shingles: List[Set[int]] = []
+        for row in relevant:
+            row_shingles = shingles(docs[row].page_content)
+            if any(
+                containment(row_shingles, other) >= self.duplicate_threshold
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(row)
+            kept_shingles.append(row_shingles)
+
+        picked = mmr(query, vectors[kept], self.k, self.lambda_mult)
+        selected = [docs[kept[i]] for i in picked]
+
+        self.counters["queries"] += 1
+        self.counters["candidates"] += len(docs)
+        self.counters["cut"] += len(docs) - len(relevant)
+        self.counters["duplicates"] += len(relevant) - len(kept)
+        self.counters["returned"] += len(selected)
+        self.counters["select_seconds"] += time.perf_counter() - started_at
+        tokens = ""
+        if self.token_stats_every and self.counters["queries"] % self.token_stats_every == 0:
+            baseline_tokens = sum(
+                count_tokens(docs[row].page_content) for row in ranked[: self.k]
+            )
+            selected_tokens = sum(count_tokens(doc.page_content) for doc in selected)
+            saved = max(0, baseline_tokens - selected_tokens)
+            self.counters["token_sampled_queries"] += 1
+            self.counters["saved_tokens"] += saved
+            tokens = f", {selected_tokens} tokens ({saved} saved vs top {self.k})"
+        logger.info(
+            f"Context selection: {len(docs)} candidates, {len(docs) - len(relevant)} below "
+            f"cutoff {cutoff:.3f}, {len(relevant) - len(kept)} near-duplicates, "
+            f"{len(selected)} selected{tokens}"
+        )
+        return selected
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = self.embeddings.embed_query(query)
+        docs, vectors = self.search(embedding, self.fetch_k)
+        return self.select(embedding, docs, vectors)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = await self.embeddings.aembed_query(query)
+        if self.asearch is not None:
+            docs, vectors = await self.asearch(embedding, self.fetch_k)
+        else:
+            docs, vectors = await run_in_executor(None, self.search, embedding, self.fetch_k)
+        return self.select(embedding, docs, vectors)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many candidates were cut, deduplicated and returned."""
+        queries = self.counters["queries"]
+        sampled = self.counters["token_sampled_queries"]
+        return {
+            **self.counters,
+            "avg_returned": self.counters["returned"] / queries if queries else 0.0,
+            "avg_saved_tokens": self.counters["saved_tokens"] / sampled if sampled else 0.0,
+            "avg_select_milliseconds": (
+                self.counters["select_seconds"] / queries * 1000 if queries else 0.0
+            ),
+        }
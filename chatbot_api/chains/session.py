@@ -1,11 +1,82 @@
-from typing import Dict, Optional
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Dict, List, Optional
 from uuid import uuid4
-from .memory import ChatMemory
+from .memory import ChatMemory, Message
+from .session_backend import SessionBackend, get_session_backend
 
 class SessionManager:
-    """Manages multiple chat sessions."""
-    def __init__(self):
-        self.sessions: Dict[str, ChatMemory] = {}
+    """Manages multiple chat sessions.
+
+    Sessions are kept in least recently used order. Sessions idle for longer than
+    idle_ttl are dropped lazily, when they are looked up or when a sweep runs, and
+    creating a session beyond max_sessions evicts the least recently used one.
+
+    With a persistent backend the sessions held here are a hot cache: messages are
+    written through to the backend, evicted sessions are loaded back on their next
+    access, and sessions older than refresh_interval are reloaded because another
+    worker may have added turns.
+    """
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        sweep_interval: float = 60.0,
+        backend: Optional[SessionBackend] = None,
+        refresh_interval: float = 5.0,
+        max_messages: int = 10,
+    ):
+        """Initialize the session manager.
+        
+        Args:
+            max_sessions (Optional[int]): Maximum number of sessions held. Unbounded if None.
+            idle_ttl (Optional[float]): Seconds after the last access before a
+                session expires. Never expires if None.
+            sweep_interval (float): Minimum seconds between sweeps of expired sessions.
+            backend (Optional[SessionBackend]): Persistent store behind the cache,
+                in-process only if None.
+            refresh_interval (float): Seconds before a cached session of a shared
+                backend is reloaded.
+            max_messages (int): Maximum number of messages kept per session.
+        """
+        self.sessions: "OrderedDict[str, ChatMemory]" = OrderedDict()
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.backend = backend or SessionBackend()
+        self.refresh_interval = refresh_interval
+        self.max_messages = max_messages
+        self.evicted = 0
+        self.expired = 0
+        self._swept_at = time.monotonic()
+        # Per-session lock and the number of tasks holding or waiting for it
+        self._locks: Dict[str, List] = {}
+    
+    @classmethod
+    def from_env(cls) -> "SessionManager":
+        """Create a session manager bounded by SESSION_MAX_COUNT and SESSION_IDLE_TTL,
+        with the backend selected by SESSION_BACKEND."""
+        max_sessions = int(os.environ.get("SESSION_MAX_COUNT", "10000"))
+        idle_ttl = float(os.environ.get("SESSION_IDLE_TTL", "86400"))
+        return cls(
+            max_sessions=max_sessions if max_sessions > 0 else None,
+            idle_ttl=idle_ttl if idle_ttl > 0 else None,
+            backend=get_session_backend(),
+            refresh_interval=float(os.environ.get("SESSION_REFRESH_INTERVAL", "5")),
+        )
+    
+    def start(self) -> None:
+        """Start the background work of the session backend."""
+        self.backend.start()
+    
+    def close(self) -> None:
+        """Flush pending writes of the session backend and stop it."""
+        self.backend.close()
     
     def create_session(self, session_id: Optional[str] = None) -> str:
         """Create a new chat session.
@@ -17,7 +88,7 @@ class SessionManager:
             str: The session ID
         """
         session_id = session_id or str(uuid4())
-        self.sessions[session_id] = ChatMemory()
+        self._add(session_id)
         return session_id
     
     def get_session(self, session_id: str) -> Optional[ChatMemory]:
@@ -29,7 +100,60 @@ class SessionManager:
         Returns:
             Optional[ChatMemory]: The chat memory for the session, or None if not found
         """
-        return self.sessions.get(session_id)
+        session = self._get_cached(session_id)
+        if session is None or self._is_stale(session):
+            messages = self.backend.load(session_id, self.max_messages)
+            session = self._install(session_id, session, messages)
+        return session
+    
+    async def aget_session(self, session_id: str) -> Optional[ChatMemory]:
+        """Get a chat session by ID.
+        
+        Like get_session, but the backend is queried in a thread so a cache miss
+        does not block the event loop.
+        
+        Args:
+            session_id (str): The session ID
+            
+        Returns:
+            Optional[ChatMemory]: The chat memory for the session, or None if not found
+        """
+        session = self._get_cached(session_id)
+        if session is None or self._is_stale(session):
+            messages = await asyncio.to_thread(self.backend.load, session_id, self.max_messages)
+            session = self._install(session_id, session, messages)
+        return session
+    
+    def get_or_create_session(self, session_id: str) -> ChatMemory:
+        """Get a chat session by ID, creating it if it does not exist.
+        
+        Args:
+            session_id (str): The session ID
+            
+        Returns:
+            ChatMemory: The chat memory for the session
+        """
+        session = self.get_session(session_id)
+        if session is None:
+            session = self._add(session_id)
+        return session
+    
+    async def aget_or_create_session(self, session_id: str) -> ChatMemory:
+        """Get a chat session by ID, creating it if it does not exist.
+        
+        Like get_or_create_session, but the backend is queried in a thread so a
+        cache miss does not block the event loop.
+        
+        Args:
+            session_id (str): The session ID
+            
+        Returns:
+            ChatMemory: The chat memory for the session
+        """
+        session = await self.aget_session(session_id)
+        if session is None:
+            session = self._add(session_id)
+        return session
     
     def delete_session(self, session_id: str) -> None:
         """Delete a chat session.
@@ -38,4 +162,147 @@ class SessionManager:
             session_id (str): The session ID to delete
         """
         if session_id in self.sessions:
-            del self.sessions[session_id] 
\ No newline at end of file
+            del self.sessions[session_id] 
+        self.backend.delete(session_id)
+    
+    async def adelete_session(self, session_id: str) -> None:
+        """Delete a chat session, deleting it from the backend in a thread.
+        
+        Args:
+            session_id (str): The session ID to delete
+        """
+        self.sessions.pop(session_id, None)
+        await asyncio.to_thread(self.backend.delete, session_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of sessions held, their approximate size and evictions."""
+        self._sweep(force=True)
+        return {
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "messages": sum(len(session.messages) for session in self.sessions.values()),
+            "approx_bytes": sys.getsizeof(self.sessions) + sum(
+                sys.getsizeof(session_id) + session.approx_bytes()
+                for session_id, session in self.sessions.items()
+            ),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "backend": self.backend.stats(),
+        }
+    
+    def _add(self, session_id: str) -> ChatMemory:
+        """Add an empty session to the cache, writing through to the backend."""
+        session = ChatMemory(
+            max_messages=self.max_messages,
+            on_append=partial(self.backend.append, session_id),
+        )
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        self._sweep()
+        self._evict()
+        return session
+    
+    def _get_cached(self, session_id: str) -> Optional[ChatMemory]:
+        """Look up a cached session, dropping it if it expired."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if self._is_expired(session, now) and session_id not in self._locks:
+            del self.sessions[session_id]
+            self.expired += 1
+            return None
+        session.last_access = now
+        self.sessions.move_to_end(session_id)
+        return session
+    
+    def _is_stale(self, session: ChatMemory) -> bool:
+        return (
+            self.backend.shared
+            and time.monotonic() - session.loaded_at > self.refresh_interval
+        )
+    
+    def _install(
+        self,
+        session_id: str,
+        session: Optional[ChatMemory],
+        messages: Optional[List[Message]],
+    ) -> Optional[ChatMemory]:
+        """Cache messages loaded from the backend, if it had any."""
+        if messages is None:
+            if session is not None:
+                if self.backend.shared:
+                    # Another worker cleared the session
+                    session.replace([])
+                session.loaded_at = time.monotonic()
+            return session
+        if session is None:
+            session = self._add(session_id)
+        session.replace(messages)
+        session.loaded_at = time.monotonic()
+        return session
+    
+    def _is_expired(self, session: ChatMemory, now: float) -> bool:
+        return self.idle_ttl is not None and now - session.last_access > self.idle_ttl
+    
+    def _sweep(self, force: bool = False) -> None:
+        """Drop expired sessions, oldest first.
+        
+        Sessions are ordered by last access, so the sweep stops at the first one
+        that has not expired.
+        """
+        if self.idle_ttl is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._swept_at < self.sweep_interval:
+            return
+        self._swept_at = now
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if not self._is_expired(session, now):
+                break
+            if session_id in self._locks:
+                # Still answering a turn, so it is not idle
+                session.last_access = now
+                self.sessions.move_to_end(session_id)
+                continue
+            self.sessions.popitem(last=False)
+            self.expired += 1
+    
+    def _evict(self) -> None:
+        """Evict least recently used sessions beyond max_sessions, skipping locked ones."""
+        if self.max_sessions is None:
+            return
+        locked = 0
+        while len(self.sessions) > self.max_sessions and locked < len(self.sessions):
+            session_id = next(iter(self.sessions))
+            if session_id in self._locks:
+                self.sessions.move_to_end(session_id)
+                locked += 1
+                continue
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+    
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        """Serialize turns within one session.
+        
+        Requests for the same session run one after another so history is read
+        and written in order, while different sessions still run in parallel.
+        The lock is dropped once no task holds or waits for it.
+        
+        Args:
+            session_id (str): The session ID to lock
+        """
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
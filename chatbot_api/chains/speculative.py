@@ -0,0 +1,252 @@
+"""Speculative retrieval for follow up questions.
+
+With chat history the question is first rephrased by the language model and only
+then sent to the retriever, so both latencies add up. In speculative mode the
+retriever is queried with the raw question while the rephrase runs. If the
+rephrased question turns out close enough to the raw one, the speculative
+documents are used; otherwise a second retrieval runs with the rephrased question.
+Questions that read as self-contained skip the rephrase entirely.
+"""
+
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.utils import ConfigurableFieldSpec, get_unique_config_specs
+
+# Words that usually point back to an earlier turn, in English and Spanish.
+REFERRING_WORDS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their", "one",
+    "ones", "he", "she", "him", "her", "there", "same", "other", "another", "else",
+    "eso", "esa", "ese", "esos", "esas", "esto", "este", "esta", "estos", "estas",
+    "ello", "ellos", "ellas", "otro", "otra", "mismo", "misma",
+}
+
+# Openings that mark a question as a continuation of the previous one.
+FOLLOW_UP_PREFIXES = (
+    "and ", "what about", "how about", "also", "y ", "que tal", "qué tal",
+)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def is_self_contained(question: str, min_words: int = 4) -> bool:
+    """Guess whether a question can be understood without the chat history.
+
+    Args:
+        question (str): The follow up question.
+        min_words (int): Shorter questions are always treated as follow ups.
+
+    Returns:
+        bool: True if the question has no referring words or follow up openings.
+    """
+    words = _words(question)
+    if len(words) < min_words:
+        return False
+    if question.strip().lower().startswith(FOLLOW_UP_PREFIXES):
+        return False
+    return not REFERRING_WORDS.intersection(words)
+
+
+def question_similarity(a: str, b: str) -> float:
+    """Return the Jaccard similarity of the word sets of two questions."""
+    words_a, words_b = set(_words(a)), set(_words(b))
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+class SpeculativeRetrieval:
+    """Settings and path counters for speculative retrieval."""
+
+    def __init__(self, similarity_threshold: float = 0.6, skip_self_contained: bool = True):
+        """Initialize the settings.
+
+        Args:
+            similarity_threshold (float): Minimum word overlap between the raw and
+                rephrased question for the speculative documents to be reused.
+            skip_self_contained (bool): Skip the rephrase for self-contained questions.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.skip_self_contained = skip_self_contained
+        self.paths: Dict[str, int] = {
+            "no_history": 0,
+            "skipped_condense": 0,
+            "speculative_hit": 0,
+            "speculative_miss": 0,
+        }
+        self.latency_saved = 0.0
+        self._condense_time = 0.0
+        self._condense_count = 0
+
+    @classmethod
+    def from_env(cls) -> "SpeculativeRetrieval":
+        """Create settings from SPECULATIVE_* environment variables."""
+        return cls(
+            similarity_threshold=float(os.environ.get("SPECULATIVE_SIMILARITY", "0.6")),
+            skip_self_contained=(
+                os.environ.get("SPECULATIVE_SKIP_SELF_CONTAINED", "true").lower() == "true"
+            ),
+        )
+
+    def record(self, path: str, saved: float = 0.0) -> None:
+        """Count a retrieval path and the latency it saved."""
+        self.paths[path] += 1
+        self.latency_saved += saved
+
+    def record_condense(self, elapsed: float) -> None:
+        """Track rephrase latency, used to estimate what a skipped rephrase saves."""
+        self._condense_time += elapsed
+        self._condense_count += 1
+
+    @property
+    def avg_condense_time(self) -> float:
+        return self._condense_time / self._condense_count if self._condense_count else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how often each path was taken and the latency saved."""
+        return {
+            "paths": dict(self.paths),
+            "latency_saved_seconds": self.latency_saved,
+            "avg_condense_seconds": self.avg_condense_time,
+        }
+
+
+class SpeculativeRetrievalRunnable(Runnable[Dict[str, Any], Dict[str, Any]]):
+    """Adds ``standalone_question`` and ``docs`` to the input, retrieving speculatively."""
+
+    def __init__(
+        self,
+        rephrase_chain: Runnable,
+        retriever: BaseRetriever,
+        settings: SpeculativeRetrieval,
+    ):
+        self.rephrase_chain = rephrase_chain
+        self.retriever = retriever
+        self.settings = settings
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return get_unique_config_specs(
+            self.rephrase_chain.config_specs + self.retriever.config_specs
+        )
+
+    def _direct_path(self, input: Dict[str, Any]) -> Optional[str]:
+        """Return the path name when no rephrase is needed, else None."""
+        if not input.get("chat_history"):
+            return "no_history"
+        if self.settings.skip_self_contained and is_self_contained(input["question"]):
+            return "skipped_condense"
+        return None
+
+    def _record_direct(self, path: str) -> None:
+        saved = self.settings.avg_condense_time if path == "skipped_condense" else 0.0
+        self.settings.record(path, saved)
+
+    def _record_speculative(
+        self, path: str, started_at: float, condense_time: float, retrieval_time: float
+    ) -> None:
+        saved = 0.0
+        if path == "speculative_hit":
+            # Without speculation the retrieval would only start after the rephrase
+            elapsed = time.perf_counter() - started_at
+            saved = max(0.0, condense_time + retrieval_time - elapsed)
+        self.settings.record(path, saved)
+
+    def invoke(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    def _invoke(
+        self,
+        input: Dict[str, Any],
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        question = input["question"]
+        path = self._direct_path(input)
+        if path is not None:
+            docs = self.retriever.invoke(question, config)
+            self._record_direct(path)
+            return {**input, "standalone_question": question, "docs": docs}
+
+        started_at = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            speculative = executor.submit(self._timed_retrieve, question, config)
+            standalone_question = self.rephrase_chain.invoke(input, config)
+            condense_time = time.perf_counter() - started_at
+            self.settings.record_condense(condense_time)
+            similarity = question_similarity(question, standalone_question)
+            if similarity >= self.settings.similarity_threshold:
+                docs, retrieval_time = speculative.result()
+                path = "speculative_hit"
+            else:
+                docs, retrieval_time = self._timed_retrieve(standalone_question, config)
+                path = "speculative_miss"
+        finally:
+            # Do not wait for a speculative retrieval whose result is discarded
+            executor.shutdown(wait=False)
+        self._record_speculative(path, started_at, condense_time, retrieval_time)
+        return {**input, "standalone_question": standalone_question, "docs": docs}
+
+    async def _ainvoke(
+        self,
+        input: Dict[str, Any],
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        question = input["question"]
+        path = self._direct_path(input)
+        if path is not None:
+            docs = await self.retriever.ainvoke(question, config)
+            self._record_direct(path)
+            return {**input, "standalone_question": question, "docs": docs}
+
+        started_at = time.perf_counter()
+        speculative = asyncio.create_task(self._atimed_retrieve(question, config))
+        try:
+            standalone_question = await self.rephrase_chain.ainvoke(input, config)
+        except BaseException:
+            speculative.cancel()
+            raise
+        condense_time = time.perf_counter() - started_at
+        self.settings.record_condense(condense_time)
+        similarity = question_similarity(question, standalone_question)
+        if similarity >= self.settings.similarity_threshold:
+            docs, retrieval_time = await speculative
+            path = "speculative_hit"
+        else:
+            speculative.cancel()
+            docs, retrieval_time = await self._atimed_retrieve(standalone_question, config)
+            path = "speculative_miss"
+        self._record_speculative(path, started_at, condense_time, retrieval_time)
+        return {**input, "standalone_question": standalone_question, "docs": docs}
+
+    def _timed_retrieve(self, query: str, config: Optional[RunnableConfig]):
+        started_at = time.perf_counter()
+        docs = self.retriever.invoke(query, config)
+        return docs, time.perf_counter() - started_at
+
+    async def _atimed_retrieve(self, query: str, config: Optional[RunnableConfig]):
+        started_at = time.perf_counter()
+        docs = await self.retriever.ainvoke(query, config)
+        return docs, time.perf_counter() - started_at
@@ -0,0 +1,286 @@
+"""Structured retrieval over the stock table for attribute questions.
+
+Questions that name numeric ranges or features ("Toyota under 15000 with CarPlay
+from 2019 or later") are parsed into predicates and answered from the columnar
+StockTable. Other questions, including those that only name a make or model
+("Does the Corolla have a warranty?"), go to the vector retriever as before.
+"""
+
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chatbot_api.ingests.stock_table import StockTable
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = r"\$?\s?\d[\d.,]*(?:\s?(?:k|mil)\b)?"
+_UNIT = r"(?:km|kms|kilometers|kilometres|kilometros|kilómetros|miles|usd|dollars|dolares|dólares|pesos|euros|€)"
+_MAX_WORDS = (
+    r"under|below|less than|cheaper than|up to|at most|no more than|max(?:imum)?|"
+    r"menos de|hasta|por debajo de|m[aá]ximo|bajo"
+)
+_MIN_WORDS = (
+    r"over|above|more than|at least|min(?:imum)?|from|since|"
+    r"m[aá]s de|desde|por encima de|m[ií]nimo"
+)
+# Also used outside ranges ("open from 9", "writing from 1234 Main street"), so
+# they only bound a column before a unit, a price or a marked year
+_SOFT_MIN_WORDS = r"from|since|desde"
+_ONWARDS_RE = re.compile(r"\s*(?:on(?:wards?)?|en adelante)\b", re.IGNORECASE)
+_STRICT_WORDS = r"after|newer than|posterior a|before|older than|anterior a"
+
+_BETWEEN_RE = re.compile(
+    rf"\b(?:between|entre)\s+(?P<low>{_NUMBER})\s*(?P<unit1>{_UNIT})?\s+(?:and|y)\s+"
+    rf"(?P<high>{_NUMBER})\s*(?P<unit>{_UNIT})?",
+    re.IGNORECASE,
+)
+_BOUND_RE = re.compile(
+    rf"\b(?P<op>{_MAX_WORDS}|{_MIN_WORDS}|{_STRICT_WORDS})\s+(?:the\s+|el\s+|del\s+)?"
+    rf"(?P<year>year\s+|año\s+)?(?P<num>{_NUMBER})\s*(?P<unit>{_UNIT})?",
+    re.IGNORECASE,
+)
+_YEAR_SUFFIX_RE = re.compile(
+    r"\b(?P<num>(?:19|20)\d\d)\s+(?:or|o)\s+(?P<op>later|newer|after|more recent|"
+    r"earlier|older|before|posterior|m[aá]s nuevo|anterior|m[aá]s viejo)\b",
+    re.IGNORECASE,
+)
+_YEAR_RE = re.compile(r"\b(?P<num>19[5-9]\d|20[0-4]\d)\b")
+_FLAG_PATTERNS = {
+    "car_play": re.compile(r"\b(?:apple\s*)?car\s*play\b", re.IGNORECASE),
+    "bluetooth": re.compile(r"\bbluetooth\b", re.IGNORECASE),
+}
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class StockQuery:
+    """Predicates parsed from a question."""
+
+    ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = field(default_factory=dict)
+    categories: Dict[str, str] = field(default_factory=dict)
+    flags: Dict[str, bool] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.ranges or self.categories or self.flags)
+
+    @property
+    def has_filters(self) -> bool:
+        """Whether the question names a range or a feature, not only a make or model."""
+        return bool(self.ranges or self.flags)
+
+    def describe(self) -> str:
+        """Return the predicates as readable text for the language model."""
+        parts = [f"{name} = {value}" for name, value in self.categories.items()]
+        for name, (low, high) in self.ranges.items():
+            if low is not None and high is not None:
+                parts.append(f"{name} between {low:g} and {high:g}")
+            elif low is not None:
+                parts.append(f"{name} >= {low:g}")
+            else:
+                parts.append(f"{name} <= {high:g}")
+        parts.extend(f"{name} = {'yes' if value else 'no'}" for name, value in self.flags.items())
+        return ", ".join(parts)
+
+    def bound(self, name: str, low: Optional[float] = None, high: Optional[float] = None) -> None:
+        """Narrow the range of a column, keeping earlier bounds."""
+        old_low, old_high = self.ranges.get(name, (None, None))
+        if low is not None and (old_low is None or low > old_low):
+            old_low = low
+        if high is not None and (old_high is None or high < old_high):
+            old_high = high
+        self.ranges[name] = (old_low, old_high)
+
+
+def _to_number(text: str) -> Tuple[float, bool]:
+    """Parse a number from the question, returning it and whether it had a k suffix."""
+    text = text.strip().lower()
+    multiplier = 1
+    suffix = re.search(r"(k|mil)$", text)
+    if suffix:
+        multiplier = 1000
+        text = text[: suffix.start()]
+    text = text.replace("$", "").replace(" ", "").rstrip(".,")
+    if re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+", text):
+        text = text.replace(",", "").replace(".", "")
+    return float(text.replace(",", ".")) * multiplier, bool(suffix)
+
+
+def _is_bound(match: "re.Match", question: str, has_suffix: bool) -> bool:
+    """Whether a from/since match bounds a column rather than being an unrelated number."""
+    if not re.fullmatch(_SOFT_MIN_WORDS, match["op"], re.IGNORECASE):
+        return True
+    if match["unit"] or has_suffix or "$" in match["num"]:
+        return True
+    year_shaped = _YEAR_RE.fullmatch(match["num"].strip().rstrip(".,")) is not None
+    return year_shaped and bool(
+        match["year"] or _ONWARDS_RE.match(question, match.end())
+    )
+
+
+def _column_for(text: str, value: float, unit: Optional[str], has_suffix: bool) -> str:
+    if unit and unit.lower() in {"km", "kms", "kilometers", "kilometres", "kilometros", "kilómetros", "miles"}:
+        return "km"
+    if not unit and not has_suffix and "$" not in text and 1950 <= value <= 2049 and value.is_integer():
+        return "year"
+    return "price"
+
+
+def parse_stock_query(question: str, table: StockTable) -> StockQuery:
+    """Parse range, category and feature predicates from a question.
+
+    Args:
+        question (str): The standalone question.
+        table (StockTable): The table, used for its makes, models and columns.
+
+    Returns:
+        StockQuery: The predicates, empty (falsy) if the question names none.
+    """
+    query = StockQuery()
+    remaining = question
+
+    def consume(match: "re.Match") -> str:
+        return " " * (match.end() - match.start())
+
+    for match in _BETWEEN_RE.finditer(remaining):
+        low, low_suffix = _to_number(match["low"])
+        high, high_suffix = _to_number(match["high"])
+        # "between 10 and 20 mil": a suffix on either end applies to both
+        if high_suffix and not low_suffix:
+            low *= 1000
+        elif low_suffix and not high_suffix:
+            high *= 1000
+        unit = match["unit"] or match["unit1"]
+        name = _column_for(match["low"], low, unit, low_suffix or high_suffix)
+        query.bound(name, min(low, high), max(low, high))
+    remaining = _BETWEEN_RE.sub(consume, remaining)
+
+    for match in _YEAR_SUFFIX_RE.finditer(remaining):
+        year = float(match["num"])
+        if re.match(r"later|newer|after|more recent|posterior|m[aá]s nuevo", match["op"], re.IGNORECASE):
+            query.bound("year", low=year)
+        else:
+            query.bound("year", high=year)
+    remaining = _YEAR_SUFFIX_RE.sub(consume, remaining)
+
+    bounds = []
+    for match in _BOUND_RE.finditer(remaining):
+        value, has_suffix = _to_number(match["num"])
+        if not _is_bound(match, remaining, has_suffix):
+            continue
+        bounds.append(match)
+        name = _column_for(match["num"], value, match["unit"], has_suffix)
+        op = match["op"].lower()
+        strict = re.fullmatch(_STRICT_WORDS, op) is not None
+        if strict:
+            later = op in {"after", "newer than", "posterior a"}
+            step = 1 if name == "year" else 0
+            if later:
+                query.bound(name, low=value + step)
+            else:
+                query.bound(name, high=value - step)
+        elif re.fullmatch(_MAX_WORDS, op):
+            query.bound(name, high=value)
+        else:
+            query.bound(name, low=value)
+    for match in bounds:
+        remaining = remaining[: match.start()] + consume(match) + remaining[match.end() :]
+
+    for name, pattern in _FLAG_PATTERNS.items():
+        if table.has_index(name) and pattern.search(question):
+            query.flags[name] = True
+
+    words = _WORD_RE.findall(question.lower())
+    text = " ".join(words)
+    for name in ("make", "model"):
+        for label in table.categories(name):
+            if label and re.search(rf"\b{re.escape(label)}\b", text):
+                query.categories[name] = label
+                break
+
+    query.ranges = {name: bounds for name, bounds in query.ranges.items() if table.has_index(name)}
+    # A bare year ("a 2019 Corolla") only counts next to a range or feature, so
+    # unrelated questions that mention a year still go to the vector retriever
+    if query.has_filters and "year" not in query.ranges and table.has_index("year"):
+        years = [float(match["num"]) for match in _YEAR_RE.finditer(remaining)]
+        if len(years) == 1:
+            query.bound("year", years[0], years[0])
+    return query
+
+
+class StructuredStockRetriever(BaseRetriever):
+    """Answers attribute questions from the stock table, others from a fallback retriever."""
+
+    table: StockTable
+    """The columnar stock table."""
+    fallback: BaseRetriever
+    """Retriever for questions without range or feature predicates."""
+    k: int = 6
+    """Maximum number of matching rows returned."""
+    counters: Dict[str, float] = {"structured": 0, "fallback": 0, "query_seconds": 0.0}
+
+    def _structured(self, query: str) -> Optional[List[Document]]:
+        """Return documents for a structured question, or None to use the fallback."""
+        started_at = time.perf_counter()
+        predicates = parse_stock_query(query, self.table)
+        # A make or model alone is not selective enough to skip the vector
+        # retriever, which also finds FAQ answers ("financing for a Toyota")
+        if not predicates.has_filters:
+            self.counters["fallback"] += 1
+            return None
+        rows = self.table.query(
+            ranges=predicates.ranges,
+            categories=predicates.categories,
+            flags=predicates.flags,
+        )
+        self.counters["structured"] += 1
+        self.counters["query_seconds"] += time.perf_counter() - started_at
+        logger.info(f"Structured stock query ({predicates.describe()}) matched {len(rows)} rows")
+        summary = (
+            f"{len(rows)} vehicles in stock match {predicates.describe()}."
+            if len(rows)
+            else f"No vehicles in stock match {predicates.describe()}."
+        )
+        if len(rows) > self.k:
+            summary += f" Showing the {self.k} cheapest."
+        return [
+            Document(page_content=summary, metadata={"source": "stock", "title": ""}),
+            *self.table.to_documents(rows[: self.k]),
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self._structured(query)
+        if docs is None:
+            return self.fallback.invoke(query, {"callbacks": run_manager.get_child()})
+        return docs
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self._structured(query)
+        if docs is None:
+            return await self.fallback.ainvoke(query, {"callbacks": run_manager.get_child()})
+        return docs
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many questions were answered from the table."""
+        structured = self.counters["structured"]
+        return {
+            **self.table.stats(),
+            "structured": structured,
+            "fallback": self.counters["fallback"],
+            "avg_query_microseconds": (
+                self.counters["query_seconds"] / structured * 1e6 if structured else 0.0
+            ),
+        }
@@ -0,0 +1,3 @@
+from .http import get_http_client, close_http_client
+from .telegram import send_telegram_message, stream_telegram_message
+from .twilio import OutboundSender, TwilioSender, LoggingSender, get_outbound_sender
@@ -0,0 +1,43 @@
+"""Shared async HTTP client for outbound calls to messaging providers.
+
+A single pooled client is reused across requests so that every reply does not
+pay for a fresh TCP/TLS handshake with the provider's API.
+"""
+
+import os
+from typing import Optional
+
+import httpx
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide async HTTP client, creating it on first use.
+
+    Pool size and timeouts can be tuned with the HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS and HTTP_TIMEOUT environment variables.
+
+    Returns:
+        httpx.AsyncClient: The shared client.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=float(os.environ.get("HTTP_TIMEOUT", "30")),
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get("HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(
+                    os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+                ),
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and release its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
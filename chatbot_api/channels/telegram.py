@@ -0,0 +1,166 @@
+"""Helpers for talking to the Telegram Bot API."""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from .http import get_http_client
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/{method}"
+
+# Telegram allows roughly one message edit per second in a chat before it starts
+# answering with 429 Too Many Requests.
+TELEGRAM_EDIT_INTERVAL = float(os.environ.get("TELEGRAM_EDIT_INTERVAL", "1.0"))
+
+# Maximum length of a Telegram message text.
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+async def _call_telegram_api(
+    bot_token: str, method: str, payload: Dict[str, Any]
+) -> httpx.Response:
+    """Call a Telegram Bot API method with the shared HTTP client."""
+    return await get_http_client().post(
+        TELEGRAM_API_URL.format(token=bot_token, method=method), json=payload
+    )
+
+
+def _not_modified(response: httpx.Response) -> bool:
+    """Whether an edit was rejected only because it would not change the message."""
+    return response.status_code == 400 and "message is not modified" in response.text
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Return the retry delay Telegram asked for, if the call was rate limited."""
+    if response.status_code != 429:
+        return None
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError):
+        return TELEGRAM_EDIT_INTERVAL
+
+
+async def send_telegram_message(chat_id: int, text: str) -> Dict[str, Any]:
+    """Send a message to a Telegram chat.
+
+    Args:
+        chat_id (int): The Telegram chat to send the message to.
+        text (str): The message text. HTML formatting is allowed.
+
+    Returns:
+        dict: A status dictionary in the same shape the webhook returns.
+    """
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not bot_token:
+        return {"status": "error", "message": "Telegram bot token not configured"}
+
+    payload = {
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": "HTML",  # Allow HTML formatting in the response
+    }
+    response = await _call_telegram_api(bot_token, "sendMessage", payload)
+
+    if response.status_code == 200:
+        return {"status": "success", "message": "Response sent to user"}
+    return {"status": "error", "message": f"Failed to send response: {response.text}"}
+
+
+async def stream_telegram_message(
+    chat_id: int,
+    chunks: AsyncIterator[str],
+    edit_interval: Optional[float] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Deliver a streamed answer to a Telegram chat through progressive edits.
+
+    The first non-empty chunk is sent as a new message as soon as it arrives. Later
+    chunks are coalesced and applied with editMessageText at most once per
+    ``edit_interval`` seconds, backing off when Telegram answers 429. Intermediate
+    edits are plain text because partial HTML may not parse; the final edit always
+    uses HTML formatting like send_telegram_message, even when no text arrived after
+    the last intermediate edit.
+
+    Args:
+        chat_id (int): The Telegram chat to send the message to.
+        chunks (AsyncIterator[str]): The streamed answer chunks.
+        edit_interval (Optional[float]): Minimum seconds between edits. Defaults to
+            TELEGRAM_EDIT_INTERVAL.
+
+    Returns:
+        Tuple[str, dict]: The full answer text and a status dictionary in the same
+            shape the webhook returns.
+    """
+    edit_interval = TELEGRAM_EDIT_INTERVAL if edit_interval is None else edit_interval
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    text = ""
+    sent_text = ""
+    message_id = None
+    next_edit_at = 0.0
+    error = None if bot_token else "Telegram bot token not configured"
+
+    async for chunk in chunks:
+        text += chunk
+        if error or not text.strip() or len(text) > TELEGRAM_MAX_MESSAGE_LENGTH:
+            continue
+        now = time.monotonic()
+        if message_id is None:
+            response = await _call_telegram_api(
+                bot_token, "sendMessage", {"chat_id": chat_id, "text": text}
+            )
+            if response.status_code != 200:
+                error = f"Failed to send response: {response.text}"
+                continue
+            message_id = response.json()["result"]["message_id"]
+            sent_text = text
+            next_edit_at = now + edit_interval
+        elif now >= next_edit_at and text != sent_text:
+            response = await _call_telegram_api(
+                bot_token,
+                "editMessageText",
+                {"chat_id": chat_id, "message_id": message_id, "text": text},
+            )
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                next_edit_at = now + retry_after
+                continue
+            if response.status_code == 200:
+                sent_text = text
+            else:
+                # The next edit carries this text too, the final one retries it
+                logger.warning(f"Failed to edit Telegram message: {response.text}")
+            next_edit_at = now + edit_interval
+
+    if error:
+        return text, {"status": "error", "message": error}
+    if message_id is None:
+        return text, await send_telegram_message(chat_id, text)
+
+    final_text = text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+    payload = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": final_text,
+        "parse_mode": "HTML",
+    }
+    # Always sent, so the HTML formatting does not depend on when the last chunk
+    # arrived; Telegram rejects it as not modified when the text has no formatting.
+    for _ in range(3):
+        await asyncio.sleep(max(0.0, next_edit_at - time.monotonic()))
+        response = await _call_telegram_api(bot_token, "editMessageText", payload)
+        retry_after = _retry_after(response)
+        if retry_after is None:
+            break
+        next_edit_at = time.monotonic() + retry_after
+    if response.status_code != 200 and not _not_modified(response):
+        logger.error(f"Failed to finalize Telegram message: {response.text}")
+        return text, {
+            "status": "error",
+            "message": f"Failed to send response: {response.text}",
+        }
+    return text, {"status": "success", "message": "Response streamed to user"}
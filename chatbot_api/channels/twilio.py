@@ -0,0 +1,90 @@
+"""Outbound senders used to deliver answers to Twilio conversations.
+
+When the webhook acknowledges a message before the answer is ready, the answer
+has to be pushed back to the user out of band. Senders share a small interface
+so the Twilio REST API can be swapped for a local fake during development.
+"""
+
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from .http import get_http_client
+
+logger = logging.getLogger(__name__)
+
+TWILIO_MESSAGES_URL = "https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json"
+
+
+class OutboundSender(ABC):
+    """Base class for outbound message senders."""
+
+    @abstractmethod
+    async def send(self, to: str, text: str, from_: Optional[str] = None) -> None:
+        """Send a message to a user.
+
+        Args:
+            to (str): The recipient address, e.g. a phone or WhatsApp number.
+            text (str): The message body.
+            from_ (Optional[str]): The sender address, if the provider needs one.
+        """
+
+
+class TwilioSender(OutboundSender):
+    """Sends messages through the Twilio Messages REST API."""
+
+    def __init__(
+        self,
+        account_sid: Optional[str] = None,
+        auth_token: Optional[str] = None,
+        from_number: Optional[str] = None,
+    ):
+        self.account_sid = account_sid or os.environ.get("TWILIO_ACCOUNT_SID", "")
+        self.auth_token = auth_token or os.environ.get("TWILIO_AUTH_TOKEN", "")
+        self.from_number = from_number or os.environ.get("TWILIO_FROM_NUMBER")
+
+    async def send(self, to: str, text: str, from_: Optional[str] = None) -> None:
+        from_ = from_ or self.from_number
+        if not from_:
+            raise ValueError("No sender number for Twilio reply")
+        response = await get_http_client().post(
+            TWILIO_MESSAGES_URL.format(sid=self.account_sid),
+            data={"To": to, "From": from_, "Body": text},
+            auth=(self.account_sid, self.auth_token),
+        )
+        if response.status_code >= 300:
+            raise RuntimeError(f"Failed to send Twilio message: {response.text}")
+
+
+class LoggingSender(OutboundSender):
+    """Fake sender that logs and records messages instead of sending them."""
+
+    def __init__(self):
+        self.sent: List[Tuple[str, str]] = []
+
+    async def send(self, to: str, text: str, from_: Optional[str] = None) -> None:
+        self.sent.append((to, text))
+        logger.info(f"Outbound message to {to}: {text}")
+
+
+SENDERS: Dict[str, type] = {
+    "twilio": TwilioSender,
+    "log": LoggingSender,
+}
+
+
+def get_outbound_sender(name: Optional[str] = None) -> OutboundSender:
+    """Create the outbound sender selected by name or the OUTBOUND_SENDER variable.
+
+    Args:
+        name (Optional[str]): The sender name, "twilio" or "log".
+
+    Returns:
+        OutboundSender: The sender instance.
+    """
+    name = name or os.environ.get("OUTBOUND_SENDER", "twilio")
+    try:
+        return SENDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown outbound sender: {name}")
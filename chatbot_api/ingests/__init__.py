@@ -1 +1,5 @@
-from .ingest import *
\ No newline at end of file
+from .ingest import *
+from .version import get_index_version, bump_index_version
+from .embedding_store import EmbeddingStore, StoreBackedEmbeddings
+from .stock_table import StockTable, get_stock_table_path
+from .watch import IngestWatcher, read_watch_stats
@@ -0,0 +1,269 @@
+"""Persistent content-hash embedding store for ingestion.
+
+Re-ingesting with FORCE_UPDATE, under a new index name or from scratch sends every
+chunk back to the embeddings API even though most chunks did not change. The store
+keeps each computed vector on disk under (model, sha256 of the chunk text), so
+ingestion only pays for chunks it has never embedded before.
+
+Layout of a store directory, one per model:
+
+    meta.json      {"model": ..., "dim": ..., "generation": G, "rows": N}
+    keys.txt       one sha256 hex digest per line, line N is row N
+    vectors.f32    row-major float32 matrix, memory-mapped on read
+
+Generation 0 uses the names above, later generations written by compact() are
+keys.G.txt and vectors.G.f32. meta.json is the commit point and is replaced
+atomically: appends are fsynced before "rows" is raised, and a compacted
+generation only becomes current when meta.json names it. On open, rows past the
+committed count, left by an interrupted append, are truncated from both files and
+files of other generations are removed, so keys and vector rows always line up.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from glob import glob
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    """Return the sha256 hex digest of a chunk text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped store of embeddings keyed by content hash."""
+
+    def __init__(self, root: str, model: str):
+        """Open or create the store for a model.
+
+        Args:
+            root (str): Directory holding the stores of all models.
+            model (str): Embedding model name; each model gets its own directory.
+        """
+        self.model = model
+        self.path = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model))
+        os.makedirs(self.path, exist_ok=True)
+        self._meta_path = os.path.join(self.path, "meta.json")
+        self.generation = 0
+        self.dim: Optional[int] = None
+        self._index: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def _keys_path(self) -> str:
+        return self._generation_path("keys", "txt", self.generation)
+
+    @property
+    def _vectors_path(self) -> str:
+        return self._generation_path("vectors", "f32", self.generation)
+
+    def _generation_path(self, name: str, extension: str, generation: int) -> str:
+        suffix = f".{generation}" if generation else ""
+        return os.path.join(self.path, f"{name}{suffix}.{extension}")
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[List[float]]]:
+        """Look up vectors for many content hashes at once.
+
+        Args:
+            keys (Sequence[str]): Content hashes.
+
+        Returns:
+            List[Optional[List[float]]]: The vectors, None where a key is missing.
+        """
+        rows = [self._index.get(key) for key in keys]
+        found = [row for row in rows if row is not None]
+        if not found:
+            return [None] * len(keys)
+        vectors = iter(self._get_matrix()[found].tolist())
+        return [next(vectors) if row is not None else None for row in rows]
+
+    def put_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Append vectors for content hashes that are not stored yet.
+
+        Args:
+            keys (Sequence[str]): Content hashes.
+            vectors (Sequence[Sequence[float]]): The vectors, in the same order.
+        """
+        new_keys, new_rows, seen = [], [], set()
+        for key, vector in zip(keys, vectors):
+            if key in self._index or key in seen:
+                continue
+            seen.add(key)
+            new_keys.append(key)
+            new_rows.append(vector)
+        if not new_keys:
+            return
+        matrix = np.asarray(new_rows, dtype=np.float32)
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+            self._write_meta(0)
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {matrix.shape[1]} does not match store dimension {self.dim}"
+            )
+        # The rows only count once meta.json says so; a crash before that leaves
+        # an uncommitted tail that the next open truncates
+        _write_synced(self._vectors_path, matrix.tobytes(), "ab")
+        _write_synced(self._keys_path, "".join(f"{key}\n" for key in new_keys).encode(), "ab")
+        self._write_meta(len(self._index) + len(new_keys))
+        start = len(self._index)
+        for offset, key in enumerate(new_keys):
+            self._index[key] = start + offset
+        self._matrix = None
+
+    def compact(self, keep: Iterable[str]) -> int:
+        """Rewrite the store keeping only the given content hashes.
+
+        Args:
+            keep (Iterable[str]): Content hashes to keep.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        keep_keys = [key for key in dict.fromkeys(keep) if key in self._index]
+        removed = len(self._index) - len(keep_keys)
+        if removed == 0:
+            return 0
+        matrix = self._get_matrix()[[self._index[key] for key in keep_keys]]
+        matrix = np.asarray(matrix, dtype=np.float32)
+        self._matrix = None
+        # Both files of the new generation are complete before meta.json switches
+        # to it, so readers see either the old or the new store, never a mix
+        previous = self.generation
+        self.generation = previous + 1
+        try:
+            _write_synced(self._vectors_path, matrix.tobytes(), "wb")
+            _write_synced(self._keys_path, "".join(f"{key}\n" for key in keep_keys).encode(), "wb")
+            self._write_meta(len(keep_keys))
+        except BaseException:
+            self.generation = previous
+            self._remove_other_generations()
+            raise
+        self._remove_other_generations()
+        self._index = {key: row for row, key in enumerate(keep_keys)}
+        return removed
+
+    def _load(self) -> None:
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.generation = meta.get("generation", 0)
+        self._remove_other_generations()
+        keys: List[str] = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "rb") as f:
+                # The last piece is empty or a line cut off by an interrupted write
+                keys = f.read().decode("utf-8", "replace").split("\n")[:-1]
+        vector_rows = (
+            os.path.getsize(self._vectors_path) // (4 * self.dim)
+            if os.path.exists(self._vectors_path)
+            else 0
+        )
+        # Stores written before meta.json counted rows commit what both files hold
+        rows = min(len(keys), vector_rows, meta.get("rows", len(keys)))
+        self._truncate(rows, keys)
+        if meta.get("rows") != rows:
+            self._write_meta(rows)
+        self._index = {key: row for row, key in enumerate(keys[:rows])}
+
+    def _truncate(self, rows: int, keys: List[str]) -> None:
+        """Drop rows past the committed count from both files."""
+        vectors_size = rows * self.dim * 4
+        if os.path.exists(self._vectors_path) and os.path.getsize(self._vectors_path) > vectors_size:
+            logger.warning(f"Truncating uncommitted embeddings in {self.path} to {rows} rows")
+            os.truncate(self._vectors_path, vectors_size)
+        keys_size = sum(len(key.encode("utf-8")) + 1 for key in keys[:rows])
+        if os.path.exists(self._keys_path) and os.path.getsize(self._keys_path) > keys_size:
+            os.truncate(self._keys_path, keys_size)
+
+    def _write_meta(self, rows: int) -> None:
+        """Atomically replace meta.json, committing the generation and row count."""
+        meta = {"model": self.model, "dim": self.dim, "generation": self.generation, "rows": rows}
+        _write_synced(f"{self._meta_path}.tmp", json.dumps(meta).encode(), "wb")
+        os.replace(f"{self._meta_path}.tmp", self._meta_path)
+
+    def _remove_other_generations(self) -> None:
+        """Delete files of generations meta.json does not name, e.g. an interrupted compaction."""
+        current = {self._keys_path, self._vectors_path}
+        for path in glob(os.path.join(self.path, "keys*.txt")) + glob(
+            os.path.join(self.path, "vectors*.f32")
+        ):
+            if path not in current:
+                os.remove(path)
+
+    def _get_matrix(self) -> np.memmap:
+        if self._matrix is None:
+            self._matrix = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._index), self.dim)
+            )
+        return self._matrix
+
+
+def _write_synced(path: str, data: bytes, mode: str) -> None:
+    """Write or append bytes and flush them to disk before returning."""
+    with open(path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class StoreBackedEmbeddings(Embeddings):
+    """Embeddings wrapper that reuses stored document vectors by content hash."""
+
+    def __init__(self, underlying: Embeddings, store: EmbeddingStore):
+        """Initialize the wrapper.
+
+        Args:
+            underlying (Embeddings): The embeddings model to call for unseen texts.
+            store (EmbeddingStore): The store holding previously computed vectors.
+        """
+        self.underlying = underlying
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_hash(text) for text in texts]
+        vectors = self.store.get_many(keys)
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for vector in vectors if vector is None)
+        self.misses += len(missing)
+        if missing:
+            computed = self.underlying.embed_documents(list(missing.values()))
+            self.store.put_many(list(missing), computed)
+            by_key = dict(zip(missing, computed))
+            vectors = [
+                vector if vector is not None else by_key[key]
+                for key, vector in zip(keys, vectors)
+            ]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many document embeddings were reused from the store."""
+        total = self.hits + self.misses
+        return {
+            "stored": len(self.store),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,21 +1,33 @@
 """This module loads HTML from files, cleans up, splits, and ingests into Weaviate."""
 
+import argparse
 import logging
 import os
 import re
-import weaviate
 import glob
 import csv
+from functools import partial
+from typing import Iterator, List, Optional, Set
 
 from chatbot_api.parsers import custom_site_extractor
 from bs4 import BeautifulSoup, SoupStrainer
 from chatbot_api.constants import WEAVIATE_DOCS_INDEX_NAME
+from chatbot_api.ingests.embedding_store import EmbeddingStore, StoreBackedEmbeddings
+from chatbot_api.ingests.manifest import SourceManifest
+from chatbot_api.ingests.parallel import ParseTimings, parallel_parse
+from chatbot_api.ingests.pipeline import IngestPipeline
+from chatbot_api.ingests.stock_table import StockTable, get_stock_table_path
+from chatbot_api.ingests.version import bump_index_version
+from chatbot_api.ingests.watch import IngestWatcher
+from chatbot_api.vectorstores import LocalVectorStore, get_vector_store_connection
 from langchain.document_loaders import RecursiveUrlLoader, SitemapLoader, CSVLoader, UnstructuredMarkdownLoader
 from langchain.indexes import SQLRecordManager, index
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.utils.html import PREFIXES_TO_IGNORE_REGEX, SUFFIXES_TO_IGNORE_REGEX
 from langchain_community.vectorstores import Weaviate
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
 from langchain_openai import OpenAIEmbeddings
 
 logging.basicConfig(level=logging.INFO)
@@ -31,6 +43,26 @@ def get_embeddings_model() -> Embeddings:
     return OpenAIEmbeddings(model="text-embedding-3-small", chunk_size=200)
 
 
+def get_ingest_embeddings_model() -> Embeddings:
+    """Create the embeddings model used for ingestion.
+
+    Unless EMBEDDING_STORE_DIR is set to an empty value, document vectors are
+    looked up in a persistent content-hash store before calling the API, so
+    unchanged chunks are never embedded twice.
+
+    Returns:
+        Embeddings: The embeddings model, backed by the store when enabled.
+    """
+    embedding = get_embeddings_model()
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    store_dir = os.environ.get(
+        "EMBEDDING_STORE_DIR", os.path.join(data_dir, ".embedding_store")
+    )
+    if not store_dir:
+        return embedding
+    return StoreBackedEmbeddings(embedding, EmbeddingStore(store_dir, embedding.model))
+
+
 def metadata_extractor(meta: dict, soup: BeautifulSoup) -> dict:
     """Extract metadata from the given BeautifulSoup object.
 
@@ -53,11 +85,11 @@ def metadata_extractor(meta: dict, soup: BeautifulSoup) -> dict:
     }
 
 
-def load_custom_site():
-    """Load the custom site using a SitemapLoader.
+def lazy_load_custom_site() -> Iterator[Document]:
+    """Lazily load the custom site using a SitemapLoader.
 
     Returns:
-        list: The loaded documents from the custom site.
+        Iterator[Document]: The documents from the custom site, one page at a time.
     """
     return SitemapLoader(
         os.environ.get("LOAD_CUSTOM_SITE_URL"),
@@ -70,19 +102,42 @@ def load_custom_site():
             ),
         },
         meta_function=metadata_extractor,
-    ).load()
+    ).lazy_load()
 
 
-def load_custom_blog():
-    """Load the custom blog using a RecursiveUrlLoader.
+def load_custom_site():
+    """Load the custom site using a SitemapLoader.
 
     Returns:
-        list: The loaded documents from the custom blog.
+        list: The loaded documents from the custom site.
     """
-    return RecursiveUrlLoader(
+    return list(lazy_load_custom_site())
+
+
+def extract_page(doc: Document) -> Document:
+    """Replace the raw HTML of a crawled page with its text, in a parse worker process.
+
+    Args:
+        doc (Document): The page with raw HTML content.
+
+    Returns:
+        Document: The page with extracted text.
+    """
+    return Document(page_content=simple_extractor(doc.page_content), metadata=doc.metadata)
+
+
+def lazy_load_custom_blog() -> Iterator[Document]:
+    """Lazily load the custom blog using a RecursiveUrlLoader.
+
+    The crawler keeps the raw HTML and text extraction runs in INGEST_PARSE_WORKERS
+    processes, in crawl order.
+
+    Returns:
+        Iterator[Document]: The documents from the custom blog, one page at a time.
+    """
+    pages = RecursiveUrlLoader(
         url=os.environ.get("LOAD_CUSTOM_BLOG_URL"),
         max_depth=8,
-        extractor=simple_extractor,
         prevent_outside=True,
         use_async=True,
         timeout=600,
@@ -92,7 +147,25 @@ def load_custom_blog():
             r"(?:[\#'\"]|\/[\#'\"])"
         ),
         check_response_status=True,
-    ).load()
+    ).lazy_load()
+    timings = ParseTimings("custom blog")
+    for result in parallel_parse(extract_page, pages):
+        source = result.item.metadata.get("source", "")
+        timings.record(source, result)
+        if result.error is not None:
+            logger.error(f"Error extracting {source}: {result.error}")
+            continue
+        yield result.value
+    timings.log()
+
+
+def load_custom_blog():
+    """Load the custom blog using a RecursiveUrlLoader.
+
+    Returns:
+        list: The loaded documents from the custom blog.
+    """
+    return list(lazy_load_custom_blog())
 
 
 def simple_extractor(html: str) -> str:
@@ -108,22 +181,60 @@ def simple_extractor(html: str) -> str:
     return re.sub(r"\n\n+", "\n\n", soup.text).strip()
 
 
-def load_custom_stock():
-    """Load all CSV files from the data directory.
+def get_csv_files() -> List[str]:
+    """Return the stock CSV files in the data directory, sorted.
 
     Returns:
-        list: The loaded documents from all CSV files in the data directory.
+        List[str]: Paths of the CSV files.
     """
     data_dir = os.environ.get("DATA_DIR", "/app/data")
-    csv_files = glob.glob(os.path.join(data_dir, "*.csv"))
+    return sorted(glob.glob(os.path.join(data_dir, "*.csv")))
+
+
+def save_stock_table(csv_files: List[str]) -> None:
+    """Build the columnar stock table from CSV files and write it to STOCK_TABLE_PATH.
+
+    Args:
+        csv_files (List[str]): All stock CSV files.
+    """
+    try:
+        stock_table = StockTable.from_csv_files(csv_files)
+        stock_table.save(get_stock_table_path())
+        logger.info(f"Saved stock table: {stock_table.stats()}")
+    except Exception as e:
+        logger.error(f"Error building stock table: {str(e)}")
+
+
+def lazy_load_custom_stock(
+    csv_files: Optional[List[str]] = None, failed_sources: Optional[Set[str]] = None
+) -> Iterator[Document]:
+    """Lazily load CSV files from the data directory, one row at a time.
+
+    Besides the documents, a typed columnar copy of the rows of all CSV files is
+    written to STOCK_TABLE_PATH for structured queries on price, km, year, make and
+    model, whenever a file was loaded or the table does not exist yet.
+
+    Args:
+        csv_files (Optional[List[str]]): The files to load, all CSV files in the
+            data directory if None.
+        failed_sources (Optional[Set[str]]): Receives the files that failed to load,
+            possibly after some of their documents were yielded.
+
+    Returns:
+        Iterator[Document]: The documents from the CSV files.
+    """
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    all_csv_files = get_csv_files()
+    if csv_files is None:
+        csv_files = all_csv_files
     
-    if not csv_files:
+    if not all_csv_files:
         logger.warning(f"No CSV files found in {data_dir}")
-        return []
+        return
     
-    all_docs = []
     for csv_file in csv_files:
         logger.info(f"Loading CSV file: {csv_file}")
+        count = 0
         try:
             # Default fieldnames for stock data
             fieldnames = [
@@ -148,20 +259,99 @@ def load_custom_stock():
                 if header:
                     fieldnames = header
             
-            docs = CSVLoader(
+            for doc in CSVLoader(
                 file_path=csv_file,
                 csv_args={
                     "delimiter": ",",
                     "fieldnames": fieldnames,
                 },
-            ).load()
-            
-            all_docs.extend(docs)
-            logger.info(f"Loaded {len(docs)} documents from {csv_file}")
+            ).lazy_load():
+                # Without the row position a chunk hash depends only on the row
+                # content, so inserting or deleting a row leaves the others untouched
+                # and re-ingesting a file only embeds the rows that changed
+                doc.metadata.pop("row", None)
+                count += 1
+                yield doc
+            logger.info(f"Loaded {count} documents from {csv_file}")
         except Exception as e:
-            logger.error(f"Error loading {csv_file}: {str(e)}")
+            logger.error(f"Error loading {csv_file} after {count} documents: {str(e)}")
+            if failed_sources is not None:
+                failed_sources.add(csv_file)
+
+    if csv_files or not os.path.exists(get_stock_table_path()):
+        save_stock_table(all_csv_files)
+
+
+def load_custom_stock():
+    """Load all CSV files from the data directory.
+
+    Returns:
+        list: The loaded documents from all CSV files in the data directory.
+    """
+    return list(lazy_load_custom_stock())
+
+
+def parse_markdown_file(markdown_file: str) -> List[Document]:
+    """Parse one Markdown file, in a parse worker process.
+
+    Args:
+        markdown_file (str): Path of the Markdown file.
+
+    Returns:
+        List[Document]: The documents of the file.
+    """
+    return UnstructuredMarkdownLoader(file_path=markdown_file).load()
+
+
+def get_markdown_files() -> List[str]:
+    """Return the Markdown files in the data/markdown directory, sorted.
+
+    Returns:
+        List[str]: Paths of the Markdown files.
+    """
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    return sorted(glob.glob(os.path.join(data_dir, "markdown", "*.md")))
+
+
+def lazy_load_markdown_files(
+    markdown_files: Optional[List[str]] = None, failed_sources: Optional[Set[str]] = None
+) -> Iterator[Document]:
+    """Lazily load Markdown files from the data/markdown directory.
+
+    Files are parsed in INGEST_PARSE_WORKERS processes and yielded in a stable
+    (sorted) order; a file that fails to parse is logged and skipped.
+
+    Args:
+        markdown_files (Optional[List[str]]): The files to load, all Markdown files
+            in the data/markdown directory if None.
+        failed_sources (Optional[Set[str]]): Receives the files that failed to parse.
+
+    Returns:
+        Iterator[Document]: The documents from the Markdown files.
+    """
+    if markdown_files is None:
+        markdown_files = get_markdown_files()
+        if not markdown_files:
+            data_dir = os.environ.get("DATA_DIR", "/app/data")
+            logger.warning(f"No Markdown files found in {os.path.join(data_dir, 'markdown')}")
+            return
+    if not markdown_files:
+        return
     
-    return all_docs
+    timings = ParseTimings("markdown files")
+    for result in parallel_parse(parse_markdown_file, markdown_files):
+        markdown_file = result.item
+        timings.record(markdown_file, result)
+        if result.error is not None:
+            logger.error(f"Error loading {markdown_file}: {result.error}")
+            if failed_sources is not None:
+                failed_sources.add(markdown_file)
+            continue
+        logger.info(
+            f"Loaded {len(result.value)} documents from {markdown_file} in {result.seconds:.3f}s"
+        )
+        yield from result.value
+    timings.log()
 
 
 def load_markdown_files():
@@ -170,107 +360,226 @@ def load_markdown_files():
     Returns:
         list: The loaded documents from all Markdown files in the data/markdown directory.
     """
-    data_dir = os.environ.get("DATA_DIR", "/app/data")
-    markdown_dir = os.path.join(data_dir, "markdown")
-    markdown_files = glob.glob(os.path.join(markdown_dir, "*.md"))
-    
-    if not markdown_files:
-        logger.warning(f"No Markdown files found in {markdown_dir}")
-        return []
-    
-    all_docs = []
-    for markdown_file in markdown_files:
-        logger.info(f"Loading Markdown file: {markdown_file}")
-        try:
-            docs = UnstructuredMarkdownLoader(
-                file_path=markdown_file,
-            ).load()
-            
-            all_docs.extend(docs)
-            logger.info(f"Loaded {len(docs)} documents from {markdown_file}")
-        except Exception as e:
-            logger.error(f"Error loading {markdown_file}: {str(e)}")
-    
-    return all_docs
+    return list(lazy_load_markdown_files())
+
+
+def delete_sources(
+    sources: List[str],
+    record_manager: SQLRecordManager,
+    vectorstore: VectorStore,
+    before: Optional[float] = None,
+) -> int:
+    """Delete the indexed chunks of sources that no longer exist.
+
+    Args:
+        sources (List[str]): Source ids, as in the "source" metadata of the chunks.
+        record_manager (SQLRecordManager): The record manager of the index.
+        vectorstore (VectorStore): The vector store holding the chunks.
+        before (Optional[float]): Only delete chunks not indexed since this record
+            manager time, i.e. the stale chunks of sources that were re-indexed.
+
+    Returns:
+        int: The number of deleted chunks.
+    """
+    if not sources:
+        return 0
+    keys = record_manager.list_keys(group_ids=sources, before=before)
+    if keys:
+        vectorstore.delete(keys)
+        record_manager.delete_keys(keys)
+    kind = "stale chunks of re-indexed" if before is not None else "chunks of removed"
+    logger.info(f"Deleted {len(keys)} {kind} {len(sources)} sources")
+    return len(keys)
+
+
+def reconcile_local_store(
+    record_manager: SQLRecordManager, vectorstore: LocalVectorStore
+) -> int:
+    """Make the record manager and the persisted LocalVectorStore agree.
+
+    index() commits the record manager after every batch, while the local store
+    reaches disk only when persisted. After a run that died in between, keys the
+    record manager knows but the store lost are forgotten so they are indexed again,
+    and rows the record manager does not know are deleted from the store.
+
+    Args:
+        record_manager (SQLRecordManager): The record manager of the index.
+        vectorstore (LocalVectorStore): The store, as loaded from disk.
+
+    Returns:
+        int: The number of keys and rows removed.
+    """
+    keys = set(record_manager.list_keys())
+    ids = set(vectorstore.ids)
+    lost_keys = list(keys - ids)
+    orphan_ids = list(ids - keys)
+    if lost_keys:
+        record_manager.delete_keys(lost_keys)
+    if orphan_ids:
+        vectorstore.delete(orphan_ids)
+    if lost_keys or orphan_ids:
+        logger.warning(
+            f"Reconciled the local vector store: {len(lost_keys)} keys to re-index, "
+            f"{len(orphan_ids)} orphan rows deleted"
+        )
+    return len(lost_keys) + len(orphan_ids)
 
 
 def ingest_docs():
     """Ingest documents into Weaviate.
 
     This function loads documents from the custom site, custom stock, custom blog, and markdown files,
-    transforms them, and ingests them into Weaviate.
+    transforms them, and ingests them into Weaviate, or into the in-process LocalVectorStore
+    when VECTOR_STORE is "local". A source manifest lets later runs skip unchanged files
+    before loading them and delete the chunks of removed files.
     """
-    WEAVIATE_URL = os.environ["WEAVIATE_URL"]
-    WEAVIATE_API_KEY = os.environ["WEAVIATE_API_KEY"]
     RECORD_MANAGER_DB_URL = os.environ["RECORD_MANAGER_DB_URL"]
+    VECTOR_STORE = os.environ.get("VECTOR_STORE", "weaviate").lower()
 
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=200)
-    embedding = get_embeddings_model()
-
-    client = weaviate.Client(
-        url=WEAVIATE_URL,
-        auth_client_secret=weaviate.AuthApiKey(api_key=WEAVIATE_API_KEY),
-    )
-    vectorstore = Weaviate(
-        client=client,
-        index_name=WEAVIATE_DOCS_INDEX_NAME,
-        text_key="text",
-        embedding=embedding,
-        by_text=False,
-        attributes=["source", "title"],
-    )
+    embedding = get_ingest_embeddings_model()
+
+    if VECTOR_STORE == "local":
+        client = None
+        vectorstore = LocalVectorStore.from_env(embedding, WEAVIATE_DOCS_INDEX_NAME)
+    else:
+        client = get_vector_store_connection().client
+        vectorstore = Weaviate(
+            client=client,
+            index_name=WEAVIATE_DOCS_INDEX_NAME,
+            text_key="text",
+            embedding=embedding,
+            by_text=False,
+            attributes=["source", "title"],
+        )
 
     record_manager = SQLRecordManager(
-        f"weaviate/{WEAVIATE_DOCS_INDEX_NAME}", db_url=RECORD_MANAGER_DB_URL
+        f"{VECTOR_STORE}/{WEAVIATE_DOCS_INDEX_NAME}", db_url=RECORD_MANAGER_DB_URL
     )
     record_manager.create_schema()
-
-    #docs_from_custom = load_custom_site()
-    #logger.info(f"Loaded {len(docs_from_custom)} docs from custom")
-    docs_from_custom_stock = load_custom_stock()
-    logger.info(f"Loaded {len(docs_from_custom_stock)} docs from custom stock")
-    #docs_from_custom_blog = load_custom_blog()
-    #logger.info(f"Loaded {len(docs_from_custom_blog)} docs from custom blog")
-    docs_from_markdown = load_markdown_files()
-    logger.info(f"Loaded {len(docs_from_markdown)} docs from markdown files")
-
-    #docs_transformed = text_splitter.split_documents(
-    #    docs_from_custom + docs_from_custom_stock + docs_from_custom_blog
-    #)
-    docs_transformed = text_splitter.split_documents(
-        docs_from_custom_stock + docs_from_markdown
+    if isinstance(vectorstore, LocalVectorStore):
+        reconcile_local_store(record_manager, vectorstore)
+
+    force_update = (os.environ.get("FORCE_UPDATE") or "false").lower() == "true"
+    manifest = SourceManifest.from_env()
+    # Without a manifest, or when asked to, every source goes through the pipeline
+    # and the record manager removes whatever was not seen
+    full = (
+        force_update
+        or not len(manifest)
+        or (os.environ.get("INGEST_FULL") or "false").lower() == "true"
     )
-    docs_transformed = [doc for doc in docs_transformed if len(doc.page_content) > 10]
-
-    # We try to return 'source' and 'title' metadata when querying vector store and
-    # Weaviate will error at query time if one of the attributes is missing from a
-    # retrieved document.
-    for doc in docs_transformed:
-        if "source" not in doc.metadata:
-            doc.metadata["source"] = ""
-        if "title" not in doc.metadata:
-            doc.metadata["title"] = ""
-
-    indexing_stats = index(
-        docs_transformed,
-        record_manager,
-        vectorstore,
-        cleanup="full",
-        source_id_key="source",
-        force_update=(os.environ.get("FORCE_UPDATE") or "false").lower() == "true",
+    csv_files, unchanged_csv_files = manifest.changed_files(get_csv_files())
+    markdown_files, unchanged_markdown_files = manifest.changed_files(get_markdown_files())
+    # Sources that failed to load keep their chunks and manifest entries
+    failed_sources: Set[str] = set()
+    if full:
+        sources = {
+            #"custom site": lazy_load_custom_site,
+            "custom stock": partial(lazy_load_custom_stock, failed_sources=failed_sources),
+            #"custom blog": lazy_load_custom_blog,
+            "markdown files": partial(
+                lazy_load_markdown_files, failed_sources=failed_sources
+            ),
+        }
+        removed_sources = []
+    else:
+        logger.info(
+            f"Incremental ingest: {len(csv_files)} changed CSV files "
+            f"({len(unchanged_csv_files)} unchanged), {len(markdown_files)} changed "
+            f"Markdown files ({len(unchanged_markdown_files)} unchanged)"
+        )
+        sources = {
+            "custom stock": partial(lazy_load_custom_stock, csv_files, failed_sources),
+            "markdown files": partial(lazy_load_markdown_files, markdown_files, failed_sources),
+        }
+        removed_sources = manifest.removed()
+
+    compact = (os.environ.get("EMBEDDING_STORE_COMPACT") or "false").lower() == "true"
+    pipeline = IngestPipeline(
+        text_splitter,
+        log_every=int(os.environ.get("INGEST_LOG_EVERY", "1000")),
+        collect_hashes=compact and full and isinstance(embedding, StoreBackedEmbeddings),
     )
 
+    # Documents stream from the loaders into index(), which embeds and writes them
+    # INGEST_BATCH_SIZE at a time, so the corpus is never held in memory at once.
+    # Incremental runs only see changed sources, so cleanup is limited to those. It
+    # runs after the whole pass rather than per batch, since a source spans batches.
+    # The local store is persisted even when indexing fails, so the batches the
+    # record manager already committed are on disk too.
+    try:
+        index_started_at = record_manager.get_time()
+        indexing_stats = index(
+            pipeline.run(sources),
+            record_manager,
+            vectorstore,
+            batch_size=int(os.environ.get("INGEST_BATCH_SIZE", "100")),
+            cleanup="full" if full else None,
+            source_id_key="source",
+            force_update=force_update,
+        )
+        if not full:
+            stale_sources = set(csv_files) | set(markdown_files) | pipeline.sources
+            indexing_stats["num_deleted"] += delete_sources(
+                sorted(stale_sources - failed_sources - {""}),
+                record_manager,
+                vectorstore,
+                before=index_started_at,
+            )
+        if removed_sources:
+            indexing_stats["num_deleted"] += delete_sources(
+                removed_sources, record_manager, vectorstore
+            )
+            if any(source.endswith(".csv") for source in removed_sources):
+                save_stock_table(get_csv_files())
+    finally:
+        if isinstance(vectorstore, LocalVectorStore):
+            vectorstore.persist()
+    if failed_sources:
+        logger.warning(f"Not recording {len(failed_sources)} sources that failed to load")
+        manifest.discard(failed_sources)
+    manifest.save()
+
+    logger.info(f"Ingest pipeline stats: {pipeline.stats()}")
     logger.info(f"Indexing stats: {indexing_stats}")
-    num_vecs = client.query.aggregate(WEAVIATE_DOCS_INDEX_NAME).with_meta_count().do()
+    if isinstance(embedding, StoreBackedEmbeddings):
+        logger.info(f"Embedding store stats: {embedding.stats()}")
+        if compact and full:
+            removed = embedding.store.compact(pipeline.hashes)
+            logger.info(f"Compacted embedding store, removed {removed} vectors")
+    if indexing_stats["num_added"] or indexing_stats["num_updated"] or indexing_stats["num_deleted"]:
+        # Let the API drop cached answers built from the previous index
+        logger.info(f"Index version is now {bump_index_version()}")
+    if isinstance(vectorstore, LocalVectorStore):
+        num_vecs = vectorstore.stats()
+    else:
+        num_vecs = client.query.aggregate(WEAVIATE_DOCS_INDEX_NAME).with_meta_count().do()
     logger.info(
         f"LangChain now has this many vectors: {num_vecs}",
     )
+    return indexing_stats
+
+
+def watch_docs() -> None:
+    """Watch the CSV and Markdown files in DATA_DIR and ingest changes as they happen."""
+    IngestWatcher.from_env(
+        ingest_docs, lambda: get_csv_files() + get_markdown_files()
+    ).run()
 
 
 if __name__ == "__main__":
     """Main execution point of the application.
 
     This block is executed when the module is run directly, not when it is imported.
-    It starts the ingestion of documents into Weaviate.
+    It starts the ingestion of documents into Weaviate, or with --watch keeps
+    ingesting changes to the data directory.
     """
+    parser = argparse.ArgumentParser(description="Ingest documents into the vector store.")
+    parser.add_argument(
+        "--watch", action="store_true", help="keep running and ingest changed files"
+    )
+    args = parser.parse_args()
     ingest_docs()
+    if args.watch:
+        watch_docs()
@@ -0,0 +1,118 @@
+"""Source manifest for incremental ingestion.
+
+The record manager only deduplicates chunks after every source has been loaded,
+parsed, split and hashed again. The manifest remembers the size, mtime and content
+hash of every source file under DATA_DIR, so ingestion can skip unchanged sources
+before loading them and re-index or delete only the sources that changed or
+disappeared.
+
+Entries are staged while ingesting and only written by save(), after indexing
+succeeded, so a failed run is retried in full on the next one. Sources that failed
+to load are discarded from the staged entries and retried on the next run as well.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def get_manifest_path() -> str:
+    """Return the path of the source manifest.
+
+    Returns:
+        str: The INGEST_MANIFEST_PATH variable, or .ingest_manifest.json inside DATA_DIR.
+    """
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    return os.environ.get(
+        "INGEST_MANIFEST_PATH", os.path.join(data_dir, ".ingest_manifest.json")
+    )
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Return the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SourceManifest:
+    """Size, mtime and content hash of every ingested source."""
+
+    def __init__(self, path: Optional[str] = None):
+        """Load the manifest.
+
+        Args:
+            path (Optional[str]): JSON file holding the manifest. Memory only if None.
+        """
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._seen: Set[str] = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @classmethod
+    def from_env(cls) -> "SourceManifest":
+        """Load the manifest from INGEST_MANIFEST_PATH."""
+        return cls(get_manifest_path())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def changed_files(self, paths: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """Split files into changed and unchanged ones.
+
+        Size and mtime are compared first; only files whose stat changed are hashed,
+        so touching a file without editing it does not re-index it.
+
+        Args:
+            paths (Iterable[str]): Paths of the current source files.
+
+        Returns:
+            Tuple[List[str], List[str]]: The changed (or new) and the unchanged files.
+        """
+        changed, unchanged = [], []
+        for path in paths:
+            self._seen.add(path)
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                unchanged.append(path)
+                continue
+            sha256 = file_hash(path)
+            self._pending[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+            if entry and entry["sha256"] == sha256:
+                unchanged.append(path)
+            else:
+                changed.append(path)
+        return changed, unchanged
+
+    def discard(self, sources: Iterable[str]) -> None:
+        """Drop the staged entries of sources that failed to load, so they are retried."""
+        for source in sources:
+            self._pending.pop(source, None)
+
+    def removed(self) -> List[str]:
+        """Return the sources in the manifest that were not seen in this run."""
+        return sorted(set(self.entries) - self._seen)
+
+    def save(self) -> None:
+        """Apply the staged entries, forget removed sources and write the manifest."""
+        for source in self.removed():
+            del self.entries[source]
+        self.entries.update(self._pending)
+        self._pending = {}
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Saved ingest manifest with {len(self.entries)} sources to {self.path}")
@@ -0,0 +1,156 @@
+"""Streaming document pipeline for ingestion.
+
+Documents flow one at a time from the loaders through splitting, filtering and
+metadata normalization into ``index()``, which embeds and writes them in batches of
+INGEST_BATCH_SIZE. Nothing holds the whole corpus, so peak memory depends on the
+batch size rather than the corpus size. Each stage is metered, and progress is
+logged every INGEST_LOG_EVERY documents.
+"""
+
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set
+
+from langchain_core.documents import Document
+from langchain.text_splitter import TextSplitter
+
+from chatbot_api.ingests.embedding_store import content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class StageMeter:
+    """Counts the items a pipeline stage yields and the time spent producing them."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+
+    def wrap(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Yield from items, timing every step.
+
+        The measured time includes the upstream stages, the pipeline subtracts them
+        to report the time of each stage alone.
+        """
+        iterator = iter(items)
+        while True:
+            started_at = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds += time.perf_counter() - started_at
+                return
+            self.seconds += time.perf_counter() - started_at
+            self.count += 1
+            yield item
+
+
+class IngestPipeline:
+    """Streams documents from loaders through splitting, filtering and normalization."""
+
+    def __init__(
+        self,
+        text_splitter: TextSplitter,
+        min_length: int = 10,
+        log_every: int = 1000,
+        collect_hashes: bool = False,
+    ):
+        """Initialize the pipeline.
+
+        Args:
+            text_splitter (TextSplitter): Splits documents into chunks.
+            min_length (int): Chunks with this many characters or fewer are dropped.
+            log_every (int): Log stage throughput every this many output chunks.
+            collect_hashes (bool): Remember the content hash of every output chunk,
+                e.g. to compact the embedding store afterwards.
+        """
+        self.text_splitter = text_splitter
+        self.min_length = min_length
+        self.log_every = log_every
+        self.hashes: Optional[Set[str]] = set() if collect_hashes else None
+        self.source_counts: Dict[str, int] = {}
+        self.sources: Set[str] = set()
+        self.meters = [StageMeter(name) for name in ("load", "split", "filter", "normalize")]
+        self._started_at: Optional[float] = None
+
+    def run(self, sources: Dict[str, Callable[[], Iterable[Document]]]) -> Iterator[Document]:
+        """Stream the chunks of all sources.
+
+        Args:
+            sources (Dict[str, Callable[[], Iterable[Document]]]): Source name to a
+                function returning a lazy iterable of its documents.
+
+        Returns:
+            Iterator[Document]: The normalized chunks, ready for index().
+        """
+        load, split, filter_, normalize = self.meters
+        self._started_at = time.perf_counter()
+        docs = load.wrap(self._load(sources))
+        docs = split.wrap(self._split(docs))
+        docs = filter_.wrap(doc for doc in docs if len(doc.page_content) > self.min_length)
+        docs = normalize.wrap(self._normalize(docs))
+        for doc in docs:
+            yield doc
+            if normalize.count % self.log_every == 0:
+                self.log_progress()
+        self.log_progress()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return items and throughput per stage.
+
+        Stage seconds exclude upstream stages; "index" is the time spent in
+        index() itself, i.e. embedding and writing to the vector store.
+        """
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        stages: Dict[str, Any] = {}
+        upstream = 0.0
+        for meter in self.meters:
+            own = max(0.0, meter.seconds - upstream)
+            upstream = meter.seconds
+            stages[meter.name] = {
+                "items": meter.count,
+                "seconds": own,
+                "items_per_second": meter.count / own if own else 0.0,
+            }
+        index_seconds = max(0.0, elapsed - upstream)
+        output = self.meters[-1].count
+        stages["index"] = {
+            "items": output,
+            "seconds": index_seconds,
+            "items_per_second": output / index_seconds if index_seconds else 0.0,
+        }
+        return {"elapsed_seconds": elapsed, "sources": dict(self.source_counts), "stages": stages}
+
+    def log_progress(self) -> None:
+        stats = self.stats()
+        rates = ", ".join(
+            f"{name} {stage['items']} ({stage['items_per_second']:.1f}/s)"
+            for name, stage in stats["stages"].items()
+        )
+        logger.info(f"Ingest pipeline after {stats['elapsed_seconds']:.1f}s: {rates}")
+
+    def _load(self, sources: Dict[str, Callable[[], Iterable[Document]]]) -> Iterator[Document]:
+        for name, source in sources.items():
+            count = 0
+            for doc in source():
+                count += 1
+                yield doc
+            self.source_counts[name] = count
+            logger.info(f"Loaded {count} docs from {name}")
+
+    def _split(self, docs: Iterable[Document]) -> Iterator[Document]:
+        for doc in docs:
+            yield from self.text_splitter.split_documents([doc])
+
+    def _normalize(self, docs: Iterable[Document]) -> Iterator[Document]:
+        for doc in docs:
+            # We try to return 'source' and 'title' metadata when querying vector store and
+            # Weaviate will error at query time if one of the attributes is missing from a
+            # retrieved document.
+            doc.metadata.setdefault("source", "")
+            doc.metadata.setdefault("title", "")
+            self.sources.add(doc.metadata["source"])
+            if self.hashes is not None:
+                self.hashes.add(content_hash(doc.page_content))
+            yield doc
@@ -0,0 +1,337 @@
+"""Typed columnar copy of the stock CSV files for structured queries.
+
+Vector similarity over CSV rows rendered as text is a poor fit for questions such
+as "cars under 15000 with CarPlay from 2019 or later". The stock table keeps the
+same rows as NumPy columns: numeric columns (price, km, year) with a sorted index
+each for range filters, categorical codes for make and model, and flag columns
+for yes/no features. Ingestion writes it next to the CSV files and the API loads
+it, reloading in the background when the index version changes.
+"""
+
+import csv
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chatbot_api.ingests.version import get_index_version
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_COLUMNS = ("price", "km", "year")
+CATEGORICAL_COLUMNS = ("make", "model")
+FLAG_COLUMNS = ("bluetooth", "car_play")
+
+_TRUE_VALUES = {"1", "true", "yes", "si", "sí", "y"}
+_FALSE_VALUES = {"0", "false", "no", "n"}
+
+
+def get_stock_table_path() -> str:
+    """Return the path of the stock table file.
+
+    Returns:
+        str: The STOCK_TABLE_PATH variable, or .stock_table.npz inside DATA_DIR.
+    """
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    return os.environ.get("STOCK_TABLE_PATH", os.path.join(data_dir, ".stock_table.npz"))
+
+
+def _parse_number(value: str) -> float:
+    value = value.strip().replace("$", "").replace(" ", "")
+    if not value:
+        return np.nan
+    # Both "15,000" and "15.000" are thousands separators in the stock exports
+    if value.count(",") + value.count(".") and all(
+        len(part) == 3 for part in value.replace(",", ".").split(".")[1:]
+    ):
+        value = value.replace(",", "").replace(".", "")
+    try:
+        return float(value.replace(",", "."))
+    except ValueError:
+        return np.nan
+
+
+def _parse_flag(value: str) -> int:
+    value = value.strip().lower()
+    if value in _TRUE_VALUES:
+        return 1
+    if value in _FALSE_VALUES:
+        return 0
+    return -1
+
+
+class StockTable:
+    """Columnar stock rows with sorted indexes for range and equality filters."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], version_check_interval: float = 5.0):
+        """Initialize the table from raw string columns.
+
+        Args:
+            columns (Dict[str, np.ndarray]): Column name to string array, all of the
+                same length, plus "_source" and "_row" locating each CSV row.
+            version_check_interval (float): Seconds between checks of the index
+                version stamp written by ingestion.
+        """
+        self.path: Optional[str] = None
+        self.version_check_interval = version_check_interval
+        self._index_version = get_index_version()
+        self._version_checked_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._reload_errors = 0
+        self._set_columns(columns)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def from_csv_files(cls, csv_files: Iterable[str]) -> "StockTable":
+        """Build a table from stock CSV files with a header row.
+
+        Args:
+            csv_files (Iterable[str]): Paths of the CSV files.
+
+        Returns:
+            StockTable: The table holding the rows of all files.
+        """
+        rows: List[Dict[str, str]] = []
+        for csv_file in csv_files:
+            with open(csv_file, "r", newline="") as f:
+                for i, row in enumerate(csv.DictReader(f)):
+                    row = {
+                        (key or "").strip(): (value or "").strip() for key, value in row.items()
+                    }
+                    row["_source"] = csv_file
+                    row["_row"] = str(i)
+                    rows.append(row)
+        names = list(dict.fromkeys(name for row in rows for name in row))
+        return cls({name: np.array([row.get(name, "") for row in rows], dtype=str) for name in names})
+
+    @classmethod
+    def load(cls, path: str) -> "StockTable":
+        """Load a table written by save().
+
+        Args:
+            path (str): The .npz file.
+
+        Returns:
+            StockTable: The loaded table.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            table = cls({name: data[name] for name in data.files})
+        table.path = path
+        return table
+
+    @classmethod
+    def from_env(cls) -> Optional["StockTable"]:
+        """Load the table written by ingestion, or build it from the CSV files.
+
+        Returns:
+            Optional[StockTable]: The table, or None if there is no stock data.
+        """
+        path = get_stock_table_path()
+        if os.path.exists(path):
+            return cls.load(path)
+        data_dir = os.environ.get("DATA_DIR", "/app/data")
+        csv_files = sorted(glob.glob(os.path.join(data_dir, "*.csv")))
+        if not csv_files:
+            return None
+        table = cls.from_csv_files(csv_files)
+        table.path = path
+        return table
+
+    def save(self, path: str) -> None:
+        """Write the raw columns to an .npz file, replacing it atomically.
+
+        Args:
+            path (str): The .npz file.
+        """
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **self._raw)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    def query(
+        self,
+        ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+        categories: Optional[Dict[str, str]] = None,
+        flags: Optional[Dict[str, bool]] = None,
+        order_by: str = "price",
+    ) -> np.ndarray:
+        """Return the rows matching all predicates.
+
+        Args:
+            ranges (Optional[Dict]): Numeric column to inclusive (low, high) bounds,
+                None for an open end.
+            categories (Optional[Dict[str, str]]): Categorical column to value,
+                compared case-insensitively.
+            flags (Optional[Dict[str, bool]]): Flag column to required value.
+            order_by (str): Numeric column to sort the matches by, ascending.
+
+        Returns:
+            np.ndarray: Row indexes of the matches.
+        """
+        self._maybe_reload()
+        with self._lock:
+            return self._query(ranges, categories, flags, order_by)
+
+    def _query(
+        self,
+        ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]],
+        categories: Optional[Dict[str, str]],
+        flags: Optional[Dict[str, bool]],
+        order_by: str,
+    ) -> np.ndarray:
+        candidates: List[np.ndarray] = []
+        for name, (low, high) in (ranges or {}).items():
+            candidates.append(self._range_rows(name, low, high))
+        for name, value in (categories or {}).items():
+            code = self._category_codes[name].get(value.strip().lower())
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            candidates.append(self._range_rows(name, code, code))
+        if candidates:
+            # Start from the most selective index and check the rest on that subset
+            candidates.sort(key=len)
+            rows = candidates[0]
+            for other in candidates[1:]:
+                rows = rows[np.isin(rows, other, assume_unique=True)]
+        else:
+            rows = np.arange(self._size)
+        for name, value in (flags or {}).items():
+            rows = rows[self._flags[name][rows] == int(value)]
+        if order_by in self._numeric and len(rows):
+            rows = rows[np.argsort(self._numeric[order_by][rows], kind="stable")]
+        return rows
+
+    @property
+    def fields(self) -> List[str]:
+        """Return the CSV column names."""
+        return list(self._fields)
+
+    def has_index(self, name: str) -> bool:
+        """Return whether a column can be filtered on."""
+        return name in self._sorted or name in self._flags
+
+    def categories(self, name: str) -> List[str]:
+        """Return the lowercased values of a categorical column."""
+        return list(self._category_codes.get(name, {}))
+
+    def to_documents(self, rows: Sequence[int]) -> List[Document]:
+        """Render rows the way CSVLoader does, so they read like vector search hits.
+
+        Args:
+            rows (Sequence[int]): Row indexes.
+
+        Returns:
+            List[Document]: One document per row.
+        """
+        with self._lock:
+            raw, fields = self._raw, self._fields
+        documents = []
+        for row in rows:
+            content = "\n".join(f"{name}: {raw[name][row]}" for name in fields)
+            documents.append(
+                Document(
+                    page_content=content,
+                    metadata={
+                        "source": str(raw["_source"][row]),
+                        "row": int(raw["_row"][row]),
+                        "title": "",
+                    },
+                )
+            )
+        return documents
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the table size and the cardinality of its categorical columns."""
+        return {
+            "rows": self._size,
+            "path": self.path,
+            "reload_errors": self._reload_errors,
+            "categories": {name: len(codes) for name, codes in self._category_codes.items()},
+        }
+
+    def _set_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        # Build the indexes first and swap them in together, so a concurrent query
+        # sees either the old or the new table
+        numeric: Dict[str, np.ndarray] = {}
+        category_codes: Dict[str, Dict[str, int]] = {}
+        flags: Dict[str, np.ndarray] = {}
+        sorted_columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for name in NUMERIC_COLUMNS:
+            if name in columns:
+                values = np.array([_parse_number(value) for value in columns[name]], dtype=np.float64)
+                numeric[name] = values
+                sorted_columns[name] = self._index(values)
+        for name in CATEGORICAL_COLUMNS:
+            if name in columns:
+                labels, codes = np.unique(np.char.lower(columns[name]), return_inverse=True)
+                category_codes[name] = {label: code for code, label in enumerate(labels.tolist())}
+                sorted_columns[name] = self._index(codes.astype(np.float64))
+        for name in FLAG_COLUMNS:
+            if name in columns:
+                flags[name] = np.array([_parse_flag(value) for value in columns[name]], dtype=np.int8)
+        with self._lock:
+            self._raw = columns
+            self._size = len(next(iter(columns.values()))) if columns else 0
+            self._fields = [name for name in columns if not name.startswith("_")]
+            self._numeric = numeric
+            self._category_codes = category_codes
+            self._flags = flags
+            self._sorted = sorted_columns
+
+    @staticmethod
+    def _index(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # NaNs sort last and never fall inside a searchsorted range
+        order = np.argsort(values, kind="stable")
+        return values[order], order
+
+    def _range_rows(self, name: str, low: Optional[float], high: Optional[float]) -> np.ndarray:
+        values, order = self._sorted[name]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        stop = (
+            np.searchsorted(values, np.inf, side="right")
+            if high is None
+            else np.searchsorted(values, high, side="right")
+        )
+        return order[start:stop]
+
+    def _maybe_reload(self) -> None:
+        """Reload in the background when ingestion has written a new index version.
+
+        Queries keep using the loaded columns until the new ones are read and
+        indexed, so the request path never waits on disk.
+        """
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            return
+        self._reload_thread = threading.Thread(
+            target=self._reload_in_background, name="stock-table-reload", daemon=True
+        )
+        self._reload_thread.start()
+
+    def _reload_in_background(self) -> None:
+        try:
+            version = get_index_version()
+            if version == self._index_version or not os.path.exists(self.path):
+                return
+            logger.info(f"Reloading stock table from {self.path}")
+            with np.load(self.path, allow_pickle=False) as data:
+                columns = {name: data[name] for name in data.files}
+            self._set_columns(columns)
+            self._index_version = version
+        except Exception as e:
+            # Retried at the next interval
+            self._reload_errors += 1
+            logger.error(f"Error reloading stock table from {self.path}: {str(e)}")
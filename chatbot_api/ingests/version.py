@@ -0,0 +1,51 @@
+"""Index version stamp shared between the ingestion job and the API.
+
+Ingestion runs in a separate process, so it cannot reach caches held by the API
+directly. Instead it rewrites a small stamp file whenever the index changes, and
+caches compare the stamp to decide when their entries are stale.
+"""
+
+import os
+import time
+import uuid
+from typing import Optional
+
+
+def get_index_version_path() -> str:
+    """Return the path of the index version stamp file.
+
+    Returns:
+        str: The INDEX_VERSION_FILE variable, or .index_version inside DATA_DIR.
+    """
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    return os.environ.get(
+        "INDEX_VERSION_FILE", os.path.join(data_dir, ".index_version")
+    )
+
+
+def get_index_version() -> Optional[str]:
+    """Read the current index version.
+
+    Returns:
+        Optional[str]: The version stamp, or None if no ingestion has written one.
+    """
+    try:
+        with open(get_index_version_path(), "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def bump_index_version() -> str:
+    """Write a new index version stamp.
+
+    Returns:
+        str: The new version stamp.
+    """
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    path = get_index_version_path()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
@@ -0,0 +1,215 @@
+"""Watch mode for ingestion.
+
+Polls the source files under DATA_DIR and runs an incremental ingest once a burst
+of changes has settled. The source manifest limits each run to the files that
+changed, and CSV rows are indexed by content, so a single price change re-embeds
+a single row. Lag and throughput counters are logged after every run and written
+to a JSON file that the API reports under /stats.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def get_watch_stats_path() -> str:
+    """Return the path of the watch stats file.
+
+    Returns:
+        str: The INGEST_WATCH_STATS_PATH variable, or .ingest_watch_stats.json inside DATA_DIR.
+    """
+    data_dir = os.environ.get("DATA_DIR", "/app/data")
+    return os.environ.get(
+        "INGEST_WATCH_STATS_PATH", os.path.join(data_dir, ".ingest_watch_stats.json")
+    )
+
+
+def read_watch_stats() -> Optional[Dict[str, Any]]:
+    """Read the counters written by a running watcher.
+
+    Returns:
+        Optional[Dict[str, Any]]: The counters, or None if no watcher has written any.
+    """
+    try:
+        with open(get_watch_stats_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IngestWatcher:
+    """Runs ingestion when watched files change, debouncing bursts of changes."""
+
+    def __init__(
+        self,
+        ingest: Callable[[], Dict[str, int]],
+        list_files: Callable[[], List[str]],
+        poll_interval: float = 2.0,
+        debounce: float = 5.0,
+        max_delay: float = 60.0,
+        stats_path: Optional[str] = None,
+    ):
+        """Initialize the watcher.
+
+        Args:
+            ingest (Callable[[], Dict[str, int]]): Runs an incremental ingest and
+                returns the indexing stats.
+            list_files (Callable[[], List[str]]): Returns the files to watch.
+            poll_interval (float): Seconds between polls of the watched files.
+            debounce (float): Seconds without further changes before ingesting.
+            max_delay (float): Ingest after this many seconds even if files keep
+                changing.
+            stats_path (Optional[str]): JSON file the counters are written to.
+        """
+        self.ingest = ingest
+        self.list_files = list_files
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.stats_path = stats_path
+        self._snapshot = self.snapshot()
+        self._changed: Set[str] = set()
+        self._first_change_at: Optional[float] = None
+        self._last_change_at: Optional[float] = None
+        self.counters: Dict[str, Any] = {
+            "runs": 0,
+            "failed_runs": 0,
+            "files_changed": 0,
+            "num_added": 0,
+            "num_updated": 0,
+            "num_skipped": 0,
+            "num_deleted": 0,
+            "last_lag_seconds": None,
+            "max_lag_seconds": 0.0,
+            "total_lag_seconds": 0.0,
+            "last_run_seconds": None,
+            "last_chunks_per_second": None,
+            "last_run_at": None,
+        }
+
+    @classmethod
+    def from_env(
+        cls, ingest: Callable[[], Dict[str, int]], list_files: Callable[[], List[str]]
+    ) -> "IngestWatcher":
+        """Create a watcher configured by INGEST_WATCH_* environment variables."""
+        return cls(
+            ingest,
+            list_files,
+            poll_interval=float(os.environ.get("INGEST_WATCH_INTERVAL", "2")),
+            debounce=float(os.environ.get("INGEST_WATCH_DEBOUNCE", "5")),
+            max_delay=float(os.environ.get("INGEST_WATCH_MAX_DELAY", "60")),
+            stats_path=get_watch_stats_path(),
+        )
+
+    def snapshot(self) -> Dict[str, Tuple[int, float]]:
+        """Return the size and mtime of every watched file."""
+        snapshot = {}
+        for path in self.list_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime)
+        return snapshot
+
+    def poll(self) -> bool:
+        """Check the watched files once and ingest if a burst of changes settled.
+
+        Returns:
+            bool: True if an ingest ran.
+        """
+        now = time.monotonic()
+        snapshot = self.snapshot()
+        changed = {
+            path
+            for path in set(snapshot) | set(self._snapshot)
+            if snapshot.get(path) != self._snapshot.get(path)
+        }
+        self._snapshot = snapshot
+        if changed:
+            self._changed |= changed
+            self._last_change_at = now
+            if self._first_change_at is None:
+                self._first_change_at = now
+        if self._first_change_at is None:
+            return False
+        settled = now - self._last_change_at >= self.debounce
+        overdue = now - self._first_change_at >= self.max_delay
+        if not (settled or overdue):
+            return False
+        self._run()
+        return True
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """Poll until stopped.
+
+        Args:
+            stop (Optional[threading.Event]): Set to stop the loop.
+        """
+        stop = stop or threading.Event()
+        logger.info(
+            f"Watching {len(self._snapshot)} files every {self.poll_interval}s "
+            f"(debounce {self.debounce}s, max delay {self.max_delay}s)"
+        )
+        while not stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error polling watched files: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return run, lag and throughput counters."""
+        runs = self.counters["runs"]
+        return {
+            **self.counters,
+            "avg_lag_seconds": self.counters["total_lag_seconds"] / runs if runs else 0.0,
+            "pending_files": len(self._changed),
+        }
+
+    def _run(self) -> None:
+        changed = sorted(self._changed)
+        logger.info(f"Ingesting after changes to {len(changed)} files: {changed}")
+        started_at = time.monotonic()
+        try:
+            indexing_stats = self.ingest()
+        except Exception as e:
+            # Keep the changes pending and retry once the debounce period passed again
+            self.counters["failed_runs"] += 1
+            self._last_change_at = time.monotonic()
+            logger.error(f"Error ingesting changed files: {str(e)}")
+            self._write_stats()
+            return
+        finished_at = time.monotonic()
+        lag = finished_at - self._first_change_at
+        duration = finished_at - started_at
+        written = indexing_stats.get("num_added", 0) + indexing_stats.get("num_updated", 0)
+        self.counters["runs"] += 1
+        self.counters["files_changed"] += len(changed)
+        for key in ("num_added", "num_updated", "num_skipped", "num_deleted"):
+            self.counters[key] += indexing_stats.get(key, 0)
+        self.counters["last_lag_seconds"] = lag
+        self.counters["max_lag_seconds"] = max(self.counters["max_lag_seconds"], lag)
+        self.counters["total_lag_seconds"] += lag
+        self.counters["last_run_seconds"] = duration
+        self.counters["last_chunks_per_second"] = written / duration if duration else 0.0
+        self.counters["last_run_at"] = time.time()
+        self._changed = set()
+        self._first_change_at = self._last_change_at = None
+        logger.info(f"Ingest watch stats: {self.stats()}")
+        self._write_stats()
+
+    def _write_stats(self) -> None:
+        if not self.stats_path:
+            return
+        tmp_path = f"{self.stats_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.stats(), f)
+            os.replace(tmp_path, self.stats_path)
+        except OSError as e:
+            logger.error(f"Error writing ingest watch stats: {str(e)}")
@@ -6,29 +6,161 @@ It sets up the FastAPI application, configures middleware, and defines the API r
 
 import os
 import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import Optional, Union
 from uuid import UUID
 
 import langsmith
-from chatbot_api.chains import ChatRequest, answer_chain
+from chatbot_api.chains import (
+    ChatRequest,
+    answer_cache,
+    answer_chain,
+    complexity_router,
+    condense_question_memo,
+    get_provider_stats,
+    get_retriever_stats,
+    get_startup_stats,
+    prompt_budget,
+    query_embeddings,
+    speculative_retrieval,
+    warm_up,
+)
 from chatbot_api.chains.session import SessionManager
+from chatbot_api.channels import (
+    close_http_client,
+    get_outbound_sender,
+    send_telegram_message,
+    stream_telegram_message,
+)
+from chatbot_api.workers import IdempotencyStore, WorkerPool
+from chatbot_api.ingests import read_watch_stats
+from chatbot_api.vectorstores import close_vector_store_connection, get_vector_store_connection
 from fastapi import FastAPI, Form, Response, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from langserve import add_routes
 from langsmith import Client
 from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
 from twilio.twiml.messaging_response import MessagingResponse
-import requests
 
+logger = logging.getLogger(__name__)
 
 # Initialize the LangSmith client
 client = Client()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage resources that live for the whole lifetime of the application.
+
+    Shared clients are released on shutdown so pooled connections are closed cleanly,
+    the Twilio reply pool is drained so queued answers are still delivered, and
+    session messages still queued for the session backend are flushed. On startup
+    the retriever and default language model are built, so the first request does
+    not pay for connecting to them.
+    """
+    if os.environ.get("STARTUP_WARM_UP", "true").lower() == "true":
+        await asyncio.to_thread(warm_up)
+    session_manager.start()
+    if TWILIO_REPLY_MODE == "async":
+        twilio_reply_pool.start()
+    yield
+    await twilio_reply_pool.drain(
+        timeout=float(os.environ.get("TWILIO_DRAIN_TIMEOUT", "30"))
+    )
+    await close_http_client()
+    await close_vector_store_connection()
+    await asyncio.to_thread(query_embeddings.close)
+    # Write the remaining queued session messages before the process exits
+    await asyncio.to_thread(session_manager.close)
+
+
 # Initialize the FastAPI application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Initialize the session manager
-session_manager = SessionManager()
+session_manager = SessionManager.from_env()
+
+# Remember provider message IDs so webhook retries reuse the first answer
+idempotency_store = IdempotencyStore(
+    ttl=float(os.environ.get("IDEMPOTENCY_TTL", "600")),
+    max_keys=int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000")),
+)
+
+
+@dataclass
+class TwilioReplyJob:
+    """A Twilio message waiting to be answered in the background."""
+    session_id: str
+    question: str
+    to: str
+    from_: Optional[str] = None
+    message_sid: Optional[str] = None
+    # Idempotency future shared with retries of the same MessageSid
+    future: Optional[asyncio.Future] = None
+
+
+async def answer_twilio_message(session_id: str, question: str) -> str:
+    """Run the answer chain for a Twilio conversation and update its history.
+
+    Args:
+        session_id (str): The session ID of the conversation.
+        question (str): The incoming message.
+
+    Returns:
+        str: The generated answer.
+    """
+    async with session_manager.lock(session_id):
+        session = await session_manager.aget_or_create_session(session_id)
+        
+        # Get chat history from session
+        chat_history = session.get_messages()
+        
+        # Process the request using the answer chain
+        ans = await answer_chain.ainvoke({'question': question, 'chat_history': chat_history})
+        
+        # Update session history
+        session.add_turn(question, ans)
+    return ans
+
+
+async def answer_twilio_reply_job(job: TwilioReplyJob) -> str:
+    """Answer a Twilio reply job and resolve its idempotency future."""
+    try:
+        ans = await answer_twilio_message(job.session_id, job.question)
+    except Exception as e:
+        if job.future is not None:
+            idempotency_store.complete(job.message_sid, job.future, error=e)
+        raise
+    if job.future is not None:
+        idempotency_store.complete(job.message_sid, job.future, result=ans)
+    return ans
+
+
+async def process_twilio_reply_job(job: TwilioReplyJob) -> None:
+    """Answer a queued Twilio message and push the answer to the user."""
+    ans = await answer_twilio_reply_job(job)
+    await outbound_sender.send(job.to, ans, from_=job.from_)
+
+
+# "sync" answers inside the webhook response, "async" acknowledges immediately
+# and replies from the background worker pool.
+TWILIO_REPLY_MODE = os.environ.get("TWILIO_REPLY_MODE", "sync").lower()
+outbound_sender = get_outbound_sender() if TWILIO_REPLY_MODE == "async" else None
+twilio_reply_pool = WorkerPool(
+    process_twilio_reply_job,
+    num_workers=int(os.environ.get("TWILIO_WORKERS", "4")),
+    max_queue_size=int(os.environ.get("TWILIO_QUEUE_SIZE", "100")),
+    name="twilio-reply-pool",
+)
+
+# "send" posts the full answer once it is ready, "stream" sends the first tokens
+# right away and keeps editing the message as the answer is generated.
+TELEGRAM_REPLY_MODE = os.environ.get("TELEGRAM_REPLY_MODE", "send").lower()
 
 # Configure CORS middleware
 app.add_middleware(
@@ -41,16 +173,31 @@ app.add_middleware(
 )
 
 @app.post("/webhook")
-async def chat(From: str = Form(...), Body: str = Form(...)):
+async def chat(
+    From: str = Form(...),
+    Body: str = Form(...),
+    To: Optional[str] = Form(None),
+    MessageSid: Optional[str] = Form(None),
+):
     """
     Handles incoming chat messages via the webhook.
 
     This endpoint receives messages from users, processes them using the answer_chain,
     and returns a response in Twilio's TwiML format to be sent back to the user.
 
+    When TWILIO_REPLY_MODE is "async" the message is queued on the background worker
+    pool and an empty TwiML response is returned right away; the answer is delivered
+    later through the outbound sender. If the queue is full the message is answered
+    inline instead.
+
+    Retries of the same MessageSid do not run the chain again: they wait for or reuse
+    the answer of the first delivery.
+
     Args:
         From (str): The phone number of the sender.
         Body (str): The body of the incoming message.
+        To (Optional[str]): The number the message was sent to, used as the reply sender.
+        MessageSid (Optional[str]): Twilio's ID for the message, used to drop retries.
 
     Returns:
         Response: A FastAPI Response object containing the TwiML response.
@@ -58,26 +205,65 @@ async def chat(From: str = Form(...), Body: str = Form(...)):
     # Create a session ID based on the phone number
     session_id = f"twilio_{From}"
     
-    # Get or create session
-    session = session_manager.get_session(session_id)
-    if not session:
-        session_manager.create_session(session_id)
-        session = session_manager.get_session(session_id)
-    
-    # Get chat history from session
-    chat_history = session.get_history()
-    
-    # Process the request using the answer chain
-    ans = answer_chain.invoke({'question': Body, 'chat_history': chat_history})
-    
-    # Update session history
-    session.add_message('human', Body)
-    session.add_message('ai', ans)
-    
     response = MessagingResponse()
+    if twilio_reply_pool.running:
+        job = TwilioReplyJob(
+            session_id=session_id, question=Body, to=From, from_=To, message_sid=MessageSid
+        )
+        if MessageSid:
+            job.future, is_new = idempotency_store.begin(MessageSid)
+            if not is_new:
+                # The first delivery is queued or answered and its reply is sent
+                # by the worker, so the retry is only acknowledged.
+                return Response(content=str(response), media_type="application/xml")
+        if twilio_reply_pool.submit(job):
+            return Response(content=str(response), media_type="application/xml")
+        # The queue is full, answer inline
+        ans = await answer_twilio_reply_job(job)
+    else:
+        ans = await idempotency_store.run(
+            MessageSid, lambda: answer_twilio_message(session_id, Body)
+        )
+    
     msg = response.message(f"{ans}")
     return Response(content=str(response), media_type="application/xml")
 
+async def answer_telegram_message(chat_id: int, message_text: str) -> dict:
+    """Answer a Telegram message, update the chat history and send the reply.
+
+    Args:
+        chat_id (int): The Telegram chat the message came from.
+        message_text (str): The incoming message.
+
+    Returns:
+        dict: The delivery status returned by the webhook.
+    """
+    # Create a session ID based on the chat ID
+    session_id = f"telegram_{chat_id}"
+    
+    async with session_manager.lock(session_id):
+        session = await session_manager.aget_or_create_session(session_id)
+        
+        # Get chat history from session
+        chat_history = session.get_messages()
+        
+        chain_input = {'question': message_text, 'chat_history': chat_history}
+        if TELEGRAM_REPLY_MODE == "stream":
+            # Stream tokens to the user through progressive message edits
+            ans, status = await stream_telegram_message(
+                chat_id, answer_chain.astream(chain_input)
+            )
+        else:
+            # Process the message using our existing chain
+            ans = await answer_chain.ainvoke(chain_input)
+            status = None
+        
+        # Update session history
+        session.add_turn(message_text, ans)
+    
+    # Send the response back to the user
+    return status or await send_telegram_message(chat_id, ans)
+
 @app.post("/telegram-webhook")
 async def telegram_webhook(request: Request):
     """
@@ -99,46 +285,12 @@ async def telegram_webhook(request: Request):
         chat_id = update["message"]["chat"]["id"]
         message_text = update["message"]["text"]
         
-        # Create a session ID based on the chat ID
-        session_id = f"telegram_{chat_id}"
-        
-        # Get or create session
-        session = session_manager.get_session(session_id)
-        if not session:
-            session_manager.create_session(session_id)
-            session = session_manager.get_session(session_id)
-        
-        # Get chat history from session
-        chat_history = session.get_history()
-        
-        # Process the message using our existing chain
-        ans = answer_chain.invoke({'question': message_text, 'chat_history': chat_history})
-        
-        # Update session history
-        session.add_message('human', message_text)
-        session.add_message('ai', ans)
-        
-        # Send the response back to Telegram
-        # Get the Telegram bot token from environment variables
-        bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-        
-        if not bot_token:
-            return {"status": "error", "message": "Telegram bot token not configured"}
-        
-        # Send the response back to the user
-        telegram_api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": ans,
-            "parse_mode": "HTML"  # Allow HTML formatting in the response
-        }
-        
-        response = requests.post(telegram_api_url, json=payload)
-        
-        if response.status_code == 200:
-            return {"status": "success", "message": "Response sent to user"}
-        else:
-            return {"status": "error", "message": f"Failed to send response: {response.text}"}
+        # Telegram re-delivers an update with the same update_id until it is acknowledged
+        update_id = update.get("update_id")
+        return await idempotency_store.run(
+            f"telegram_{update_id}" if update_id is not None else None,
+            lambda: answer_telegram_message(chat_id, message_text),
+        )
     
     return {"status": "no message to process"}
 
@@ -159,38 +311,110 @@ async def chat_with_history(request: ChatRequest):
     if not request.session_id:
         request.session_id = session_manager.create_session()
     
-    session = session_manager.get_session(request.session_id)
-    if not session:
-        session = session_manager.create_session(request.session_id)
-    
-    # Get chat history from session
-    request.chat_history = session.get_history()
-    
-    # Process the request using the answer chain
-    response = answer_chain.invoke({
-        'question': request.question,
-        'chat_history': request.chat_history
-    })
-    
-    # Update session history
-    session.add_message('human', request.question)
-    session.add_message('ai', response)
+    async with session_manager.lock(request.session_id):
+        session = await session_manager.aget_or_create_session(request.session_id)
+        
+        # Process the request with the session history as ready-made messages
+        response = await answer_chain.ainvoke({
+            'question': request.question,
+            'chat_history': session.get_messages()
+        })
+        
+        # Update session history
+        session.add_turn(request.question, response)
     
     return {
         'answer': response,
         'session_id': request.session_id
     }
 
+@app.post("/chat-with-history/stream")
+async def chat_with_history_stream(request: ChatRequest):
+    """Stream a chat answer as server-sent events with session management.
+
+    Each generated chunk is sent as a "data" event. When generation finishes the
+    question and answer are appended to the session history together and an "end"
+    event carries the session ID and timings. If the client disconnects before the
+    end, the stream is closed and the history is left untouched.
+    """
+    if not request.session_id:
+        request.session_id = session_manager.create_session()
+
+    async def event_generator():
+        async with session_manager.lock(request.session_id):
+            session = await session_manager.aget_or_create_session(request.session_id)
+            chat_history = session.get_messages()
+            started_at = time.perf_counter()
+            first_token_at = None
+            chunks = []
+            stream = answer_chain.astream({
+                'question': request.question,
+                'chat_history': chat_history
+            })
+            try:
+                async for chunk in stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunks.append(chunk)
+                    yield {"event": "data", "data": json.dumps(chunk)}
+            except asyncio.CancelledError:
+                logger.info(f"Client disconnected from stream for session {request.session_id}")
+                raise
+            except Exception as e:
+                logger.error(f"Error streaming answer: {str(e)}")
+                yield {"event": "error", "data": json.dumps({"message": str(e)})}
+                return
+            finally:
+                await stream.aclose()
+
+            answer = "".join(chunks)
+            session.add_turn(request.question, answer)
+            finished_at = time.perf_counter()
+            yield {
+                "event": "end",
+                "data": json.dumps({
+                    "session_id": request.session_id,
+                    "time_to_first_token": (
+                        first_token_at - started_at if first_token_at else None
+                    ),
+                    "total_time": finished_at - started_at,
+                }),
+            }
+
+    return EventSourceResponse(event_generator())
+
 @app.delete("/chat/{session_id}")
 async def clear_chat_history(session_id: str):
     """Clear chat history for a session."""
-    session = session_manager.get_session(session_id)
+    session = await session_manager.aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    session_manager.delete_session(session_id)
+    await session_manager.adelete_session(session_id)
     return {"status": "success", "message": "Chat history cleared"}
 
+@app.get("/stats")
+async def get_stats():
+    """Return runtime statistics for the background workers and caches."""
+    return {
+        "sessions": session_manager.stats(),
+        "twilio_reply_pool": twilio_reply_pool.stats(),
+        "idempotency": idempotency_store.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "condense_question_memo": condense_question_memo.stats(),
+        "query_embeddings": query_embeddings.stats(),
+        "speculative_retrieval": (
+            speculative_retrieval.stats() if speculative_retrieval else None
+        ),
+        **get_retriever_stats(),
+        "ingest_watch": read_watch_stats(),
+        "prompt_budget": prompt_budget.stats() if prompt_budget else None,
+        "startup": get_startup_stats(),
+        "llm_providers": get_provider_stats(),
+        "model_routing": complexity_router.stats() if complexity_router else None,
+        "vector_store_connection": get_vector_store_connection().stats(),
+    }
+
 class SendFeedbackBody(BaseModel):
     """Model for the body of the send feedback request."""
     run_id: UUID
@@ -0,0 +1,6 @@
+from .local import LocalVectorStore
+from .connection import (
+    VectorStoreConnection,
+    close_vector_store_connection,
+    get_vector_store_connection,
+)
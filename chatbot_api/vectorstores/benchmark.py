@@ -0,0 +1,90 @@
+"""Benchmark retrieval latency of the local vector store against Weaviate.
+
+Query vectors are sampled from the local store itself, so the benchmark measures
+only the vector search and makes no embedding API calls. Run it after ingesting
+into both backends:
+
+    python -m chatbot_api.vectorstores.benchmark --queries 200 --k 6
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import weaviate
+from langchain_community.vectorstores import Weaviate
+
+from chatbot_api.constants import WEAVIATE_DOCS_INDEX_NAME
+from chatbot_api.ingests import get_embeddings_model
+from chatbot_api.vectorstores.local import LocalVectorStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def time_queries(search: Callable[[List[float]], object], queries: List[List[float]]) -> Dict[str, float]:
+    """Run every query once and return latency percentiles in milliseconds."""
+    latencies = []
+    for query in queries:
+        started_at = time.perf_counter()
+        search(query)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+        "mean_ms": statistics.fmean(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--skip-weaviate", action="store_true")
+    args = parser.parse_args()
+
+    local = LocalVectorStore.from_env(get_embeddings_model(), WEAVIATE_DOCS_INDEX_NAME)
+    if not len(local):
+        raise SystemExit("The local vector store is empty, ingest with VECTOR_STORE=local first")
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, len(local), args.queries)
+    queries = [local.get_vectors(np.array([row]))[0].tolist() for row in rows]
+
+    results = {
+        f"local ({local.dtype})": time_queries(
+            lambda query: local.similarity_search_by_vector(query, k=args.k), queries
+        )
+    }
+    if local.ivf_lists:
+        local.build_ivf()
+        results[f"local ({local.dtype}, ivf {local.ivf_lists})"] = time_queries(
+            lambda query: local.similarity_search_by_vector(query, k=args.k), queries
+        )
+    if not args.skip_weaviate:
+        weaviate_store = Weaviate(
+            client=weaviate.Client(url=os.environ.get("WEAVIATE_URL", "http://weaviate:8080")),
+            index_name=WEAVIATE_DOCS_INDEX_NAME,
+            text_key="text",
+            embedding=get_embeddings_model(),
+            by_text=False,
+            attributes=["source", "title"],
+        )
+        results["weaviate"] = time_queries(
+            lambda query: weaviate_store.similarity_search_by_vector(query, k=args.k), queries
+        )
+
+    logger.info(f"{args.queries} queries, k={args.k}, {len(local)} vectors")
+    for name, result in results.items():
+        logger.info(
+            f"{name}: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, "
+            f"mean {result['mean_ms']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
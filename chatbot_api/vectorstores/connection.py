@@ -0,0 +1,301 @@
+"""Shared, pooled connection to Weaviate for serving and ingestion.
+
+The retriever and ingestion used to build their own weaviate.Client with default
+HTTP settings. VectorStoreConnection is configured once from WEAVIATE_* variables
+and reused by both:
+
+- the synchronous weaviate.Client gets a connection pool of WEAVIATE_POOL_SIZE,
+  TCP keep-alive, connect and read timeouts and retries with backoff on
+  connection errors and 502/503/504 responses;
+- an httpx.AsyncClient with the same limits sends GraphQL queries for the async
+  retrieval path, so queries don't block a worker thread and reuse warm
+  keep-alive connections instead of paying for TCP or TLS setup under bursts.
+
+Both pools and the query latencies are reported by stats().
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+import weaviate
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class VectorStoreConnection:
+    """Pooled sync and async clients for one Weaviate instance."""
+
+    def __init__(
+        self,
+        url: str,
+        api_key: Optional[str] = None,
+        pool_size: int = 20,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 3,
+        retry_backoff: float = 0.2,
+        startup_period: int = 5,
+    ):
+        """Initialize the connection settings; clients are created on first use.
+
+        Args:
+            url (str): Weaviate URL.
+            api_key (Optional[str]): Weaviate API key, if authentication is enabled.
+            pool_size (int): Maximum pooled connections per client.
+            keepalive_expiry (float): Seconds idle connections are kept open; also
+                the TCP keep-alive idle time of the sync client's sockets.
+            connect_timeout (float): Seconds to establish a connection.
+            read_timeout (float): Seconds to wait for a response.
+            max_retries (int): Retries of failed requests.
+            retry_backoff (float): Backoff factor between retries, in seconds.
+            startup_period (int): Seconds the sync client waits for Weaviate to be ready.
+        """
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.startup_period = startup_period
+        self._client: Optional[weaviate.Client] = None
+        self._adapter: Optional[HTTPAdapter] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Any] = {
+            "queries": 0,
+            "async_queries": 0,
+            "query_seconds": 0.0,
+            "async_query_seconds": 0.0,
+            "async_retries": 0,
+            "errors": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "VectorStoreConnection":
+        """Create a connection configured by WEAVIATE_* environment variables."""
+        return cls(
+            os.environ.get("WEAVIATE_URL") or "http://weaviate:8080",
+            api_key=os.environ.get("WEAVIATE_API_KEY") or None,
+            pool_size=int(os.environ.get("WEAVIATE_POOL_SIZE", "20")),
+            keepalive_expiry=float(os.environ.get("WEAVIATE_KEEPALIVE_EXPIRY", "60")),
+            connect_timeout=float(os.environ.get("WEAVIATE_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.environ.get("WEAVIATE_READ_TIMEOUT", "30")),
+            max_retries=int(os.environ.get("WEAVIATE_MAX_RETRIES", "3")),
+            retry_backoff=float(os.environ.get("WEAVIATE_RETRY_BACKOFF", "0.2")),
+        )
+
+    @property
+    def client(self) -> weaviate.Client:
+        """The shared synchronous client, connected on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """The shared async HTTP client used for GraphQL queries."""
+        if self._async_client is None or self._async_client.is_closed:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._async_client = httpx.AsyncClient(
+                base_url=self.url,
+                headers=headers,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+        return self._async_client
+
+    def query(self, gql: str) -> Dict[str, Any]:
+        """Run a GraphQL query with the sync client.
+
+        Args:
+            gql (str): The query, e.g. from a weaviate query builder's build().
+
+        Returns:
+            Dict[str, Any]: The GraphQL response.
+        """
+        started_at = time.perf_counter()
+        try:
+            result = self.client.query.raw(gql)
+        except Exception:
+            self._count(errors=1)
+            raise
+        self._count(queries=1, query_seconds=time.perf_counter() - started_at)
+        return result
+
+    async def aquery(self, gql: str) -> Dict[str, Any]:
+        """Run a GraphQL query with the async client, retrying transient failures.
+
+        Args:
+            gql (str): The query, e.g. from a weaviate query builder's build().
+
+        Returns:
+            Dict[str, Any]: The GraphQL response.
+        """
+        started_at = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.async_client.post("/v1/graphql", json={"query": gql})
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    break
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    self._count(errors=1)
+                    raise
+            except httpx.HTTPStatusError:
+                self._count(errors=1)
+                raise
+            self._count(async_retries=1)
+            await asyncio.sleep(self.retry_backoff * 2**attempt)
+        self._count(async_queries=1, async_query_seconds=time.perf_counter() - started_at)
+        return response.json()
+
+    def close(self) -> None:
+        """Close the sync client's pooled connections."""
+        if self._adapter is not None:
+            self._adapter.close()
+
+    async def aclose(self) -> None:
+        """Close both clients' pooled connections."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return connection pool and query latency statistics."""
+        sync_pool = {"connections_created": 0, "requests": 0, "idle_connections": 0}
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                sync_pool["connections_created"] += pool.num_connections
+                sync_pool["requests"] += pool.num_requests
+                # Unused slots of the pool queue hold None
+                idle = list(pool.pool.queue) if pool.pool else []
+                sync_pool["idle_connections"] += sum(1 for connection in idle if connection is not None)
+        async_pool = None
+        if self._async_client is not None:
+            # httpx keeps its pool in the transport; not part of its public API
+            pool = getattr(getattr(self._async_client, "_transport", None), "_pool", None)
+            connections = getattr(pool, "connections", [])
+            async_pool = {
+                "connections": len(connections),
+                "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+            }
+        with self._lock:
+            counters = dict(self.counters)
+        queries = counters["queries"]
+        async_queries = counters["async_queries"]
+        return {
+            "url": self.url,
+            "pool_size": self.pool_size,
+            **counters,
+            "avg_query_milliseconds": (
+                counters["query_seconds"] / queries * 1000 if queries else 0.0
+            ),
+            "avg_async_query_milliseconds": (
+                counters["async_query_seconds"] / async_queries * 1000
+                if async_queries
+                else 0.0
+            ),
+            "sync_pool": sync_pool,
+            "async_pool": async_pool,
+        }
+
+    def _count(self, **increments: float) -> None:
+        # Sync queries run in many worker threads at once
+        with self._lock:
+            for name, amount in increments.items():
+                self.counters[name] += amount
+
+    def _create_client(self) -> weaviate.Client:
+        client = weaviate.Client(
+            url=self.url,
+            auth_client_secret=weaviate.AuthApiKey(api_key=self.api_key) if self.api_key else None,
+            timeout_config=(self.connect_timeout, self.read_timeout),
+            startup_period=self.startup_period,
+        )
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            socket_options.append(
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(self.keepalive_expiry)))
+            )
+        adapter = _SocketOptionsAdapter(
+            socket_options,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(
+                total=self.max_retries,
+                backoff_factor=self.retry_backoff,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        )
+        # weaviate.Client has no setting for retries or socket options, so its
+        # requests session gets an adapter configured here instead
+        session = client._connection._session
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self._adapter = adapter
+        logger.info(f"Connected to Weaviate at {self.url} with a pool of {self.pool_size}")
+        return client
+
+
+class _SocketOptionsAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections use the given socket options."""
+
+    def __init__(self, socket_options: list, **kwargs: Any):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+_connection: Optional[VectorStoreConnection] = None
+
+
+def get_vector_store_connection() -> VectorStoreConnection:
+    """Return the process-wide Weaviate connection, creating it on first use.
+
+    Returns:
+        VectorStoreConnection: The shared connection.
+    """
+    global _connection
+    if _connection is None:
+        _connection = VectorStoreConnection.from_env()
+    return _connection
+
+
+async def close_vector_store_connection() -> None:
+    """Close the shared Weaviate connection and release its pooled connections."""
+    global _connection
+    if _connection is not None:
+        await _connection.aclose()
+        _connection = None
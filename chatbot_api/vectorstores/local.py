@@ -0,0 +1,574 @@
+"""In-process vector store backed by NumPy and memory-mapped files.
+
+The corpus (stock CSV rows and a few markdown files) fits easily in memory, so
+searching it inside the API process avoids a network hop to Weaviate on every
+query. Vectors are normalized on insert and searched with batched dot products.
+They can be stored as float32, float16, or int8 with a per-row scale to cut
+memory. For larger corpora an optional IVF index (k-means coarse quantizer)
+restricts the search to the closest clusters.
+
+Every persist writes a new version directory and then atomically points the
+store at it, so a reader never sees a mix of files from two writes. Readers check
+the pointer every reload_interval seconds and load a newer version in a background
+thread, swapping it in once it is fully read.
+
+Layout of a store directory:
+
+    version        name of the current version directory, replaced atomically
+    <version>/
+        meta.json      dtype, dimension, row count and IVF settings
+        vectors.bin    row-major matrix in the storage dtype, memory-mapped on load
+        scales.f32     per-row scales, int8 storage only
+        docs.jsonl     one {"id", "text", "metadata"} record per row
+        ivf.npz        IVF centroids and row assignments, when the index is built
+
+Stores written before versioning keep these files next to the version stamp and
+are still loaded; the next persist moves them into a version directory.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "int8": np.int8,
+}
+
+# Rows scored per matrix product, bounds the float32 temporary for compact dtypes.
+SEARCH_BATCH_SIZE = 65536
+
+# Version directories kept on persist, the current one and those readers may still
+# be loading
+KEEP_VERSIONS = 2
+
+_LEGACY_FILES = ("meta.json", "vectors.bin", "scales.f32", "docs.jsonl", "ivf.npz")
+
+
+class LocalVectorStore(VectorStore):
+    """NumPy-backed vector store persisted as memory-mapped files."""
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        path: Optional[str] = None,
+        dtype: str = "float32",
+        ivf_lists: int = 0,
+        ivf_probes: int = 8,
+        reload_interval: float = 5.0,
+    ):
+        """Initialize the store, loading it from disk when the path holds one.
+
+        Args:
+            embedding (Embeddings): The model used to embed texts and queries.
+            path (Optional[str]): Directory to persist to. Memory only if None.
+            dtype (str): Storage dtype, one of "float32", "float16" or "int8".
+            ivf_lists (int): Number of IVF clusters built on persist; 0 disables the
+                approximate index and every search is exact.
+            ivf_probes (int): Number of closest clusters searched per query.
+            reload_interval (float): Seconds between checks for a newer copy on disk
+                written by another process, such as ingestion.
+        """
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype: {dtype}")
+        self.embedding = embedding
+        self.path = path
+        self.dtype = dtype
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.reload_interval = reload_interval
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: Optional[List[np.ndarray]] = None
+        self._version: Optional[str] = None
+        self._version_checked_at = time.monotonic()
+        # Held while searching and while swapping in a reloaded copy
+        self._lock = threading.RLock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._reloads = 0
+        self._reload_errors = 0
+        if path and self._read_version() is not None:
+            self.load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def ids(self) -> List[str]:
+        """The IDs of the stored texts, in row order."""
+        return list(self._ids)
+
+    @classmethod
+    def from_env(cls, embedding: Embeddings, index_name: str) -> "LocalVectorStore":
+        """Create a store configured from LOCAL_VECTOR_* environment variables.
+
+        Args:
+            embedding (Embeddings): The model used to embed texts and queries.
+            index_name (str): Index name, used as the directory name.
+
+        Returns:
+            LocalVectorStore: The store.
+        """
+        data_dir = os.environ.get("DATA_DIR", "/app/data")
+        root = os.environ.get(
+            "LOCAL_VECTOR_STORE_DIR", os.path.join(data_dir, ".vector_store")
+        )
+        return cls(
+            embedding,
+            path=os.path.join(root, index_name),
+            dtype=os.environ.get("LOCAL_VECTOR_DTYPE", "float32"),
+            ivf_lists=int(os.environ.get("LOCAL_VECTOR_IVF_LISTS", "0")),
+            ivf_probes=int(os.environ.get("LOCAL_VECTOR_IVF_PROBES", "8")),
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        ids = kwargs.pop("ids", None)
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = kwargs.get("ids") or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        return self.add_vectors(self.embedding.embed_documents(texts), texts, metadatas, ids)
+
+    def add_vectors(
+        self,
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: List[dict],
+        ids: List[str],
+    ) -> List[str]:
+        """Add precomputed vectors. Existing IDs are replaced.
+
+        Args:
+            vectors (List[List[float]]): The embeddings of the texts.
+            texts (List[str]): The texts.
+            metadatas (List[dict]): Metadata for each text.
+            ids (List[str]): IDs for each text.
+
+        Returns:
+            List[str]: The IDs of the added texts.
+        """
+        existing = set(self._ids).intersection(ids)
+        if existing:
+            self.delete(list(existing))
+        matrix, scales = self._quantize(np.asarray(vectors, dtype=np.float32))
+        if self._matrix is None or not len(self._ids):
+            self._matrix, self._scales = matrix, scales
+        else:
+            self._matrix = np.concatenate([np.asarray(self._matrix), matrix])
+            if scales is not None:
+                self._scales = np.concatenate([np.asarray(self._scales), scales])
+        self._ids.extend(ids)
+        self._texts.extend(texts)
+        self._metadatas.extend(metadatas)
+        self._drop_ivf()
+        return list(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        remove = set(ids)
+        keep = [row for row, id_ in enumerate(self._ids) if id_ not in remove]
+        if len(keep) == len(self._ids):
+            return True
+        self._ids = [self._ids[row] for row in keep]
+        self._texts = [self._texts[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        if self._matrix is not None:
+            self._matrix = np.asarray(self._matrix)[keep]
+            if self._scales is not None:
+                self._scales = np.asarray(self._scales)[keep]
+        self._drop_ivf()
+        return True
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding.embed_query(query), k, **kwargs
+        )
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        vector = await self.embedding.aembed_query(query)
+        return [
+            doc for doc, _ in self.similarity_search_by_vector_with_score(vector, k, **kwargs)
+        ]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)
+        ]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """Return the k most similar documents and their cosine similarity."""
+        self._maybe_reload()
+        with self._lock:
+            if not self._ids:
+                return []
+            rows, scores = self.search(
+                self._normalize(np.asarray(embedding, dtype=np.float32)), k
+            )
+            return [
+                (
+                    Document(
+                        page_content=self._texts[row], metadata=dict(self._metadatas[row])
+                    ),
+                    float(score),
+                )
+                for row, score in zip(rows, scores)
+            ]
+
+    def similarity_search_with_vectors(
+        self, embedding: List[float], k: int = 4
+    ) -> Tuple[List[Document], np.ndarray]:
+        """Return the k most similar documents and their stored, normalized vectors."""
+        self._maybe_reload()
+        with self._lock:
+            if not self._ids:
+                return [], np.empty((0, 0), dtype=np.float32)
+            rows, _ = self.search(self._normalize(np.asarray(embedding, dtype=np.float32)), k)
+            docs = [
+                Document(page_content=self._texts[row], metadata=dict(self._metadatas[row]))
+                for row in rows
+            ]
+            return docs, self.get_vectors(rows)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows and scores of the top k matches of a normalized query.
+
+        Args:
+            query (np.ndarray): Normalized float32 query vector.
+            k (int): Number of matches.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Row indexes and scores, best first.
+        """
+        if self._centroids is not None:
+            centroid_scores = self._centroids @ query
+            probes = np.argsort(-centroid_scores)[: self.ivf_probes]
+            candidates = np.concatenate([self._lists[probe] for probe in probes])
+            if len(candidates) >= k:
+                scores = self._score(query, candidates)
+                return self._top_k(candidates, scores, k)
+        candidates = np.arange(len(self._ids))
+        return self._top_k(candidates, self._score(query, candidates), k)
+
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = 10) -> None:
+        """Build the approximate IVF index with spherical k-means.
+
+        Args:
+            n_lists (Optional[int]): Number of clusters. Defaults to ivf_lists.
+            iterations (int): Number of k-means iterations.
+        """
+        n_lists = min(n_lists or self.ivf_lists, len(self._ids))
+        if n_lists < 2:
+            self._drop_ivf()
+            return
+        vectors = self.get_vectors(np.arange(len(self._ids)))
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for cluster in range(n_lists):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = self._normalize(members.mean(axis=0))
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        self._centroids = centroids.astype(np.float32)
+        self._lists = [np.flatnonzero(assignments == cluster) for cluster in range(n_lists)]
+
+    def persist(self) -> None:
+        """Write the store to a new version directory, building the IVF index if enabled.
+
+        The version pointer is replaced only after every file of the new version is
+        on disk, then versions older than the last KEEP_VERSIONS are removed.
+        """
+        if not self.path:
+            raise ValueError("LocalVectorStore has no path to persist to")
+        os.makedirs(self.path, exist_ok=True)
+        if self.ivf_lists:
+            self.build_ivf()
+        version = uuid.uuid4().hex
+        directory = os.path.join(self.path, version)
+        os.makedirs(directory)
+        matrix = self._matrix if self._matrix is not None else np.zeros((0, 0), np.float32)
+        self._write(os.path.join(directory, "vectors.bin"), np.asarray(matrix).tobytes())
+        if self._scales is not None:
+            self._write(os.path.join(directory, "scales.f32"), np.asarray(self._scales).tobytes())
+        self._write(
+            os.path.join(directory, "docs.jsonl"),
+            "".join(
+                json.dumps({"id": id_, "text": text, "metadata": metadata}) + "\n"
+                for id_, text, metadata in zip(self._ids, self._texts, self._metadatas)
+            ).encode("utf-8"),
+        )
+        if self._centroids is not None:
+            assignments = np.empty(len(self._ids), dtype=np.int32)
+            for cluster, rows in enumerate(self._lists):
+                assignments[rows] = cluster
+            with open(os.path.join(directory, "ivf.npz"), "wb") as f:
+                np.savez(f, centroids=self._centroids, assignments=assignments)
+                f.flush()
+                os.fsync(f.fileno())
+        meta = {
+            "dtype": self.dtype,
+            "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            "rows": len(self._ids),
+            "ivf_lists": len(self._lists) if self._lists else 0,
+        }
+        self._write(os.path.join(directory, "meta.json"), json.dumps(meta).encode("utf-8"))
+        self._write(os.path.join(self.path, "version"), version.encode("utf-8"))
+        self._version = version
+        self._remove_old_versions()
+
+    def load(self) -> None:
+        """Load the current version of the store, memory-mapping the vectors."""
+        version = self._read_version()
+        if version is None:
+            raise FileNotFoundError(f"No local vector store in {self.path}")
+        self._swap(version, self._read(self._version_directory(version)))
+
+    def reload(self) -> bool:
+        """Load the store again if another process persisted a newer version.
+
+        Returns:
+            bool: Whether a newer version was loaded.
+        """
+        version = self._read_version()
+        if version is None or version == self._version:
+            return False
+        logger.info(f"Reloading local vector store from {self.path}")
+        self._swap(version, self._read(self._version_directory(version)))
+        self._reloads += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and layout information for the store."""
+        nbytes = 0
+        if self._matrix is not None:
+            nbytes = self._matrix.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+        return {
+            "rows": len(self._ids),
+            "dtype": self.dtype,
+            "vector_bytes": int(nbytes),
+            "ivf_lists": len(self._lists) if self._lists else 0,
+            "version": self._version,
+            "reloads": self._reloads,
+            "reload_errors": self._reload_errors,
+        }
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Normalize vectors and convert them to the storage dtype."""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype != "int8":
+            return vectors.astype(STORAGE_DTYPES[self.dtype]), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.where(scales == 0, 1, scales).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+    def get_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Return the stored, normalized vectors of the given rows as float32."""
+        vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= np.asarray(self._scales)[rows][:, None]
+        return vectors
+
+    def _score(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Score rows against the query in batches."""
+        contiguous = len(rows) == len(self._ids)
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BATCH_SIZE):
+            batch = (
+                slice(start, start + SEARCH_BATCH_SIZE)
+                if contiguous
+                else rows[start : start + SEARCH_BATCH_SIZE]
+            )
+            block = np.asarray(self._matrix[batch], dtype=np.float32)
+            batch_scores = block @ query
+            if self._scales is not None:
+                batch_scores *= np.asarray(self._scales)[batch]
+            scores[start : start + len(batch_scores)] = batch_scores
+        return scores
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop_ivf(self) -> None:
+        self._centroids = None
+        self._lists = None
+
+    def _read_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, "version")) as f:
+                return f.read().strip() or None
+        except OSError:
+            if os.path.exists(os.path.join(self.path, "meta.json")):
+                # Written before versioning, without a stamp
+                return ""
+            return None
+
+    def _version_directory(self, version: str) -> str:
+        directory = os.path.join(self.path, version) if version else self.path
+        # Stores written before versioning stamp the version next to their files
+        return directory if os.path.isdir(directory) else self.path
+
+    def _read(self, directory: str) -> Dict[str, Any]:
+        """Read a version directory without touching the loaded copy."""
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        rows, dim = meta["rows"], meta["dim"]
+        with open(os.path.join(directory, "docs.jsonl")) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        state: Dict[str, Any] = {
+            "dtype": meta["dtype"],
+            "ids": [record["id"] for record in records],
+            "texts": [record["text"] for record in records],
+            "metadatas": [record["metadata"] for record in records],
+            "matrix": None,
+            "scales": None,
+            "centroids": None,
+            "lists": None,
+        }
+        if rows and dim:
+            state["matrix"] = np.memmap(
+                os.path.join(directory, "vectors.bin"),
+                dtype=STORAGE_DTYPES[meta["dtype"]],
+                mode="r",
+                shape=(rows, dim),
+            )
+            if meta["dtype"] == "int8":
+                state["scales"] = np.fromfile(
+                    os.path.join(directory, "scales.f32"), dtype=np.float32
+                )
+        ivf_path = os.path.join(directory, "ivf.npz")
+        if meta.get("ivf_lists") and os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                state["centroids"] = ivf["centroids"]
+                assignments = ivf["assignments"]
+            state["lists"] = [
+                np.flatnonzero(assignments == cluster)
+                for cluster in range(len(state["centroids"]))
+            ]
+        return state
+
+    def _swap(self, version: str, state: Dict[str, Any]) -> None:
+        """Replace the loaded copy with a fully read one, between searches."""
+        with self._lock:
+            self.dtype = state["dtype"]
+            self._ids = state["ids"]
+            self._texts = state["texts"]
+            self._metadatas = state["metadatas"]
+            self._matrix = state["matrix"]
+            self._scales = state["scales"]
+            self._centroids = state["centroids"]
+            self._lists = state["lists"]
+            self._version = version
+
+    def _remove_old_versions(self) -> None:
+        """Remove version directories beyond the newest KEEP_VERSIONS, and legacy files."""
+        for name in _LEGACY_FILES:
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                os.remove(path)
+        versions = sorted(
+            (
+                entry
+                for entry in os.scandir(self.path)
+                if entry.is_dir() and os.path.exists(os.path.join(entry.path, "meta.json"))
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        for entry in versions[KEEP_VERSIONS:]:
+            if entry.name != self._version:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _maybe_reload(self) -> None:
+        """Reload in the background when another process persisted a newer version.
+
+        Searches keep using the loaded copy until the new one is fully read, so
+        the request path never waits on disk.
+        """
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._version_checked_at < self.reload_interval:
+            return
+        self._version_checked_at = now
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            return
+        self._reload_thread = threading.Thread(
+            target=self._reload_in_background, name="local-vector-store-reload", daemon=True
+        )
+        self._reload_thread.start()
+
+    def _reload_in_background(self) -> None:
+        try:
+            self.reload()
+        except Exception as e:
+            # Retried at the next interval, e.g. when the version was removed meanwhile
+            self._reload_errors += 1
+            logger.error(f"Error reloading local vector store from {self.path}: {str(e)}")
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,2 @@
+from .idempotency import IdempotencyStore
+from .pool import WorkerPool
@@ -0,0 +1,122 @@
+"""Idempotency store for webhook deliveries.
+
+Messaging providers retry webhooks with the same message ID when they do not get
+a timely answer. The store remembers the in-flight or completed result for each
+ID for a bounded time, so a retry waits for or reuses the first answer instead of
+running the chain again.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class IdempotencyStore:
+    """Bounded, TTL-evicting map from provider message IDs to results."""
+
+    def __init__(self, ttl: float = 600.0, max_keys: int = 10000):
+        """Initialize the store.
+
+        Args:
+            ttl (float): Seconds a key is remembered after it was first seen.
+            max_keys (int): Maximum number of keys kept; the oldest are evicted first.
+        """
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[str, Tuple[float, asyncio.Future]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def begin(self, key: str) -> Tuple[asyncio.Future, bool]:
+        """Register a key, or return the future of an earlier delivery.
+
+        Args:
+            key (str): The provider message ID.
+
+        Returns:
+            Tuple[asyncio.Future, bool]: The future holding the result and whether
+                this call registered the key.
+        """
+        self._expire()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1], False
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (time.monotonic() + self.ttl, future)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        return future, True
+
+    def complete(
+        self,
+        key: str,
+        future: asyncio.Future,
+        result: Any = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Resolve a key registered with begin.
+
+        On error the key is forgotten so that the provider's next retry runs again.
+
+        Args:
+            key (str): The provider message ID.
+            future (asyncio.Future): The future returned by begin.
+            result (Any): The result to share with duplicate deliveries.
+            error (Optional[BaseException]): The error raised while processing.
+        """
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+            return
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is future:
+            del self._entries[key]
+        future.set_exception(error)
+        # Mark the exception as retrieved when no duplicate is waiting on it.
+        future.exception()
+
+    async def run(self, key: Optional[str], func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func once per key and share its result with duplicate deliveries.
+
+        Args:
+            key (Optional[str]): The provider message ID. Without a key func always runs.
+            func (Callable): Coroutine function producing the result.
+
+        Returns:
+            Any: The result of the first delivery of the key.
+        """
+        if not key:
+            return await func()
+        future, is_new = self.begin(key)
+        if not is_new:
+            return await asyncio.shield(future)
+        try:
+            result = await func()
+        except BaseException as e:
+            self.complete(key, future, error=e)
+            raise
+        self.complete(key, future, result=result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit and size counters for the store."""
+        return {
+            "keys": len(self._entries),
+            "max_keys": self.max_keys,
+            "ttl": self.ttl,
+            "duplicates": self.hits,
+            "unique": self.misses,
+        }
+
+    def _expire(self) -> None:
+        """Drop keys whose TTL has passed."""
+        now = time.monotonic()
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
@@ -0,0 +1,153 @@
+"""Bounded pool of asyncio workers for background jobs.
+
+Jobs are pushed onto a fixed-size queue and consumed by a fixed number of worker
+tasks. When the queue is full new jobs are rejected instead of piling up, so
+callers can fall back to another strategy.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """Runs a job handler on a fixed number of asyncio worker tasks."""
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        num_workers: int = 4,
+        max_queue_size: int = 100,
+        name: str = "worker-pool",
+    ):
+        """Initialize the worker pool.
+
+        Args:
+            handler (Callable): Coroutine function called with each job.
+            num_workers (int): Number of concurrent worker tasks.
+            max_queue_size (int): Maximum number of jobs waiting in the queue.
+            name (str): Name used in logs and stats.
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._accepting = False
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    @property
+    def running(self) -> bool:
+        """Whether the pool is started and accepting jobs."""
+        return self._accepting
+
+    def start(self) -> None:
+        """Start the worker tasks. Must be called from a running event loop."""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-{i}")
+            for i in range(self.num_workers)
+        ]
+        self._accepting = True
+        logger.info(
+            f"Started {self.name} with {self.num_workers} workers "
+            f"and queue size {self.max_queue_size}"
+        )
+
+    def submit(self, job: Any) -> bool:
+        """Queue a job without waiting.
+
+        Args:
+            job (Any): The job passed to the handler.
+
+        Returns:
+            bool: True if the job was queued, False if the pool is stopped or full.
+        """
+        if not self._accepting:
+            self._rejected += 1
+            return False
+        try:
+            self._queue.put_nowait((time.monotonic(), job))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning(f"{self.name} queue is full, rejecting job")
+            return False
+        self._submitted += 1
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+        return True
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting jobs, finish the queued ones and stop the workers.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait for queued jobs before
+                cancelling whatever is still pending.
+        """
+        if not self._workers:
+            return
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"{self.name} drain timed out with {self._queue.qsize()} queued "
+                f"and {self._in_flight} in-flight jobs"
+            )
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info(f"Stopped {self.name}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue and throughput counters for the pool.
+
+        Returns:
+            Dict[str, Any]: The pool statistics.
+        """
+        finished = self._completed + self._failed
+        return {
+            "workers": self.num_workers,
+            "running": self._accepting,
+            "queue_size": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self.max_queue_size,
+            "max_queue_depth_seen": self._max_depth,
+            "in_flight": self._in_flight,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "avg_wait_seconds": self._total_wait / finished if finished else 0.0,
+            "avg_run_seconds": self._total_run / finished if finished else 0.0,
+        }
+
+    async def _worker(self, index: int) -> None:
+        """Consume jobs from the queue until cancelled."""
+        while True:
+            enqueued_at, job = await self._queue.get()
+            started_at = time.monotonic()
+            self._total_wait += started_at - enqueued_at
+            self._in_flight += 1
+            try:
+                await self.handler(job)
+                self._completed += 1
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"{self.name} worker {index} failed a job: {str(e)}")
+            finally:
+                self._in_flight -= 1
+                self._total_run += time.monotonic() - started_at
+                self._queue.task_done()
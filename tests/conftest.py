@@ -0,0 +1,22 @@
+"""Shared test configuration.
+
+The chatbot modules read their settings from the environment at import time, so
+the defaults below are set before any of them is imported: no provider keys, the
+local vector store, no tracing and no network calls during startup.
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("VECTOR_STORE", "local")
+os.environ.setdefault("DATA_DIR", str(Path(__file__).resolve().parent.parent / "data"))
+os.environ.setdefault("LANGCHAIN_TRACING_V2", "false")
+os.environ.setdefault("STARTUP_WARM_UP", "false")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
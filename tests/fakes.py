@@ -0,0 +1,118 @@
+"""Fake chat models, retrievers and callbacks that run locally with controlled latency."""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    BaseCallbackHandler,
+    CallbackManagerForLLMRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+
+class FakeChatModel(FakeListChatModel):
+    """Chat model that answers after a fixed latency, or fails.
+
+    ``latency`` is the time to the answer, or to the first chunk when streaming;
+    ``chunk_latency`` is the time between the following chunks. With ``error`` set
+    the model raises it after the latency.
+    """
+
+    responses: List[str] = ["answer"]
+    latency: float = 0.0
+    chunk_latency: float = 0.0
+    error: Optional[str] = None
+    calls: int = 0
+
+    def _next_response(self) -> str:
+        self.calls += 1
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self._call([])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        message = AIMessage(content=self._next_response())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        message = AIMessage(content=self._next_response())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for index, token in enumerate(self._next_response().split(" ")):
+            if index:
+                time.sleep(self.chunk_latency)
+                token = " " + token
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for index, token in enumerate(self._next_response().split(" ")):
+            if index:
+                await asyncio.sleep(self.chunk_latency)
+                token = " " + token
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class StaticRetriever(BaseRetriever):
+    """Retriever that returns the same documents for every query."""
+
+    docs: List[Document] = [Document(page_content="Toyota Corolla 2020, 45000 km, USD 18000")]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return list(self.docs)
+
+
+class RunCollector(BaseCallbackHandler):
+    """Records the name and parent of every chain run."""
+
+    def __init__(self):
+        self.runs = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self.runs[run_id] = (kwargs.get("name"), parent_run_id)
+
+    def root(self):
+        [(run_id, (name, _))] = [
+            (run_id, run) for run_id, run in self.runs.items() if run[1] is None
+        ]
+        return run_id, name
+
+    def children(self, run_id):
+        return sorted(name for name, parent in self.runs.values() if parent == run_id)
@@ -0,0 +1,85 @@
+"""Crash consistency of the content-hash embedding store."""
+
+import json
+import os
+
+import numpy as np
+
+from chatbot_api.ingests.embedding_store import EmbeddingStore, content_hash
+
+
+def vector(value, dim=4):
+    return [float(value)] * dim
+
+
+def test_uncommitted_vectors_are_truncated_before_the_next_append(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    store.put_many(["a"], [vector(1)])
+    # A crash after the vectors were appended but before their keys were
+    with open(store._vectors_path, "ab") as f:
+        f.write(np.asarray([vector(9)], dtype=np.float32).tobytes())
+
+    reopened = EmbeddingStore(str(tmp_path), "model")
+    reopened.put_many(["b"], [vector(2)])
+
+    assert os.path.getsize(reopened._vectors_path) == 2 * 4 * 4
+    assert EmbeddingStore(str(tmp_path), "model").get_many(["a", "b"]) == [vector(1), vector(2)]
+
+
+def test_rows_appended_without_committing_meta_are_dropped(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    store.put_many(["a"], [vector(1)])
+    # A crash after both files were appended but before meta.json counted the row
+    with open(store._vectors_path, "ab") as f:
+        f.write(np.asarray([vector(2)], dtype=np.float32).tobytes())
+    with open(store._keys_path, "a") as f:
+        f.write("b\nc")
+
+    reopened = EmbeddingStore(str(tmp_path), "model")
+
+    assert len(reopened) == 1
+    assert reopened.get_many(["a", "b"]) == [vector(1), None]
+    with open(reopened._keys_path) as f:
+        assert f.read() == "a\n"
+
+
+def test_compaction_switches_generations_atomically(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    keys = [content_hash(str(index)) for index in range(4)]
+    store.put_many(keys, [vector(index) for index in range(4)])
+
+    assert store.compact(keys[2:]) == 2
+    reopened = EmbeddingStore(str(tmp_path), "model")
+    assert reopened.generation == 1
+    assert reopened.get_many(keys) == [None, None, vector(2), vector(3)]
+    assert sorted(os.listdir(store.path)) == ["keys.1.txt", "meta.json", "vectors.1.f32"]
+
+
+def test_interrupted_compaction_keeps_the_previous_generation(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    store.put_many(["a", "b"], [vector(1), vector(2)])
+    # A compaction that wrote its files but crashed before switching meta.json
+    with open(os.path.join(store.path, "vectors.1.f32"), "wb") as f:
+        f.write(np.asarray([vector(2)], dtype=np.float32).tobytes())
+    with open(os.path.join(store.path, "keys.1.txt"), "w") as f:
+        f.write("b\n")
+
+    reopened = EmbeddingStore(str(tmp_path), "model")
+
+    assert reopened.generation == 0
+    assert reopened.get_many(["a", "b"]) == [vector(1), vector(2)]
+    assert not os.path.exists(os.path.join(store.path, "keys.1.txt"))
+
+
+def test_stores_without_a_row_count_are_reconciled(tmp_path):
+    path = tmp_path / "model"
+    path.mkdir()
+    (path / "meta.json").write_text(json.dumps({"model": "model", "dim": 4}))
+    (path / "keys.txt").write_text("a\nb\n")
+    (path / "vectors.f32").write_bytes(np.asarray([vector(1)], dtype=np.float32).tobytes())
+
+    store = EmbeddingStore(str(tmp_path), "model")
+    store.put_many(["c"], [vector(3)])
+
+    assert store.get_many(["a", "b", "c"]) == [vector(1), None, vector(3)]
+    assert json.loads((path / "meta.json").read_text())["rows"] == 2
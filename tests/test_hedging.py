@@ -0,0 +1,159 @@
+"""Hedging, deadlines and circuit breakers of HedgedFallbacks with fake models."""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Optional
+
+import pytest
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from chatbot_api.chains.hedging import HedgedFallbacks, ProviderHealth
+from tests.fakes import FakeChatModel
+
+
+def hedged(*models, **kwargs):
+    providers = [(f"p{i}", model) for i, model in enumerate(models)]
+    failure_threshold = kwargs.pop("failure_threshold", 3)
+    health = {
+        name: ProviderHealth(name, failure_threshold=failure_threshold) for name, _ in providers
+    }
+    options = {"deadline": 5.0, "hedge_delay": 0.1, "min_hedge_delay": 0.0, **kwargs}
+    return HedgedFallbacks(providers=providers, health=health, **options)
+
+
+class EventStream(Runnable):
+    """Streams one chunk once an event is set, and remembers whether it was closed."""
+
+    def __init__(self, event: asyncio.Event, chunk: str):
+        self.event = event
+        self.chunk = chunk
+        self.closed = False
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.chunk
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        try:
+            await self.event.wait()
+            yield self.chunk
+            await asyncio.sleep(0)
+            yield "!"
+        finally:
+            self.closed = True
+
+
+@pytest.mark.anyio
+async def test_a_slow_provider_is_hedged():
+    router = hedged(FakeChatModel(latency=1.0, responses=["slow"]), FakeChatModel(responses=["fast"]))
+
+    started_at = time.perf_counter()
+    result = await router.ainvoke("hi")
+
+    assert result.content == "fast"
+    assert time.perf_counter() - started_at < 0.5
+    assert router.health["p0"].counters["hedges"] == 1
+    assert router.health["p0"].counters["cancelled"] == 1
+
+
+def test_a_slow_provider_is_hedged_in_sync_calls():
+    router = hedged(FakeChatModel(latency=1.0, responses=["slow"]), FakeChatModel(responses=["fast"]))
+
+    assert router.invoke("hi").content == "fast"
+    assert router.health["p0"].counters["hedges"] == 1
+
+
+@pytest.mark.anyio
+async def test_an_attempt_past_its_deadline_fails_over():
+    router = hedged(
+        FakeChatModel(latency=1.0, responses=["slow"]),
+        FakeChatModel(responses=["fast"]),
+        deadline=0.1,
+        hedge_delay=10.0,
+    )
+
+    assert (await router.ainvoke("hi")).content == "fast"
+    assert router.health["p0"].counters["timeouts"] == 1
+
+
+@pytest.mark.anyio
+async def test_every_streamed_chunk_has_a_deadline():
+    router = hedged(
+        FakeChatModel(chunk_latency=1.0, responses=["one two"]), deadline=0.2, hedge_delay=10.0
+    )
+
+    chunks = []
+    with pytest.raises(asyncio.TimeoutError):
+        async for chunk in router.astream("hi"):
+            chunks.append(chunk.content)
+
+    assert chunks == ["one"]
+    assert router.health["p0"].counters["timeouts"] == 1
+
+
+def test_every_streamed_chunk_has_a_deadline_in_sync_calls():
+    router = hedged(
+        FakeChatModel(chunk_latency=1.0, responses=["one two"]), deadline=0.2, hedge_delay=10.0
+    )
+
+    chunks = []
+    with pytest.raises(TimeoutError):
+        for chunk in router.stream("hi"):
+            chunks.append(chunk.content)
+
+    assert chunks == ["one"]
+    assert router.health["p0"].counters["timeouts"] == 1
+
+
+@pytest.mark.anyio
+async def test_attempts_finishing_together_are_all_recorded():
+    release = asyncio.Event()
+
+    async def fail(_):
+        await release.wait()
+        raise RuntimeError("provider down")
+
+    async def answer(_):
+        await release.wait()
+        return "answer"
+
+    router = hedged(RunnableLambda(fail), RunnableLambda(answer), hedge_delay=0.0)
+    task = asyncio.ensure_future(router.ainvoke("hi"))
+    await asyncio.sleep(0.05)
+    release.set()
+
+    assert await task == "answer"
+    assert router.health["p0"].counters["errors"] == 1
+    assert router.health["p0"].counters["cancelled"] == 0
+
+
+@pytest.mark.anyio
+async def test_a_losing_stream_is_closed():
+    release = asyncio.Event()
+    first, second = EventStream(release, "first"), EventStream(release, "second")
+    router = hedged(first, second, hedge_delay=0.0)
+
+    async def consume():
+        return [chunk async for chunk in router.astream("hi")]
+
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0.05)
+    release.set()
+
+    assert await task == ["first", "!"]
+    assert first.closed and second.closed
+    assert router.health["p1"].counters["successes"] == 1
+
+
+@pytest.mark.anyio
+async def test_the_breaker_skips_a_failing_provider():
+    failing = FakeChatModel(error="provider down")
+    router = hedged(failing, FakeChatModel(responses=["backup"]), failure_threshold=2)
+
+    for _ in range(3):
+        assert (await router.ainvoke("hi")).content == "backup"
+
+    assert failing.calls == 2
+    assert router.health["p0"].state == "open"
+    assert router.health["p0"].counters["skipped"] == 1
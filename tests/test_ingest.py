@@ -0,0 +1,76 @@
+"""Incremental ingestion into the local vector store with fake embeddings."""
+
+import json
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chatbot_api.constants import WEAVIATE_DOCS_INDEX_NAME
+from chatbot_api.ingests import ingest
+from chatbot_api.ingests.manifest import file_hash
+from chatbot_api.vectorstores import LocalVectorStore
+
+HEADER = "stock_id,km,price,make,model,year\n"
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("VECTOR_STORE", "local")
+    monkeypatch.setenv("RECORD_MANAGER_DB_URL", f"sqlite:///{tmp_path}/records.db")
+    monkeypatch.setenv("EMBEDDING_STORE_DIR", "")
+    monkeypatch.setenv("INGEST_BATCH_SIZE", "2")
+    monkeypatch.setenv("INGEST_PARSE_WORKERS", "1")
+    monkeypatch.setattr(ingest, "get_embeddings_model", lambda: DeterministicFakeEmbedding(size=8))
+    return tmp_path
+
+
+def write_stock(path, rows):
+    with open(path, "w") as f:
+        f.write(HEADER)
+        f.writelines(f"{i},{1000 * i},{price},Toyota,Corolla,2019\n" for i, price in enumerate(rows))
+
+
+def stored_ids(data_dir):
+    return LocalVectorStore(
+        DeterministicFakeEmbedding(size=8),
+        path=str(data_dir / ".vector_store" / WEAVIATE_DOCS_INDEX_NAME),
+    ).ids
+
+
+def manifest(data_dir):
+    with open(data_dir / ".ingest_manifest.json") as f:
+        return json.load(f)
+
+
+def test_incremental_run_keeps_rows_of_a_changed_file_beyond_the_first_batch(data_dir):
+    write_stock(data_dir / "stock.csv", [10000 + i for i in range(5)])
+    ingest.ingest_docs()
+    before = stored_ids(data_dir)
+    write_stock(data_dir / "stock.csv", [10000 + i for i in range(4)] + [99999])
+
+    stats = ingest.ingest_docs()
+
+    assert len(stored_ids(data_dir)) == len(before)
+    assert stats["num_added"] == 1
+    assert stats["num_deleted"] == 1
+
+
+def test_a_file_that_fails_to_load_keeps_its_chunks_and_is_retried(data_dir):
+    write_stock(data_dir / "stock.csv", [10000 + i for i in range(5)])
+    write_stock(data_dir / "other.csv", [20000])
+    ingest.ingest_docs()
+    before = stored_ids(data_dir)
+    recorded = manifest(data_dir)[str(data_dir / "stock.csv")]
+    # A changed file with undecodable bytes
+    write_stock(data_dir / "stock.csv", [10000 + i for i in range(3)])
+    with open(data_dir / "stock.csv", "ab") as f:
+        f.write(b"9,9000,\xff\xfe,Toyota,Corolla,2019\n")
+    write_stock(data_dir / "other.csv", [30000])
+
+    ingest.ingest_docs()
+
+    assert len(stored_ids(data_dir)) == len(before)
+    assert manifest(data_dir)[str(data_dir / "stock.csv")] == recorded
+    other = manifest(data_dir)[str(data_dir / "other.csv")]
+    assert other["sha256"] == file_hash(str(data_dir / "other.csv"))
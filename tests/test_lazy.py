@@ -0,0 +1,47 @@
+"""Warm-up of lazily built providers."""
+
+import importlib
+import logging
+
+from chatbot_api.chains.lazy import LazyRunnable
+from tests.fakes import FakeChatModel
+
+# The chains package re-exports a function named chain over the module name
+chain = importlib.import_module("chatbot_api.chains.chain")
+
+
+def failing_factory():
+    raise RuntimeError("provider unavailable")
+
+
+def test_warm_up_failures_are_logged_and_reported(monkeypatch, caplog):
+    monkeypatch.setattr(chain, "gpt_3_5", LazyRunnable.from_factory(failing_factory, "gpt-test"))
+    monkeypatch.setattr(chain, "retriever", LazyRunnable.from_factory(FakeChatModel, "retriever"))
+
+    with caplog.at_level(logging.WARNING, logger=chain.__name__):
+        chain.warm_up()
+
+    assert "Error warming up gpt-test: provider unavailable" in caplog.text
+    assert chain.gpt_3_5.lazy.stats()["failures"] == 1
+    assert chain.gpt_3_5.lazy.stats()["last_error"] == "provider unavailable"
+    assert chain.retriever.lazy.stats()["last_error"] is None
+
+
+def test_a_later_build_clears_the_last_error():
+    attempts = []
+
+    def flaky_factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("timeout")
+        return FakeChatModel()
+
+    runnable = LazyRunnable.from_factory(flaky_factory, "flaky")
+    try:
+        runnable.lazy.get()
+    except RuntimeError:
+        pass
+    runnable.lazy.get()
+
+    assert runnable.lazy.stats()["failures"] == 1
+    assert runnable.lazy.stats()["last_error"] is None
@@ -0,0 +1,87 @@
+"""Versioned persistence of the local vector store and its record manager."""
+
+import json
+import os
+
+from langchain.indexes import SQLRecordManager, index
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chatbot_api.ingests.ingest import reconcile_local_store
+from chatbot_api.vectorstores import LocalVectorStore
+
+EMBEDDING = DeterministicFakeEmbedding(size=8)
+
+
+def store(path, **kwargs):
+    return LocalVectorStore(EMBEDDING, path=str(path), **kwargs)
+
+
+def docs(*texts):
+    return [Document(page_content=text, metadata={"source": f"{text}.md"}) for text in texts]
+
+
+def test_persist_switches_versions_atomically(tmp_path):
+    writer = store(tmp_path)
+    writer.add_texts(["a"], ids=["1"])
+    writer.persist()
+    first = writer.stats()["version"]
+    writer.add_texts(["b"], ids=["2"])
+    writer.persist()
+    writer.add_texts(["c"], ids=["3"])
+    writer.persist()
+
+    with open(tmp_path / "version") as f:
+        current = f.read()
+    assert current == writer.stats()["version"] != first
+    # The current version and the one before it, which a reader may still be loading
+    versions = [name for name in os.listdir(tmp_path) if name != "version"]
+    assert current in versions and first not in versions and len(versions) == 2
+    assert store(tmp_path).ids == ["1", "2", "3"]
+
+
+def test_legacy_layout_is_loaded_and_migrated(tmp_path):
+    with open(tmp_path / "meta.json", "w") as f:
+        json.dump({"dtype": "float32", "dim": 0, "rows": 0, "ivf_lists": 0}, f)
+    with open(tmp_path / "docs.jsonl", "w") as f:
+        f.write("")
+    legacy = store(tmp_path)
+    legacy.add_texts(["a"], ids=["1"])
+    legacy.persist()
+
+    assert not os.path.exists(tmp_path / "meta.json")
+    assert store(tmp_path).ids == ["1"]
+
+
+def test_readers_reload_in_the_background(tmp_path):
+    writer = store(tmp_path)
+    writer.add_texts(["a"], ids=["1"])
+    writer.persist()
+    reader = store(tmp_path, reload_interval=0)
+    writer.add_texts(["b"], ids=["2"])
+    writer.persist()
+
+    # The search that notices the new version is served from the loaded copy
+    assert len(reader.similarity_search("b", k=2)) == 1
+    reader._reload_thread.join(timeout=5)
+
+    assert len(reader.similarity_search("b", k=2)) == 2
+    assert reader.stats()["reloads"] == 1
+
+
+def test_reconcile_after_a_run_that_was_not_persisted(tmp_path):
+    record_manager = SQLRecordManager("local/test", db_url=f"sqlite:///{tmp_path}/records.db")
+    record_manager.create_schema()
+    first = store(tmp_path / "store")
+    index(docs("a"), record_manager, first, cleanup="full", source_id_key="source")
+    first.persist()
+    # A run that committed the record manager but died before persisting
+    unpersisted = store(tmp_path / "store")
+    index(docs("b"), record_manager, unpersisted, cleanup="full", source_id_key="source")
+
+    reloaded = store(tmp_path / "store")
+    assert reconcile_local_store(record_manager, reloaded) == 2
+    stats = index(docs("b"), record_manager, reloaded, cleanup="full", source_id_key="source")
+
+    assert stats["num_added"] == 1
+    assert [doc.page_content for doc in reloaded.similarity_search("b", k=5)] == ["b"]
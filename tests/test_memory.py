@@ -0,0 +1,29 @@
+"""Chat history kept as compact messages and as LangChain messages for the chain."""
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chatbot_api.chains.memory import ChatMemory, Message
+
+
+def test_langchain_messages_are_evicted_with_the_stored_messages():
+    memory = ChatMemory(max_messages=3)
+    memory.add_message("human", "hi")
+    memory.add_turn("price?", "10000")
+    memory.add_turn("km?", "1000")
+
+    assert memory.get_messages() == [
+        AIMessage(content="10000"),
+        HumanMessage(content="km?"),
+        AIMessage(content="1000"),
+    ]
+    assert len(memory.messages) == len(memory.lc_messages) == 3
+
+
+def test_replace_and_clear():
+    memory = ChatMemory()
+    memory.replace([Message("human", "hola", 1.0), Message("ai", "buenas", 2.0)])
+
+    assert memory.get_messages() == [HumanMessage(content="hola"), AIMessage(content="buenas")]
+    assert memory.approx_bytes() > 0
+    memory.clear()
+    assert memory.get_messages() == []
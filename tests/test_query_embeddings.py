@@ -0,0 +1,58 @@
+"""Query embedding cache in memory and on disk."""
+
+import threading
+
+import pytest
+from langchain_core.embeddings import FakeEmbeddings
+
+from chatbot_api.chains.embeddings import CachedQueryEmbeddings
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    calls: int = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return super().embed_query(text)
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+@pytest.mark.anyio
+async def test_async_queries_are_cached_on_disk_off_the_event_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / "query_embeddings.sqlite")
+    underlying = CountingEmbeddings(size=4)
+    cache = CachedQueryEmbeddings(underlying, path=path)
+    vector = await cache.aembed_query("¿Tienen un Corolla?")
+    assert await cache.aembed_query("¿Tienen un Corolla?") == vector
+    cache.close()
+
+    disk_threads = []
+    reopened = CachedQueryEmbeddings(underlying, path=path)
+    lookup_disk = reopened._lookup_disk
+
+    def record_thread(key):
+        disk_threads.append(threading.current_thread())
+        return lookup_disk(key)
+
+    monkeypatch.setattr(reopened, "_lookup_disk", record_thread)
+    assert await reopened.aembed_query("¿Tienen un Corolla?") == pytest.approx(vector)
+    reopened.close()
+
+    assert underlying.calls == 1
+    assert reopened.stats()["disk_hits"] == 1
+    assert disk_threads and threading.main_thread() not in disk_threads
+
+
+def test_memory_only_cache_counts_round_trips():
+    underlying = CountingEmbeddings(size=4)
+    cache = CachedQueryEmbeddings(underlying, max_size=1)
+    cache.embed_query("a")
+    cache.embed_query("a")
+    cache.embed_query("b")
+    cache.embed_query("a")
+
+    assert underlying.calls == 3
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["round_trips"] == 3
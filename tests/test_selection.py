@@ -0,0 +1,27 @@
+"""Context selection over candidates from a fake vector search."""
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chatbot_api.chains.selection import DiverseRetriever
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=8)
+DOCS = [Document(page_content=f"Toyota Corolla {2010 + i}, {1000 * i} km") for i in range(8)]
+VECTORS = np.asarray(EMBEDDINGS.embed_documents([doc.page_content for doc in DOCS]), dtype=np.float32)
+
+
+def search(embedding, k):
+    return DOCS[:k], VECTORS[:k]
+
+
+def test_saved_tokens_are_counted_for_a_sample_of_the_queries():
+    retriever = DiverseRetriever(search=search, embeddings=EMBEDDINGS, token_stats_every=2)
+
+    for _ in range(4):
+        assert retriever.invoke("Corolla")
+
+    stats = retriever.stats()
+    assert stats["queries"] == 4
+    assert stats["token_sampled_queries"] == 2
+    assert stats["avg_saved_tokens"] == stats["saved_tokens"] / 2
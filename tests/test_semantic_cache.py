@@ -0,0 +1,125 @@
+"""Semantic answer cache lookups, eviction, model namespaces and tracing."""
+
+import time
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.runnables import RunnableLambda
+
+from chatbot_api.chains.cache import (
+    LRUMemo,
+    MemoizedRunnable,
+    SemanticCache,
+    SemanticCacheRunnable,
+    model_namespace,
+)
+from tests.fakes import RunCollector
+
+
+def unit(index, dim=8):
+    vector = np.zeros(dim)
+    vector[index] = 1.0
+    return vector.tolist()
+
+
+def test_hit_above_threshold_and_miss_below():
+    cache = SemanticCache(threshold=0.9)
+    cache.store(unit(0), "first", latency=1.0)
+    cache.store(unit(1), "second", latency=1.0)
+
+    near = np.array(unit(1)) + 0.1 * np.array(unit(2))
+    assert cache.lookup(near.tolist()) == "second"
+    assert cache.lookup(unit(3)) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_answers_are_only_served_for_the_same_model():
+    cache = SemanticCache()
+    cache.store(unit(0), "from gpt", latency=1.0, namespace="openai_gpt_3_5_turbo")
+
+    assert cache.lookup(unit(0), "anthropic_claude_3_haiku") is None
+    assert cache.lookup(unit(0), "openai_gpt_3_5_turbo") == "from gpt"
+    assert model_namespace({"configurable": {"llm": "fireworks_mixtral"}}) == "fireworks_mixtral"
+    assert model_namespace(None) == "default"
+
+
+def test_evicted_rows_are_reused_without_growing_the_matrix():
+    cache = SemanticCache(max_entries=3)
+    for index in range(6):
+        cache.store(unit(index), f"answer {index}", latency=0.1)
+
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["matrix_rows"] == 3
+    # The least recently used answers were evicted
+    assert cache.lookup(unit(0)) is None
+    assert cache.lookup(unit(5)) == "answer 5"
+    assert cache.lookup(unit(3)) == "answer 3"
+
+
+def test_expired_answers_are_dropped():
+    cache = SemanticCache(ttl=0.01)
+    cache.store(unit(0), "stale", latency=0.1)
+    time.sleep(0.02)
+
+    assert cache.lookup(unit(0)) is None
+    assert cache.stats()["entries"] == 0
+    cache.store(unit(1), "fresh", latency=0.1)
+    assert cache.lookup(unit(1)) == "fresh"
+
+
+def cached_chain():
+    return SemanticCacheRunnable(
+        RunnableLambda(lambda input: {**input, "standalone_question": input["question"]}).with_config(
+            run_name="CondenseQuestion"
+        ),
+        RunnableLambda(lambda input: "answer").with_config(run_name="Answer"),
+        DeterministicFakeEmbedding(size=8),
+        SemanticCache(),
+    )
+
+
+def test_the_cached_chain_is_the_root_run_of_its_steps():
+    collector = RunCollector()
+
+    output = cached_chain().invoke(
+        {"question": "hola"}, {"callbacks": [collector], "run_name": "AnswerChain"}
+    )
+
+    root, name = collector.root()
+    assert output == "answer"
+    assert name == "AnswerChain"
+    assert collector.children(root) == ["Answer", "CondenseQuestion"]
+
+
+@pytest.mark.anyio
+async def test_the_cached_chain_streams_events_in_one_run():
+    chain = cached_chain()
+    await chain.ainvoke({"question": "hola"})
+
+    events = [
+        event async for event in chain.astream_events({"question": "hola"}, version="v1")
+    ]
+
+    assert events[0]["event"] == "on_chain_start"
+    assert events[-1]["event"] == "on_chain_end"
+    assert events[-1]["data"]["output"] == "answer"
+    # A cache hit skips the answer step
+    assert "Answer" not in [event["name"] for event in events]
+
+
+@pytest.mark.anyio
+async def test_memoized_runnables_start_a_run():
+    collector = RunCollector()
+    memoized = MemoizedRunnable(
+        RunnableLambda(lambda input: input["question"].upper()).with_config(run_name="Rephrase"),
+        LRUMemo(),
+    ).with_config(run_name="MemoizedRephrase")
+
+    output = await memoized.ainvoke({"question": "hola"}, {"callbacks": [collector]})
+
+    root, name = collector.root()
+    assert output == "HOLA"
+    assert name == "MemoizedRephrase"
+    assert collector.children(root) == ["Rephrase"]
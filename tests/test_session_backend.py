@@ -0,0 +1,97 @@
+"""Write-behind batching of the SQL session backend, and session manager calls into it."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+from chatbot_api.chains.memory import Message
+from chatbot_api.chains.session import SessionManager
+from chatbot_api.chains.session_backend import SessionBackend, SQLSessionBackend
+
+INSERT_LATENCY = 0.3
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLSessionBackend(f"sqlite:///{tmp_path}/sessions.db")
+
+    @event.listens_for(backend.engine, "before_cursor_execute")
+    def slow_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT"):
+            time.sleep(INSERT_LATENCY)
+
+    yield backend
+    backend.close()
+
+
+def flush_in_background(backend):
+    thread = threading.Thread(target=backend.flush)
+    thread.start()
+    # Let the flush take the batch and start inserting it
+    time.sleep(INSERT_LATENCY / 3)
+    assert backend.stats()["in_flight"]
+    return thread
+
+
+def test_load_includes_messages_being_inserted(backend):
+    backend.append("a", [Message("human", "hi", 1.0), Message("ai", "hello", 2.0)])
+    thread = flush_in_background(backend)
+
+    messages = backend.load("a", 10)
+    thread.join()
+
+    assert messages == [Message("human", "hi", 1.0), Message("ai", "hello", 2.0)]
+
+
+def test_delete_is_not_undone_by_an_insert_in_flight(backend):
+    backend.append("a", [Message("human", "hi", 1.0)])
+    backend.append("b", [Message("human", "hey", 1.0)])
+    thread = flush_in_background(backend)
+
+    backend.delete("a")
+    thread.join()
+
+    assert backend.load("a", 10) is None
+    assert backend.load("b", 10) == [Message("human", "hey", 1.0)]
+
+
+def test_messages_of_a_held_session_stay_queued(backend):
+    backend.append("a", [Message("human", "hi", 1.0)])
+    backend.append("b", [Message("human", "hey", 1.0)])
+    backend._hold("a")
+    try:
+        assert backend.flush() == 1
+    finally:
+        backend._release("a")
+
+    assert backend.stats()["pending"] == 1
+    assert backend.flush() == 1
+    assert backend.load("a", 10) == [Message("human", "hi", 1.0)]
+
+
+class SlowBackend(SessionBackend):
+    """Backend whose loads and deletes block for INSERT_LATENCY."""
+
+    def load(self, session_id, limit):
+        time.sleep(INSERT_LATENCY)
+        return [Message("human", "hi", 1.0)]
+
+    def delete(self, session_id):
+        time.sleep(INSERT_LATENCY)
+
+
+@pytest.mark.anyio
+async def test_async_session_calls_do_not_block_the_event_loop():
+    manager = SessionManager(backend=SlowBackend())
+
+    async def clear(session_id):
+        assert await manager.aget_session(session_id) is not None
+        await manager.adelete_session(session_id)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(clear("a"), clear("b"), clear("c"))
+
+    assert time.perf_counter() - started_at < 3 * INSERT_LATENCY
@@ -0,0 +1,41 @@
+"""Speculative retrieval paths and tracing of the retrieval step."""
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from chatbot_api.chains.speculative import SpeculativeRetrieval, SpeculativeRetrievalRunnable
+from tests.fakes import RunCollector, StaticRetriever
+
+FOLLOW_UP = {"question": "and how much is it?", "chat_history": [HumanMessage(content="Corolla?")]}
+
+
+def find_docs(rephrase):
+    return SpeculativeRetrievalRunnable(
+        rephrase_chain=RunnableLambda(rephrase, name="Rephrase"),
+        retriever=StaticRetriever(),
+        settings=SpeculativeRetrieval(),
+    ).with_config(run_name="FindDocs")
+
+
+def test_a_close_rephrase_reuses_the_speculative_documents():
+    runnable = find_docs(lambda input: "and how much is it, the Corolla?")
+
+    result = runnable.invoke(FOLLOW_UP)
+
+    assert result["standalone_question"] == "and how much is it, the Corolla?"
+    assert result["docs"] == StaticRetriever().docs
+    assert runnable.bound.settings.paths["speculative_hit"] == 1
+
+
+@pytest.mark.anyio
+async def test_the_retrieval_step_is_a_named_run():
+    collector = RunCollector()
+
+    await find_docs(lambda input: "how much is the Toyota Corolla?").ainvoke(
+        FOLLOW_UP, {"callbacks": [collector]}
+    )
+
+    run_id, name = collector.root()
+    assert name == "FindDocs"
+    assert collector.children(run_id) == ["Rephrase"]
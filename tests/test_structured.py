@@ -0,0 +1,95 @@
+"""Parsing of stock questions and routing between the table and the vector retriever."""
+
+import csv
+import threading
+
+import pytest
+
+from chatbot_api.chains.structured import StructuredStockRetriever, parse_stock_query
+from chatbot_api.ingests import stock_table
+from chatbot_api.ingests.stock_table import StockTable
+from tests.fakes import StaticRetriever
+
+ROWS = [
+    ("1", "1000", "10000", "Toyota", "Corolla", "2019", "1", "1"),
+    ("2", "50000", "18000", "Toyota", "Hilux", "2016", "1", "0"),
+    ("3", "80000", "7000", "Ford", "Fiesta", "2012", "0", "0"),
+]
+
+
+@pytest.fixture
+def table(tmp_path):
+    path = tmp_path / "stock.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stock_id", "km", "price", "make", "model", "year", "bluetooth", "car_play"])
+        writer.writerows(ROWS)
+    return StockTable.from_csv_files([str(path)])
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "What financing options do you have for a Toyota?",
+        "Does the Corolla have a warranty?",
+        "Does the 2019 Corolla have a warranty?",
+        "Are you open from 9 to 5?",
+        "I'm writing from 1234 Main street",
+        "Do you accept cars from 2010 as trade-in?",
+    ],
+)
+def test_questions_without_filters_go_to_the_vector_retriever(table, question):
+    assert not parse_stock_query(question, table).has_filters
+
+
+@pytest.mark.parametrize(
+    "question, ranges",
+    [
+        ("Toyota under 15000 with CarPlay from 2019 or later", {"price": (None, 15000), "year": (2019, None)}),
+        ("cars from the year 2015", {"year": (2015, None)}),
+        ("cars since 2015 onwards", {"year": (2015, None)}),
+        ("anything from $8000", {"price": (8000, None)}),
+        ("cars from 20000 km", {"km": (20000, None)}),
+        ("between 10 and 20 mil dollars", {"price": (10000, 20000)}),
+        ("between 10k and 20", {"price": (10000, 20000)}),
+    ],
+)
+def test_ranges(table, question, ranges):
+    assert parse_stock_query(question, table).ranges == ranges
+
+
+def test_only_filtered_questions_skip_the_vector_retriever(table):
+    fallback = StaticRetriever()
+    counters = {"structured": 0, "fallback": 0, "query_seconds": 0.0}
+    retriever = StructuredStockRetriever(table=table, fallback=fallback, counters=counters)
+
+    structured = retriever.invoke("Toyota under 15000")
+    faq = retriever.invoke("What financing options do you have for a Toyota?")
+
+    assert structured[0].page_content.startswith("1 vehicles in stock match")
+    assert faq == fallback.invoke("What financing options do you have for a Toyota?")
+    assert retriever.stats()["structured"] == 1
+    assert retriever.stats()["fallback"] == 1
+
+
+def test_a_new_index_version_is_loaded_in_the_background(table, tmp_path, monkeypatch):
+    path = str(tmp_path / "stock.npz")
+    table.save(path)
+    loaded = StockTable.load(path)
+    loaded.version_check_interval = 0.0
+    StockTable({name: values[:1] for name, values in table._raw.items()}).save(path)
+    queried = threading.Event()
+
+    def new_version():
+        queried.wait()
+        return "2"
+
+    monkeypatch.setattr(stock_table, "get_index_version", new_version)
+
+    # The query that notices the new version does not wait for the reload
+    assert len(loaded.query()) == 3
+    queried.set()
+    loaded._reload_thread.join()
+
+    assert len(loaded.query()) == 1
+    assert loaded.stats()["reload_errors"] == 0
@@ -0,0 +1,87 @@
+"""Progressive Telegram edits against a fake Bot API."""
+
+import httpx
+import pytest
+
+from chatbot_api.channels import telegram
+
+
+class FakeBotApi:
+    """Records Bot API calls and answers them from a list of status codes."""
+
+    def __init__(self, edit_statuses=()):
+        self.calls = []
+        self.edit_statuses = list(edit_statuses)
+
+    async def __call__(self, bot_token, method, payload):
+        self.calls.append((method, payload))
+        request = httpx.Request("POST", f"https://api.telegram.org/bot/{method}")
+        if method == "sendMessage":
+            return httpx.Response(200, json={"ok": True, "result": {"message_id": 7}}, request=request)
+        status = self.edit_statuses.pop(0) if self.edit_statuses else 200
+        return httpx.Response(status, json={"ok": status == 200}, request=request)
+
+    def edits(self):
+        return [payload for method, payload in self.calls if method == "editMessageText"]
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.fixture
+def bot_api(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "token")
+    api = FakeBotApi()
+    monkeypatch.setattr(telegram, "_call_telegram_api", api)
+    return api
+
+
+@pytest.mark.anyio
+async def test_final_edit_uses_html_even_when_nothing_new_arrived(bot_api):
+    # Every chunk is applied right away, so the last intermediate edit already
+    # holds the full text
+    text, status = await telegram.stream_telegram_message(
+        1, chunks("<b>Corolla</b>", " 2020"), edit_interval=0
+    )
+
+    assert text == "<b>Corolla</b> 2020"
+    assert status["status"] == "success"
+    assert "parse_mode" not in bot_api.edits()[0]
+    assert bot_api.edits()[-1] == {
+        "chat_id": 1,
+        "message_id": 7,
+        "text": "<b>Corolla</b> 2020",
+        "parse_mode": "HTML",
+    }
+
+
+@pytest.mark.anyio
+async def test_failed_intermediate_edit_is_not_taken_as_sent(bot_api):
+    bot_api.edit_statuses = [500]
+    text, status = await telegram.stream_telegram_message(
+        1, chunks("Hola", " mundo"), edit_interval=0
+    )
+
+    assert status["status"] == "success"
+    assert [edit["text"] for edit in bot_api.edits()] == ["Hola mundo", "Hola mundo"]
+    assert bot_api.edits()[-1]["parse_mode"] == "HTML"
+
+
+@pytest.mark.anyio
+async def test_unchanged_final_edit_counts_as_delivered(bot_api, monkeypatch):
+    async def not_modified(bot_token, method, payload):
+        response = await FakeBotApi.__call__(bot_api, bot_token, method, payload)
+        if method == "editMessageText" and "parse_mode" in payload:
+            return httpx.Response(
+                400,
+                json={"ok": False, "description": "Bad Request: message is not modified"},
+                request=response.request,
+            )
+        return response
+
+    monkeypatch.setattr(telegram, "_call_telegram_api", not_modified)
+    _, status = await telegram.stream_telegram_message(1, chunks("Hola"), edit_interval=0)
+
+    assert status["status"] == "success"
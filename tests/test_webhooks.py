@@ -0,0 +1,88 @@
+"""Concurrency of the webhook handlers with a fixed-latency fake LLM."""
+
+import asyncio
+import time
+import uuid
+
+import httpx
+import pytest
+
+import chatbot_api.main as main
+from chatbot_api.chains.chain import create_chain
+from tests.fakes import FakeChatModel, StaticRetriever
+
+LATENCY = 0.5
+CONCURRENCY = 10
+
+
+@pytest.fixture
+def app(monkeypatch):
+    llm = FakeChatModel(responses=["Tenemos un Corolla 2020."], latency=LATENCY)
+    monkeypatch.setattr(
+        main, "answer_chain", create_chain(llm, StaticRetriever(), prompt_budget=main.prompt_budget)
+    )
+    return main.app
+
+
+async def post_webhooks(app, count: int) -> float:
+    """Post one message from each of count new senders at once, returning the seconds taken."""
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        started_at = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/webhook", data={"From": f"+{uuid.uuid4().int}", "Body": "Hola"})
+            for _ in range(count)
+        ])
+        elapsed = time.perf_counter() - started_at
+    assert [response.status_code for response in responses] == [200] * count
+    assert all("Corolla" in response.text for response in responses)
+    return elapsed
+
+
+@pytest.mark.anyio
+async def test_concurrent_webhooks_overlap_their_llm_calls(app):
+    # The first request builds the chain
+    await post_webhooks(app, 1)
+    single = await post_webhooks(app, 1)
+
+    concurrent = await post_webhooks(app, CONCURRENCY)
+
+    assert single >= LATENCY
+    # Handled one after another this would take CONCURRENCY times as long. The
+    # requests still share the event loop for the chain's own CPU work, mostly
+    # langchain_core serializing every runnable step for the callbacks.
+    assert concurrent < CONCURRENCY * single / 2, (
+        f"{CONCURRENCY} concurrent webhooks took {concurrent:.2f}s, one took {single:.2f}s"
+    )
+
+
+@pytest.mark.anyio
+async def test_telegram_webhooks_run_concurrently(app, monkeypatch):
+    sent = []
+
+    async def fake_send(chat_id, text):
+        sent.append((chat_id, text))
+        return {"status": "success"}
+
+    monkeypatch.setattr(main, "send_telegram_message", fake_send)
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        started_at = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post(
+                "/telegram-webhook",
+                json={
+                    "update_id": uuid.uuid4().int % 2**31,
+                    "message": {"chat": {"id": chat_id}, "text": "Hola"},
+                },
+            )
+            for chat_id in range(CONCURRENCY)
+        ])
+        elapsed = time.perf_counter() - started_at
+
+    assert [response.json() for response in responses] == [{"status": "success"}] * CONCURRENCY
+    assert sorted(chat_id for chat_id, _ in sent) == list(range(CONCURRENCY))
+    # One after another this would take at least CONCURRENCY * LATENCY
+    assert elapsed < CONCURRENCY * LATENCY / 2
@@ -0,0 +1,202 @@
+"""Background worker pool and the async Twilio reply mode with a fake sender."""
+
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+import chatbot_api.main as main
+from chatbot_api.chains.chain import create_chain
+from chatbot_api.channels import LoggingSender, OutboundSender
+from chatbot_api.workers import IdempotencyStore, WorkerPool
+from tests.fakes import FakeChatModel, StaticRetriever
+
+
+@pytest.mark.anyio
+async def test_pool_queues_up_to_its_size_and_rejects_the_rest():
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(job):
+        await release.wait()
+        handled.append(job)
+
+    pool = WorkerPool(handler, num_workers=1, max_queue_size=2)
+    pool.start()
+    assert pool.submit(1)
+    # Let the worker take the first job, the next two wait in the queue
+    await asyncio.sleep(0)
+    assert pool.submit(2)
+    assert pool.submit(3)
+    assert not pool.submit(4)
+
+    stats = pool.stats()
+    assert stats["in_flight"] == 1
+    assert stats["queue_size"] == 2
+    assert stats["max_queue_depth_seen"] == 2
+    assert stats["rejected"] == 1
+
+    release.set()
+    await pool.drain(timeout=1)
+    assert handled == [1, 2, 3]
+    assert pool.stats()["completed"] == 3
+    assert not pool.submit(5)
+
+
+@pytest.mark.anyio
+async def test_pool_counts_failed_jobs_and_keeps_working():
+    handled = []
+
+    async def handler(job):
+        if job == "bad":
+            raise RuntimeError("boom")
+        handled.append(job)
+
+    pool = WorkerPool(handler, num_workers=1, max_queue_size=10)
+    pool.start()
+    for job in ("good", "bad", "good"):
+        assert pool.submit(job)
+    await pool.drain(timeout=1)
+
+    assert handled == ["good", "good"]
+    stats = pool.stats()
+    assert stats["completed"] == 2
+    assert stats["failed"] == 1
+
+
+@pytest.mark.anyio
+async def test_drain_cancels_jobs_still_running_after_the_timeout():
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def handler(job):
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    pool = WorkerPool(handler, num_workers=1, max_queue_size=10)
+    pool.start()
+    pool.submit("slow")
+    await started.wait()
+    await pool.drain(timeout=0.05)
+
+    assert cancelled.is_set()
+    assert not pool.running
+
+
+class FailingSender(OutboundSender):
+    """Fake sender whose provider rejects every message."""
+
+    def __init__(self):
+        self.attempts = 0
+
+    async def send(self, to, text, from_=None):
+        self.attempts += 1
+        raise RuntimeError("provider rejected the message")
+
+
+@pytest.fixture
+def llm():
+    return FakeChatModel(responses=["Tenemos un Corolla 2020."], latency=0.05)
+
+
+@pytest.fixture
+def async_replies(monkeypatch, llm):
+    """Switch the Twilio webhook to async replies through a fake sender."""
+    monkeypatch.setattr(main, "answer_chain", create_chain(llm, StaticRetriever()))
+    monkeypatch.setattr(main, "idempotency_store", IdempotencyStore())
+    monkeypatch.setattr(main, "outbound_sender", LoggingSender())
+    pool = WorkerPool(main.process_twilio_reply_job, num_workers=2, max_queue_size=10)
+    monkeypatch.setattr(main, "twilio_reply_pool", pool)
+    return pool
+
+
+@pytest.fixture
+def sender():
+    # A new conversation, so the question is not rephrased with an earlier history
+    return f"+{uuid.uuid4().int % 10**12}"
+
+
+async def wait_for_stat(pool, key, value, timeout=5):
+    async def poll():
+        while pool.stats()[key] != value:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def post_webhook(message_sid, sender):
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=main.app), base_url="http://test"
+    ) as client:
+        return await client.post(
+            "/webhook",
+            data={"From": sender, "To": "+14150000000", "Body": "Hola", "MessageSid": message_sid},
+        )
+
+
+@pytest.mark.anyio
+async def test_webhook_acknowledges_and_replies_through_the_sender(async_replies, llm, sender):
+    async_replies.start()
+    response = await post_webhook("SM1", sender)
+
+    # Acknowledged with an empty TwiML response before the answer is ready
+    assert response.status_code == 200
+    assert "<Message>" not in response.text
+    assert main.outbound_sender.sent == []
+
+    await async_replies.drain(timeout=5)
+    assert main.outbound_sender.sent == [(sender, "Tenemos un Corolla 2020.")]
+    assert llm.calls == 1
+
+
+@pytest.mark.anyio
+async def test_webhook_retry_does_not_answer_twice(async_replies, llm, sender):
+    async_replies.start()
+    await post_webhook("SM2", sender)
+    retry = await post_webhook("SM2", sender)
+    await async_replies.drain(timeout=5)
+
+    assert "<Message>" not in retry.text
+    assert len(main.outbound_sender.sent) == 1
+    assert llm.calls == 1
+    assert main.idempotency_store.stats()["duplicates"] == 1
+
+
+@pytest.mark.anyio
+async def test_failed_reply_is_counted_and_retry_runs_again(async_replies, llm, sender, monkeypatch):
+    monkeypatch.setattr(main, "outbound_sender", FailingSender())
+    llm.error = "provider down"
+    async_replies.start()
+    await post_webhook("SM3", sender)
+    await wait_for_stat(async_replies, "failed", 1)
+
+    # The chain failed: nothing was sent and the message ID was forgotten
+    assert async_replies.stats()["failed"] == 1
+    assert main.outbound_sender.attempts == 0
+
+    llm.error = None
+    await post_webhook("SM3", sender)
+    await async_replies.drain(timeout=5)
+
+    # The retry answered, but the provider rejected the reply
+    assert llm.calls == 2
+    assert main.outbound_sender.attempts == 1
+    assert async_replies.stats()["failed"] == 2
+
+
+@pytest.mark.anyio
+async def test_full_queue_answers_inline(async_replies, llm, sender):
+    async_replies.max_queue_size = 1
+    async_replies.num_workers = 0
+    async_replies.start()
+    await post_webhook(f"SM{uuid.uuid4().hex}", sender)
+    inline = await post_webhook(f"SM{uuid.uuid4().hex}", sender + "1")
+
+    assert "Tenemos un Corolla 2020." in inline.text
+    assert async_replies.stats()["rejected"] == 1
+    await async_replies.drain(timeout=0.05)